@@ -1,17 +1,29 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
+import glob
+import hashlib
+import json
 import os
 import pytest
 import re
+import threading
+from typing import cast
+from typing import Any
 from typing import TYPE_CHECKING
 
 import pytest_codecov.git as git
-import pytest_codecov.codecov as codecov
 
 if TYPE_CHECKING:
+    # NOTE: The upload machinery pulls in requests, multiprocessing and
+    #       friends, so we only import it once we actually need it, the
+    #       plugin may be installed without being enabled
+    import pytest_codecov.codecov as codecov
+    from collections.abc import Iterable
     from coverage import Coverage
     from pytest_cov.plugin import CovPlugin  # type: ignore[import-untyped]
+    from pytest_codecov.codecov import CompressionLevel
 
 
 __version__ = '0.7.0'
@@ -21,6 +33,13 @@ token_regex = re.compile(
 slug_regex = re.compile(
     r'^[0-9a-zA-Z_.-]+/[0-9a-zA-Z_.-]+$'
 )
+flag_regex = re.compile(
+    r'^[\w.-]{1,45}$'
+)
+# NOTE: We remember the digests of the most recent successful uploads,
+#       so reruns of the same commit can skip identical uploads
+upload_cache_key = 'codecov/uploads'
+upload_cache_size = 16
 
 
 def validate_token(arg: str) -> str:
@@ -37,6 +56,130 @@ def validate_slug(arg: str) -> str:
     return arg
 
 
+def validate_flag(arg: str) -> str:
+    if not flag_regex.match(arg):
+        msg = 'Invalid flag supplied.'
+        raise argparse.ArgumentTypeError(msg)
+    return arg
+
+
+def validate_compression_level(arg: str) -> CompressionLevel:
+    if arg == 'auto':
+        return 'auto'
+    if not arg.isdigit() or not 0 <= int(arg) <= 9:
+        msg = 'Invalid compression level supplied, use 0-9 or auto.'
+        raise argparse.ArgumentTypeError(msg)
+    return int(arg)
+
+
+def validate_workers(arg: str) -> int:
+    if not arg.isdigit() or int(arg) < 1:
+        msg = 'Invalid number of workers supplied.'
+        raise argparse.ArgumentTypeError(msg)
+    return int(arg)
+
+
+def validate_max_message_length(arg: str) -> int:
+    if not arg.isdigit():
+        msg = 'Invalid maximum message length supplied.'
+        raise argparse.ArgumentTypeError(msg)
+    return int(arg)
+
+
+def get_compression_level(config: pytest.Config) -> CompressionLevel:
+    level = config.option.codecov_compression_level
+    if level is not None:
+        return level  # type: ignore[no-any-return]
+    try:
+        return validate_compression_level(
+            config.getini('codecov_compression_level')
+        )
+    except argparse.ArgumentTypeError as exc:
+        raise pytest.UsageError(str(exc)) from None
+
+
+def get_compression_workers(config: pytest.Config) -> int:
+    workers = config.option.codecov_compression_workers
+    if workers is not None:
+        return workers  # type: ignore[no-any-return]
+    try:
+        return validate_workers(config.getini('codecov_compression_workers'))
+    except argparse.ArgumentTypeError as exc:
+        raise pytest.UsageError(str(exc)) from None
+
+
+def expand_globs(patterns: list[str]) -> list[str]:
+    files: dict[str, None] = {}
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            if os.path.isfile(path):
+                files[os.path.normpath(path)] = None
+    return list(files)
+
+
+def report_filename(path: str) -> str:
+    """ Returns the name a report file is embedded under, which is its
+    POSIX path relative to the current directory, or just its base name
+    if it lies outside of it.
+
+    """
+    try:
+        filename = os.path.relpath(path)
+    except ValueError:
+        # NOTE: On Windows the path may be on a different drive
+        return os.path.basename(path)
+
+    if filename == os.pardir or filename.startswith(os.pardir + os.sep):
+        return os.path.basename(path)
+    return filename.replace(os.sep, '/')
+
+
+def get_path_matcher(config: pytest.Config) -> git.PathMatcher:
+    option = config.option
+    return git.PathMatcher(
+        exclude=[
+            *config.getini('codecov_network_exclude'),
+            *option.codecov_network_exclude
+        ],
+        include=[
+            *config.getini('codecov_network_include'),
+            *option.codecov_network_include
+        ],
+    )
+
+
+def get_compressed_network(config: pytest.Config) -> bytes:
+    """ Returns the compressed network section, the result is cached
+    for as long as the git tree and index stay the same.
+
+    """
+    import pytest_codecov.codecov as codecov
+
+    level = get_compression_level(config)
+    matcher = get_path_matcher(config)
+    cache: pytest.Cache | None = getattr(config, 'cache', None)
+    key = None if cache is None else git.ls_files_key()
+    if cache is None or key is None:
+        return codecov.compress_network(git.ls_files(matcher), level)
+
+    # NOTE: The listing also depends on the configured globs
+    key = hashlib.sha256(f'{key}\0{matcher.fingerprint}'.encode()).hexdigest()
+    directory = cache.mkdir('codecov-network')
+    path = directory / f'{key}.gz'
+    with contextlib.suppress(OSError):
+        return path.read_bytes()
+
+    gz_network = codecov.compress_network(git.ls_files(matcher), level)
+    with contextlib.suppress(OSError):
+        # NOTE: We only keep the listing for the current tree around
+        for stale in directory.glob('*.gz'):
+            stale.unlink()
+        tmp_path = directory / f'.{key}.{os.getpid()}'
+        tmp_path.write_bytes(gz_network)
+        os.replace(tmp_path, path)
+    return gz_network
+
+
 def pytest_addoption(
     parser: pytest.Parser,
     pluginmanager: pytest.PytestPluginManager
@@ -62,7 +205,7 @@ def pytest_addoption(
         '--codecov-slug',
         action='store',
         dest='codecov_slug',
-        default=os.environ.get('CODECOV_SLUG') or git.slug,
+        default=os.environ.get('CODECOV_SLUG') or None,
         metavar='SLUG',
         type=validate_slug,
         help='Set the git repository slug manually.'
@@ -71,16 +214,25 @@ def pytest_addoption(
         '--codecov-branch',
         action='store',
         dest='codecov_branch',
-        default=os.environ.get('CODECOV_BRANCH') or git.branch,
+        default=os.environ.get('CODECOV_BRANCH') or None,
         help='Set the git branch manually.'
     )
     group.addoption(
         '--codecov-commit',
         action='store',
         dest='codecov_commit',
-        default=os.environ.get('CODECOV_COMMIT') or git.commit,
+        default=os.environ.get('CODECOV_COMMIT') or None,
         help='Set the git commit hash manually.'
     )
+    group.addoption(
+        '--codecov-flag',
+        action='append',
+        dest='codecov_flags',
+        default=[],
+        metavar='FLAG',
+        type=validate_flag,
+        help='Add a flag to the upload, can be given multiple times.'
+    )
     group.addoption(
         '--codecov-dump',
         action='store_true',
@@ -102,10 +254,435 @@ def pytest_addoption(
         default=True,
         help="Don't upload the junit xml file"
     )
+    group.addoption(
+        '--codecov-report-file',
+        action='append',
+        dest='codecov_report_files',
+        default=[],
+        metavar='GLOB',
+        help='Include existing coverage reports matching this glob in the '
+             'upload, can be given multiple times.'
+    )
+    group.addoption(
+        '--codecov-junit-file',
+        action='append',
+        dest='codecov_junit_files',
+        default=[],
+        metavar='GLOB',
+        help='Include additional junit xml files matching this glob in the '
+             'upload, can be given multiple times.'
+    )
+    group.addoption(
+        '--codecov-junit-slim',
+        action='store_true',
+        dest='codecov_junit_slim',
+        default=False,
+        help='Strip captured output and properties from the junit xml file '
+             'and truncate failure messages before uploading it.'
+    )
+    group.addoption(
+        '--codecov-junit-max-message-length',
+        action='store',
+        dest='codecov_junit_max_message_length',
+        default=1000,
+        metavar='LENGTH',
+        type=validate_max_message_length,
+        help='Truncate failure messages in the slimmed junit xml file to '
+             'this many characters.'
+    )
+    group.addoption(
+        '--codecov-network-measured-only',
+        action='store_true',
+        dest='codecov_network_measured_only',
+        default=False,
+        help='Only list the files that were measured by coverage in the '
+             'network section of the report.'
+    )
+    group.addoption(
+        '--codecov-network-include',
+        action='append',
+        dest='codecov_network_include',
+        default=[],
+        metavar='GLOB',
+        help='Always list the files matching this glob in the network '
+             'section, can be given multiple times.'
+    )
+    group.addoption(
+        '--codecov-network-exclude',
+        action='append',
+        dest='codecov_network_exclude',
+        default=[],
+        metavar='GLOB',
+        help="Don't list the files matching this glob in the network "
+             'section, can be given multiple times.'
+    )
+    group.addoption(
+        '--codecov-diff-base',
+        action='store',
+        dest='codecov_diff_base',
+        default=None,
+        metavar='REF',
+        help='Only report the files which changed since the merge base of '
+             'the current commit and this git ref, e.g. for pull requests.'
+    )
+    group.addoption(
+        '--codecov-report-format',
+        action='store',
+        dest='codecov_report_format',
+        default='xml',
+        choices=('xml', 'json'),
+        help='Upload the coverage as a coverage.py XML report (default) or '
+             "in Codecov's JSON format, which is faster to generate for "
+             'large projects.'
+    )
+    group.addoption(
+        '--codecov-report-workers',
+        action='store',
+        dest='codecov_report_workers',
+        default=1,
+        metavar='WORKERS',
+        type=validate_workers,
+        help='Generate the JSON report in this many processes, the XML '
+             'report is always generated in a single process.'
+    )
+    group.addoption(
+        '--codecov-compression-level',
+        action='store',
+        dest='codecov_compression_level',
+        default=None,
+        metavar='LEVEL',
+        type=validate_compression_level,
+        help='Set the gzip compression level (0-9) for the upload or "auto" '
+             'to pick one based on the size of the payload.'
+    )
+    group.addoption(
+        '--codecov-compression-workers',
+        action='store',
+        dest='codecov_compression_workers',
+        default=None,
+        metavar='WORKERS',
+        type=validate_workers,
+        help='Compress large payloads in parallel chunks using this many '
+             'threads.'
+    )
+    group.addoption(
+        '--codecov-retries',
+        action='store',
+        dest='codecov_retries',
+        default=2,
+        metavar='RETRIES',
+        type=int,
+        help='How many times failed requests to codecov are retried.'
+    )
+    group.addoption(
+        '--codecov-retry-backoff',
+        action='store',
+        dest='codecov_retry_backoff',
+        default=1.0,
+        metavar='SECONDS',
+        type=float,
+        help='Initial delay between retries, which doubles on each retry.'
+    )
+    group.addoption(
+        '--codecov-spool',
+        action='store',
+        dest='codecov_spool',
+        default=None,
+        metavar='DIRECTORY',
+        help='Write the prepared reports to this directory instead of '
+             'uploading them, use pytest-codecov-drain to upload them later.'
+    )
+    group.addoption(
+        '--codecov-shard',
+        action='store',
+        dest='codecov_shard',
+        default=None,
+        metavar='DIRECTORY',
+        help='Write the coverage data of this shard to a shared directory '
+             'instead of uploading it, use pytest-codecov-combine to '
+             'upload all shards as a single report.'
+    )
+    group.addoption(
+        '--codecov-force-upload',
+        action='store_true',
+        dest='codecov_force_upload',
+        default=False,
+        help='Upload the reports even if identical reports were already '
+             'uploaded from this checkout.'
+    )
+    group.addoption(
+        '--codecov-profile',
+        action='store',
+        dest='codecov_profile',
+        default=None,
+        metavar='PATH',
+        help='Write the duration and size of each phase of the upload to '
+             'this file as JSON.'
+    )
+    group.addoption(
+        '--codecov-background',
+        action='store_true',
+        dest='codecov_background',
+        default=False,
+        help='Prepare and upload the report in the background while the '
+             'rest of the session finishes.'
+    )
+    group.addoption(
+        '--codecov-background-timeout',
+        action='store',
+        dest='codecov_background_timeout',
+        default=300.0,
+        metavar='SECONDS',
+        type=float,
+        help='How long to wait for a background upload to finish.'
+    )
+    parser.addini(
+        'codecov_compression_level',
+        default='auto',
+        help='Default gzip compression level (0-9 or auto) for the upload.'
+    )
+    parser.addini(
+        'codecov_compression_workers',
+        default='1',
+        help='Default number of threads used to compress large payloads.'
+    )
+    parser.addini(
+        'codecov_network_exclude',
+        type='linelist',
+        default=[],
+        help="Globs of files which shouldn't be listed in the network "
+             'section.'
+    )
+    parser.addini(
+        'codecov_network_include',
+        type='linelist',
+        default=[],
+        help='Globs of files which should always be listed in the network '
+             'section.'
+    )
+
+
+class BufferedReporter:
+    """ Records terminal output, so it can be replayed later on. """
+
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, tuple[Any, ...], dict[str, Any]]] = []
+
+    def section(self, *args: Any, **kwargs: Any) -> None:
+        self.calls.append(('section', args, kwargs))
+
+    def line(self, *args: Any, **kwargs: Any) -> None:
+        self.calls.append(('line', args, kwargs))
+
+    def write_line(self, *args: Any, **kwargs: Any) -> None:
+        self.calls.append(('write_line', args, kwargs))
+
+    def replay(self, terminalreporter: pytest.TerminalReporter) -> None:
+        for name, args, kwargs in list(self.calls):
+            getattr(terminalreporter, name)(*args, **kwargs)
+
+
+class CodecovWorkerPlugin:
+    """ Prepares parts of the payload on a pytest-xdist worker, so the
+    controller doesn't have to do it serially once all workers finished.
+
+    The network section is listed and compressed in a background thread
+    while the worker runs its tests, the result is sent to the controller
+    through the worker output.
+
+    """
+
+    def __init__(self) -> None:
+        self._thread: threading.Thread | None = None
+        self._compressed_network: bytes | None = None
+
+    def prepare_network(self, config: pytest.Config) -> None:
+        # NOTE: If anything goes wrong the controller just lists the
+        #       files itself, so we never fail the worker because of it
+        with contextlib.suppress(Exception):
+            self._compressed_network = get_compressed_network(config)
+
+    def pytest_sessionstart(self, session: pytest.Session) -> None:
+        # NOTE: Listing the files is mostly spent in git and zlib, which
+        #       release the GIL, so this barely slows down the tests
+        self._thread = threading.Thread(
+            target=self.prepare_network,
+            args=(session.config,),
+            name='codecov-network',
+            daemon=True,
+        )
+        self._thread.start()
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_sessionfinish(self, session: pytest.Session) -> None:
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        config = session.config
+        if self._compressed_network is not None:
+            workeroutput = config.workeroutput  # type: ignore[attr-defined]
+            workeroutput['codecov_network'] = self._compressed_network
 
 
 class CodecovPlugin:
 
+    def __init__(self) -> None:
+        self._background_thread: threading.Thread | None = None
+        self._background_reporter: BufferedReporter | None = None
+        self._compressed_network: bytes | None = None
+
+    def resolve_git_metadata(self, option: argparse.Namespace) -> None:
+        # NOTE: We only query git once we actually need the metadata, so
+        #       pytest runs without --codecov don't pay for repo detection
+        if option.codecov_slug is None:
+            slug = git.slug
+            if slug and slug_regex.match(slug):
+                option.codecov_slug = slug
+        if option.codecov_branch is None:
+            option.codecov_branch = git.branch
+        if option.codecov_commit is None:
+            option.codecov_commit = git.commit
+
+    def filter_network(
+        self,
+        config: pytest.Config,
+        files: Iterable[str],
+        gz_network: bytes
+    ) -> bytes:
+        import pytest_codecov.codecov as codecov
+
+        # NOTE: We filter the full listing, so it can still be shared
+        #       with the cache and the xdist workers, which don't know
+        #       which files will end up in the combined coverage data
+        measured_files = codecov.MeasuredFiles(
+            files,
+            get_path_matcher(config).include
+        )
+        return codecov.compress_network(
+            (
+                path
+                for path in codecov.decompress_network(gz_network)
+                if path in measured_files
+            ),
+            get_compression_level(config)
+        )
+
+    def changed_measured_files(
+        self,
+        cov: Coverage,
+        changed_files: git.ChangedFiles
+    ) -> list[str]:
+        changed = {
+            os.path.normcase(os.path.join(changed_files.root, path))
+            for path in changed_files.paths
+        }
+        return [
+            path
+            for path in cov.get_data().measured_files()
+            if os.path.normcase(os.path.realpath(path)) in changed
+        ]
+
+    def write_compression_stats(
+        self,
+        terminalreporter: pytest.TerminalReporter,
+        uploader: codecov.CodecovUploader
+    ) -> None:
+        stats = uploader.compression_stats
+        if stats is None:
+            return
+
+        threads = ''
+        if stats.workers > 1:
+            threads = f' using {stats.workers} threads'
+        terminalreporter.write_line(
+            f'Compressed payload from {stats.raw_size} to '
+            f'{stats.compressed_size} bytes ({stats.ratio:.1%}) '
+            f'at level {stats.level} in {stats.seconds:.2f}s'
+            f'{threads}.'
+        )
+
+    def write_profile(
+        self,
+        terminalreporter: pytest.TerminalReporter,
+        config: pytest.Config,
+        profile: codecov.UploadProfile
+    ) -> None:
+        option = config.option
+        terminalreporter.write_line(f'Profile: {profile.summary()}.')
+        if not option.codecov_profile:
+            return
+
+        data = {
+            'version': __version__,
+            'slug': option.codecov_slug,
+            'branch': option.codecov_branch,
+            'commit': option.codecov_commit,
+            **profile.as_dict(),
+        }
+        try:
+            with open(option.codecov_profile, 'w') as fp:
+                json.dump(data, fp, indent=2)
+        except OSError as exc:
+            terminalreporter.write_line(
+                f'WARNING: Failed to write profile: {exc}',
+                yellow=True,
+                bold=True,
+            )
+
+    def write_shard(
+        self,
+        terminalreporter: pytest.TerminalReporter,
+        config: pytest.Config,
+        cov: Coverage
+    ) -> None:
+        import pytest_codecov.shard as shard
+
+        option = config.option
+        terminalreporter.section('Codecov.io shard')
+        xmlpath = option.xmlpath if option.codecov_junit_xml else None
+        if not xmlpath or not os.path.isfile(xmlpath):
+            xmlpath = None
+
+        report_files = expand_globs(option.codecov_report_files)
+        junit_files = expand_globs(option.codecov_junit_files)
+        try:
+            path = shard.write_shard(
+                cov,
+                option.codecov_shard,
+                xmlpath,
+                report_files=[
+                    (report, report_filename(report))
+                    for report in report_files
+                ],
+                junit_files=[
+                    (junit, report_filename(junit))
+                    for junit in junit_files
+                ],
+            )
+        except OSError as exc:
+            terminalreporter.write_line(
+                f'ERROR: Failed to write shard: {exc}',
+                red=True,
+                bold=True,
+            )
+            return
+
+        terminalreporter.write_line(
+            f'Wrote coverage data to {path}, use pytest-codecov-combine to '
+            'upload all shards.',
+            green=True
+        )
+        for path in report_files:
+            terminalreporter.write_line(
+                f'Report file {path} included in shard.'
+            )
+        for path in junit_files:
+            terminalreporter.write_line(
+                f'JUnit XML file {path} included in shard.'
+            )
+        terminalreporter.line('')
+
     def upload_report(
         self,
         terminalreporter: pytest.TerminalReporter,
@@ -113,39 +690,142 @@ class CodecovPlugin:
         cov: Coverage
     ) -> None:
         option = config.option
+        if option.codecov_shard:
+            self.write_shard(terminalreporter, config, cov)
+            return
+
+        import pytest_codecov.codecov as codecov
+
+        profile = codecov.UploadProfile()
+        with profile.measure('git'):
+            self.resolve_git_metadata(option)
         uploader = codecov.CodecovUploader(
             option.codecov_slug,
             commit=option.codecov_commit,
             branch=option.codecov_branch,
             token=option.codecov_token,
+            compression_level=get_compression_level(config),
+            compression_workers=get_compression_workers(config),
+            retry_policy=codecov.RetryPolicy(
+                attempts=option.codecov_retries + 1,
+                backoff=option.codecov_retry_backoff,
+            ),
+            flags=option.codecov_flags,
+            profile=profile,
         )
-        uploader.add_network_files(git.ls_files())
-        from coverage.exceptions import CoverageException
-        try:
-            uploader.add_coverage_report(cov)
-        except CoverageException as exc:
-            terminalreporter.section('Codecov.io payload')
+        with profile.measure('network'):
+            gz_network = self._compressed_network or get_compressed_network(
+                config
+            )
+            if option.codecov_network_measured_only:
+                gz_network = self.filter_network(
+                    config,
+                    cov.get_data().measured_files(),
+                    gz_network
+                )
+
+        morfs = None
+        changed_files = None
+        if option.codecov_diff_base:
+            with profile.measure('diff'):
+                changed_files = git.changed_files(option.codecov_diff_base)
+        if changed_files is not None:
+            morfs = self.changed_measured_files(cov, changed_files)
+
+        # NOTE: Coverage reports every measured file for an empty list,
+        #       so there's no coverage to upload in that case, but the
+        #       test results are still worth uploading
+        skip_coverage = morfs is not None and not morfs
+        if changed_files is not None and not skip_coverage:
+            with profile.measure('network'):
+                gz_network = self.filter_network(
+                    config,
+                    changed_files.paths,
+                    gz_network
+                )
+        report_files = []
+        if not skip_coverage:
+            profile.add('network', size=len(gz_network))
+            uploader.add_compressed_network(gz_network)
+            from coverage.exceptions import CoverageException
+            report_format = option.codecov_report_format
+            try:
+                if report_format == 'json':
+                    uploader.add_json_coverage_report(
+                        cov,
+                        workers=option.codecov_report_workers,
+                        morfs=morfs
+                    )
+                else:
+                    uploader.add_coverage_report(cov, morfs=morfs)
+            except CoverageException as exc:
+                terminalreporter.section('Codecov.io payload')
+                terminalreporter.write_line(
+                    'ERROR: Failed to generate '
+                    f'{report_format.upper()} report: {exc}',
+                    red=True,
+                    bold=True,
+                )
+                terminalreporter.line('')
+                return
+
+            report_files = expand_globs(option.codecov_report_files)
+            for path in report_files:
+                uploader.add_report_file(path, filename=report_filename(path))
+
+        from xml.etree.ElementTree import ParseError  # noqa: S405
+        junit_warnings = []
+
+        def add_junit_xml(path: str, filename: str = 'junit.xml') -> bool:
+            # NOTE: A broken test results file shouldn't prevent the
+            #       upload of the coverage and the other test results
+            try:
+                uploader.add_junit_xml(
+                    path,
+                    filename=filename,
+                    slim=option.codecov_junit_slim,
+                    max_message_length=option.codecov_junit_max_message_length
+                )
+            except (ParseError, OSError) as exc:
+                junit_warnings.append(
+                    f'WARNING: Skipped JUnit XML file {path}: {exc}'
+                )
+                return False
+            return True
+
+        xmlpath = option.xmlpath if option.codecov_junit_xml else None
+        has_junit_xml = bool(
+            xmlpath
+            and os.path.isfile(xmlpath)
+            and add_junit_xml(xmlpath)
+        )
+        junit_files = [
+            path
+            for path in expand_globs(option.codecov_junit_files)
+            if add_junit_xml(path, report_filename(path))
+        ]
+
+        if skip_coverage and not (has_junit_xml or junit_files):
+            uploader.close()
+            terminalreporter.section('Codecov.io upload')
+            for warning in junit_warnings:
+                terminalreporter.write_line(warning, yellow=True, bold=True)
             terminalreporter.write_line(
-                f'ERROR: Failed to generate XML report: {exc}',
-                red=True,
-                bold=True,
+                'No measured files changed since '
+                f'{option.codecov_diff_base}, skipping upload.',
+                yellow=True
             )
             terminalreporter.line('')
             return
 
-        xmlpath = option.xmlpath if option.codecov_junit_xml else None
-        if xmlpath and os.path.isfile(xmlpath):
-            uploader.add_junit_xml(xmlpath)
-            has_junit_xml = True
-        else:
-            has_junit_xml = False
-
         if option.codecov_dump:
             terminalreporter.section('Prepared Codecov.io payload')
             terminalreporter.write_line(uploader.get_payload())
             return
 
         terminalreporter.section('Codecov.io upload')
+        for warning in junit_warnings:
+            terminalreporter.write_line(warning, yellow=True, bold=True)
 
         if not option.codecov_slug:
             terminalreporter.write_line(
@@ -168,6 +848,13 @@ class CodecovPlugin:
                 yellow=True,
                 bold=True,
             )
+        if option.codecov_diff_base and changed_files is None:
+            terminalreporter.write_line(
+                'WARNING: Failed to determine the files changed since '
+                f'{option.codecov_diff_base}, uploading the full report.',
+                yellow=True,
+                bold=True,
+            )
         if has_junit_xml and config.getini('junit_family') != 'legacy':
             terminalreporter.write_line(
                 'INFO: We recommend using junit_family=legacy with Codecov.',
@@ -175,62 +862,280 @@ class CodecovPlugin:
                 bold=True,
             )
 
+        flags = ''
+        if option.codecov_flags:
+            flags = f'Flags:  {",".join(option.codecov_flags)}\n'
         terminalreporter.write_line(
             'Environment:\n'
             f'Slug:   {option.codecov_slug}\n'
             f'Branch: {option.codecov_branch}\n'
             f'Commit: {option.codecov_commit}\n'
+            f'{flags}'
         )
+        for path in report_files:
+            terminalreporter.write_line(
+                f'Report file {path} included in upload.'
+            )
+        for path in junit_files:
+            terminalreporter.write_line(
+                f'JUnit XML file {path} included in upload.'
+            )
+        if report_files or junit_files:
+            terminalreporter.line('')
+        if skip_coverage:
+            terminalreporter.write_line(
+                'No measured files changed since '
+                f'{option.codecov_diff_base}, only uploading test results.\n'
+            )
+        elif morfs is not None:
+            terminalreporter.write_line(
+                f'Restricted report to {len(morfs)} measured file(s) '
+                f'changed since {option.codecov_diff_base}.\n'
+            )
         if has_junit_xml:
             terminalreporter.write_line(
                 'JUnit XML file detected and included in upload.\n'
             )
-        try:
-            terminalreporter.write_line('Pinging codecov API...')
-            uploader.ping()
-            terminalreporter.line('')
+        junit_stats = uploader.junit_stats
+        if junit_stats is not None:
             terminalreporter.write_line(
-                'Uploading reports to storage endpoint...'
+                f'Slimmed JUnit XML from {junit_stats.raw_size} to '
+                f'{junit_stats.slim_size} bytes, saved '
+                f'{junit_stats.saved} bytes.\n'
             )
-            uploader.upload()
+        if option.codecov_spool:
+            import pytest_codecov.spool as spool
+
+            # NOTE: The token isn't spooled, so if it wasn't taken from the
+            #       environment the drain can't find it on its own
+            token_env: str | None = None
+            env_token = os.environ.get('CODECOV_TOKEN') or None
+            if option.codecov_token == env_token:
+                token_env = 'CODECOV_TOKEN'  # noqa: S105
+            else:
+                terminalreporter.write_line(
+                    'WARNING: The token passed with --codecov-token is not '
+                    'spooled, pass it to pytest-codecov-drain with --token.',
+                    yellow=True,
+                    bold=True,
+                )
+            try:
+                path = spool.spool_report(
+                    uploader,
+                    option.codecov_spool,
+                    token_env=token_env,
+                    coverage=not skip_coverage
+                )
+            except OSError as exc:
+                terminalreporter.write_line(
+                    f'ERROR: Failed to spool reports: {exc}',
+                    red=True,
+                    bold=True,
+                )
+                return
+            finally:
+                uploader.close()
+
+            self.write_compression_stats(terminalreporter, uploader)
+            self.write_profile(terminalreporter, config, profile)
+            terminalreporter.write_line(
+                f'Spooled reports to {path}, use pytest-codecov-drain to '
+                'upload them.',
+                green=True
+            )
+            terminalreporter.line('')
+            return
+
+        cache = getattr(config, 'cache', None)
+        if cache is not None:
+            uploaded = cache.get(upload_cache_key, [])
+            digest = uploader.payload_digest()
+            if digest in uploaded and not option.codecov_force_upload:
+                uploader.close()
+                terminalreporter.write_line(
+                    'Identical reports were already uploaded, skipping '
+                    'upload. Use --codecov-force-upload to upload them '
+                    'anyway.',
+                    yellow=True
+                )
+                terminalreporter.line('')
+                return
+
+        terminalreporter.write_line(
+            'Pinging codecov API and uploading reports to storage endpoint...'
+        )
+        try:
+            errors = uploader.run_pipelines(coverage=not skip_coverage)
+        finally:
+            uploader.close()
+
+        if cache is not None and not any(errors.values()):
+            uploaded = [d for d in uploaded if d != digest]
+            uploaded.append(digest)
+            cache.set(upload_cache_key, uploaded[-upload_cache_size:])
+
+        self.write_compression_stats(terminalreporter, uploader)
+        self.write_profile(terminalreporter, config, profile)
+        for error in errors.values():
+            if error is not None:
+                terminalreporter.write_line(
+                    f'ERROR: {error}',
+                    red=True,
+                    bold=True
+                )
+
+        if errors['test results' if skip_coverage else 'coverage'] is None:
             terminalreporter.line('')
             terminalreporter.write_line(
                 'Successfully queued reports for processing.',
                 green=True
             )
             terminalreporter.line('')
-        except codecov.CodecovError as error:
-            terminalreporter.write_line(f'ERROR: {error}', red=True, bold=True)
 
-    @pytest.hookimpl(trylast=True)
-    def pytest_terminal_summary(
+    def get_coverage(
         self,
-        terminalreporter: pytest.TerminalReporter,
-        exitstatus: int,
-        config: pytest.Config
-    ) -> None:
+        config: pytest.Config,
+        exitstatus: int
+    ) -> Coverage | None:
+
         cov_plugin: CovPlugin | None = config.pluginmanager.get_plugin('_cov')
         if cov_plugin is None:
-            return
+            return None
 
         if cov_plugin.cov_controller is None:
-            return
+            return None
 
         cov: Coverage | None = cov_plugin.cov_controller.cov
         if cov is None:
-            return
+            return None
 
         if exitstatus != 0 and not config.option.codecov_upload_on_failure:
+            return None
+
+        return cov
+
+    def _background_upload(
+        self,
+        reporter: BufferedReporter,
+        config: pytest.Config,
+        cov: Coverage
+    ) -> None:
+        try:
+            self.upload_report(
+                cast('pytest.TerminalReporter', reporter),
+                config,
+                cov
+            )
+        except Exception as exc:
+            reporter.write_line(
+                f'ERROR: Background upload failed: {exc!r}',
+                red=True,
+                bold=True
+            )
+
+    def start_background_upload(
+        self,
+        config: pytest.Config,
+        cov: Coverage
+    ) -> None:
+        self._background_reporter = BufferedReporter()
+        self._background_thread = threading.Thread(
+            target=self._background_upload,
+            args=(self._background_reporter, config, cov),
+            name='codecov-upload',
+            daemon=True,
+        )
+        self._background_thread.start()
+
+    def join_background_upload(
+        self,
+        terminalreporter: pytest.TerminalReporter,
+        timeout: float | None
+    ) -> None:
+        thread = self._background_thread
+        reporter = self._background_reporter
+        if thread is None or reporter is None:
+            return
+
+        thread.join(timeout)
+        reporter.replay(terminalreporter)
+        if thread.is_alive():
+            terminalreporter.write_line(
+                'ERROR: Timed out waiting for background upload to finish.',
+                red=True,
+                bold=True,
+            )
+        self._background_thread = None
+        self._background_reporter = None
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node: Any, error: object) -> None:
+        workeroutput = getattr(node, 'workeroutput', None) or {}
+        compressed_network = workeroutput.get('codecov_network')
+        if compressed_network is not None:
+            self._compressed_network = compressed_network
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_sessionfinish(
+        self,
+        session: pytest.Session,
+        exitstatus: int
+    ) -> None:
+        # NOTE: pytest-cov finalizes the coverage data at the end of the
+        #       test loop, so we can start while the terminal summary and
+        #       the remaining teardown are still going on
+        config = session.config
+        if not config.option.codecov_background:
             return
 
-        self.upload_report(terminalreporter, config, cov)
+        cov = self.get_coverage(config, exitstatus)
+        if cov is not None:
+            self.start_background_upload(config, cov)
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_terminal_summary(
+        self,
+        terminalreporter: pytest.TerminalReporter,
+        exitstatus: int,
+        config: pytest.Config
+    ) -> None:
+        if config.option.codecov_background:
+            return
+
+        cov = self.get_coverage(config, exitstatus)
+        if cov is not None:
+            self.upload_report(terminalreporter, config, cov)
+
+    def pytest_unconfigure(self, config: pytest.Config) -> None:
+        terminalreporter = config.pluginmanager.get_plugin('terminalreporter')
+        if terminalreporter is None:
+            return
+
+        self.join_background_upload(
+            terminalreporter,
+            config.option.codecov_background_timeout
+        )
 
 
 def pytest_configure(config: pytest.Config) -> None:  # pragma: no cover
-    # NOTE: Don't report codecov results on worker nodes
-    if hasattr(config, 'workerinput'):
+    # NOTE: Don't report codecov results on worker nodes, but let the
+    #       first worker prepare the network section for the controller
+    workerinput = getattr(config, 'workerinput', None)
+    if workerinput is not None:
+        if (
+            config.option.codecov
+            and not config.option.codecov_shard
+            and workerinput.get('workerid') == 'gw0'
+        ):
+            config.option.codecov_compression_level = get_compression_level(
+                config
+            )
+            config.pluginmanager.register(CodecovWorkerPlugin())
         return
 
     # NOTE: if cov is missing we fail silently
     if config.option.codecov and config.pluginmanager.has_plugin('_cov'):
+        config.option.codecov_compression_level = get_compression_level(
+            config
+        )
         config.pluginmanager.register(CodecovPlugin())
@@ -1,19 +1,52 @@
 from __future__ import annotations
 
+import contextlib
+import fnmatch
 import gzip
+import hashlib
 import io
+import itertools
 import json
+import multiprocessing
+import os
+import random
+import re
 import requests
+import shutil
 import tempfile
+import threading
+import time
 import zlib
 from base64 import b64encode
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 from typing import Any
+from typing import IO
+from typing import NamedTuple
 from typing import TYPE_CHECKING
 from urllib.parse import urljoin
+from urllib.parse import urlsplit
+from xml.etree import ElementTree  # noqa: S405
+from xml.sax.saxutils import quoteattr
 
 if TYPE_CHECKING:
     from _typeshed import StrOrBytesPath
+    from collections.abc import Callable
+    from collections.abc import Generator
+    from collections.abc import Iterable
+    from collections.abc import Iterator
+    from concurrent.futures import Future
     from coverage import Coverage
+    from coverage import CoverageData
+    from coverage.plugin import FileReporter
+    from coverage.results import Analysis
+    from typing import Literal
+    from typing import Union
+
+    CompressionLevel = Union[int, Literal['auto']]
 
 
 def package() -> str:
@@ -25,69 +58,917 @@ class CodecovError(Exception):
     pass
 
 
+def create_session(
+    pool_connections: int = 2,
+    pool_maxsize: int = 4
+) -> requests.Session:
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def request_unsent(exc: requests.RequestException) -> bool:
+    """ Returns whether the request that failed with the given exception
+    is known to never have been sent to the server.
+
+    """
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    if not isinstance(exc, requests.ConnectionError) or not exc.args:
+        return False
+    # NOTE: requests wraps the urllib3 error, if the connection couldn't
+    #       be established it's the reason of the exhausted retries
+    reason = getattr(exc.args[0], 'reason', exc.args[0])
+    return isinstance(reason, NewConnectionError)
+
+
+class RetryPolicy:
+    """ Describes how often and how quickly failed requests are retried.
+
+    Connection errors, timeouts and responses with a status code in
+    `retry_on` are retried with exponential backoff and random jitter.
+
+    Requests which aren't idempotent, like the POST that reserves an
+    upload, are only retried if they never reached the server or if it
+    told us to come back later through a status code in `retry_unsafe_on`.
+
+    """
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        backoff: float = 1.0,
+        max_backoff: float = 30.0,
+        jitter: float = 0.5,
+        retry_on: Iterable[int] = (408, 429, 500, 502, 503, 504),
+        retry_unsafe_on: Iterable[int] = (429, 503),
+    ) -> None:
+        self.attempts = max(attempts, 1)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_on = frozenset(retry_on)
+        self.retry_unsafe_on = frozenset(retry_unsafe_on)
+
+    def delay(self, attempt: int) -> float:
+        delay = min(self.backoff * 2.0 ** attempt, self.max_backoff)
+        return delay + random.uniform(0, delay * self.jitter)  # noqa: S311
+
+
+class CompressionStats(NamedTuple):
+    level: int
+    raw_size: int
+    compressed_size: int
+    seconds: float
+    workers: int = 1
+
+    @property
+    def ratio(self) -> float:
+        if not self.raw_size:
+            return 1.0
+        return self.compressed_size / self.raw_size
+
+
+class SlimStats(NamedTuple):
+    raw_size: int
+    slim_size: int
+
+    @property
+    def saved(self) -> int:
+        return self.raw_size - self.slim_size
+
+
+class UploadProfile:
+    """ Collects how long each phase of an upload took and how many bytes
+    it produced. Phases which run more than once are summed up.
+
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.seconds: dict[str, float] = {}
+        self.sizes: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        phase: str,
+        seconds: float = 0.0,
+        size: int | None = None
+    ) -> None:
+        with self._lock:
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+            if size is not None:
+                self.sizes[phase] = self.sizes.get(phase, 0) + size
+
+    @contextlib.contextmanager
+    def measure(
+        self,
+        phase: str,
+        output: IO[bytes] | None = None
+    ) -> Generator[None, None, None]:
+        """ Times the block, if an output is given the bytes written to
+        it are counted as well.
+
+        """
+        offset = 0 if output is None else output.tell()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            size = None if output is None else output.tell() - offset
+            self.add(phase, seconds, size)
+
+    @property
+    def total_seconds(self) -> float:
+        return time.perf_counter() - self.start
+
+    def summary(self) -> str:
+        parts = []
+        for phase, seconds in self.seconds.items():
+            part = f'{phase} {seconds:.2f}s'
+            if phase in self.sizes:
+                part += f' ({self.sizes[phase]} bytes)'
+            parts.append(part)
+        parts.append(f'total {self.total_seconds:.2f}s')
+        return ', '.join(parts)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            'total_seconds': self.total_seconds,
+            'phases': [
+                {
+                    'name': phase,
+                    'seconds': seconds,
+                    'bytes': self.sizes.get(phase),
+                }
+                for phase, seconds in self.seconds.items()
+            ],
+        }
+
+
+class PayloadDigest:
+    """ Incremental sha256 digest of a payload, which ignores volatile
+    attributes like the timestamps in the XML reports, so identical reports
+    from different runs produce the same digest.
+
+    """
+
+    volatile_attributes = re.compile(rb'\s(?:time|timestamp|hostname)="[^"]*"')
+
+    # NOTE: We hold back the end of each chunk until the next one arrives,
+    #       so attributes which are split between two chunks are ignored
+    carry = 256
+
+    def __init__(self) -> None:
+        self._hash = hashlib.sha256()
+        self._tail = b''
+
+    def update(self, data: bytes) -> None:
+        data = self.volatile_attributes.sub(b'', self._tail + data)
+        self._hash.update(data[:-self.carry])
+        self._tail = data[-self.carry:]
+
+    def copy(self) -> PayloadDigest:
+        digest = PayloadDigest()
+        digest._hash = self._hash.copy()
+        digest._tail = self._tail
+        return digest
+
+    def hexdigest(self) -> str:
+        digest = self._hash.copy()
+        digest.update(self._tail)
+        return digest.hexdigest()
+
+
+def compress_network(
+    files: Iterable[str],
+    compression_level: CompressionLevel = 'auto'
+) -> bytes:
+    """ Compresses the network section of a payload into a standalone
+    gzip member, see :meth:`CodecovUploader.add_compressed_network`.
+
+    """
+    # NOTE: The file list is usually small enough, that the default
+    #       level is a good trade-off when the level is picked for us
+    level = 6 if compression_level == 'auto' else compression_level
+    buffer = io.BytesIO()
+    with gzip.GzipFile(
+        fileobj=buffer,
+        mode='wb',
+        compresslevel=level
+    ) as gz_network:
+        for path in files:
+            gz_network.write(f'{path}\n'.encode())
+        gz_network.write(b'<<<<<< network')
+    return buffer.getvalue()
+
+
+def decompress_network(gz_network: bytes) -> list[str]:
+    network = gzip.decompress(gz_network).decode('utf-8')
+    return network.split('\n')[:-1]
+
+
+junit_containers = frozenset(('testsuites', 'testsuite'))
+junit_stripped = frozenset(('properties', 'system-out', 'system-err'))
+junit_outcomes = frozenset(('failure', 'error', 'skipped'))
+
+
+def slim_junit_xml(
+    source: StrOrBytesPath | IO[bytes],
+    max_message_length: int = 1000
+) -> Iterator[bytes]:
+    """ Streams a copy of the given JUnit XML without captured output and
+    properties and with truncated failure messages.
+
+    Only one test case is kept in memory at a time.
+
+    """
+    yield b'<?xml version="1.0" encoding="utf-8"?>'
+    parents: list[ElementTree.Element] = []
+    events = ElementTree.iterparse(  # noqa: S314
+        source,
+        events=('start', 'end')
+    )
+    for event, element in events:
+        if event == 'start':
+            if element.tag in junit_containers:
+                attrs = ''.join(
+                    f' {name}={quoteattr(value)}'
+                    for name, value in element.attrib.items()
+                )
+                yield f'<{element.tag}{attrs}>'.encode()
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if element.tag in junit_containers:
+            yield f'</{element.tag}>'.encode()
+        elif not parents or parents[-1].tag not in junit_containers:
+            # NOTE: Children of test cases are handled with the test case
+            continue
+        elif element.tag == 'testcase':
+            for child in list(element):
+                if child.tag in junit_stripped:
+                    element.remove(child)
+                elif child.tag in junit_outcomes:
+                    message = child.get('message', '')
+                    if len(message) > max_message_length:
+                        message = message[:max_message_length] + '...'
+                        child.set('message', message)
+                    text = child.text or ''
+                    if len(text) > max_message_length:
+                        child.text = text[:max_message_length] + '...'
+                child.tail = None
+            if element.text is not None and not element.text.strip():
+                element.text = None
+            element.tail = None
+            yield ElementTree.tostring(element, encoding='utf-8')
+
+        # NOTE: Detach the element from its parent, so the parsed tree
+        #       doesn't grow with the size of the file
+        if parents:
+            parents[-1].remove(element)
+
+
+class MeasuredFiles:
+    """ Index of the files measured by coverage for the network section.
+
+    The listed paths are matched against every trailing part of the
+    measured paths, so it doesn't matter which directory either of them
+    is relative to. Paths matching one of the include globs are always
+    kept.
+
+    """
+
+    def __init__(
+        self,
+        measured_files: Iterable[str],
+        include: Iterable[str] = ()
+    ) -> None:
+        self.suffixes: set[str] = set()
+        for path in measured_files:
+            parts = path.replace(os.sep, '/').split('/')
+            self.suffixes.update(
+                '/'.join(parts[i:]) for i in range(len(parts))
+            )
+
+        patterns = [fnmatch.translate(pattern) for pattern in include]
+        self.include = re.compile('|'.join(patterns)) if patterns else None
+
+    def __contains__(self, path: object) -> bool:
+        if path in self.suffixes:
+            return True
+        return (
+            self.include is not None
+            and isinstance(path, str)
+            and self.include.match(path) is not None
+        )
+
+
+def _analysis_to_report(
+    cov: Coverage,
+    morfs: Iterable[str] | None = None
+) -> Iterable[tuple[FileReporter, Analysis]]:
+    try:
+        from coverage.report_core import get_analysis_to_report
+    except ImportError:  # pragma: no cover
+        # NOTE: coverage<7.4
+        from coverage.report import (  # type: ignore[attr-defined]
+            get_analysis_to_report
+        )
+    return get_analysis_to_report(cov, morfs)
+
+
+def _json_file_coverage(
+    file_reporter: FileReporter,
+    analysis: Analysis
+) -> str:
+    has_arcs = analysis.has_arcs
+    if callable(has_arcs):  # pragma: no cover
+        # NOTE: coverage<7.5
+        has_arcs = has_arcs()
+    branch_stats = analysis.branch_stats() if has_arcs else {}
+
+    lines: dict[str, int | str] = {}
+    missing = analysis.missing
+    for line in sorted(analysis.statements):
+        if line in missing:
+            lines[str(line)] = 0
+        elif line in branch_stats:
+            total, taken = branch_stats[line]
+            lines[str(line)] = f'{taken}/{total}'
+        else:
+            lines[str(line)] = 1
+
+    path = file_reporter.relative_filename().replace('\\', '/')
+    return f'{json.dumps(path)}: {json.dumps(lines, separators=(",", ":"))}'
+
+
+# NOTE: The options which affect the JSON report. pytest-cov passes some
+#       of them to Coverage in code, so the workers can't rely on reading
+#       them from the configuration file
+json_report_options = (
+    'run:source',
+    'run:relative_files',
+    'paths',
+    'report:omit',
+    'report:include',
+    'report:exclude_lines',
+    'report:partial_branches',
+)
+
+
+@contextlib.contextmanager
+def _data_file_on_disk(data: CoverageData) -> Generator[str, None, None]:
+    """ Yields the path of a data file the JSON report workers can read.
+
+    The data usually lives on disk already, if it's only kept in memory
+    a temporary copy is written for the duration of the report.
+
+    """
+    data_file = data.data_filename()
+    if data_file and os.path.isfile(data_file):
+        yield data_file
+        return
+
+    from coverage import CoverageData
+
+    with tempfile.TemporaryDirectory() as directory:
+        copy = CoverageData(basename=os.path.join(directory, '.coverage'))
+        copy.update(data)
+        copy.write()
+        yield copy.data_filename()
+
+
+def _json_coverage_fragments(
+    data_file: str,
+    config_file: str | None,
+    options: dict[str, Any],
+    morfs: list[str]
+) -> list[str]:
+    """ Renders the JSON coverage of a slice of the measured files, this
+    runs in a worker process which only reads the shared data file.
+
+    """
+    from coverage import Coverage
+    from coverage.exceptions import NoDataError
+
+    cov = Coverage(data_file=data_file, config_file=config_file or False)
+    for name, value in options.items():
+        cov.set_option(name, value)
+    cov.load()
+    try:
+        return list(itertools.starmap(
+            _json_file_coverage,
+            _analysis_to_report(cov, morfs)
+        ))
+    except NoDataError:
+        # NOTE: Every file in this slice was omitted from the report
+        return []
+
+
 class CodecovUploader:
     api_endpoint = 'https://codecov.io'
     storage_endpoint = 'https://storage.googleapis.com/codecov-production/'
 
+    # NOTE: The payload is streamed through spooled temporary files in
+    #       chunks, so peak memory stays bounded regardless of its size
+    spool_size = 4 * 1024 * 1024
+    chunk_size = 256 * 1024
+
+    # NOTE: In auto mode small payloads are compressed as well as we can,
+    #       for larger payloads we trade some size for compression speed
+    #       if we estimate compression would exceed our time budget
+    auto_max_level_size = 1024 * 1024
+    auto_time_budget = 1.0
+
+    # NOTE: Payloads above this threshold may be split into chunks that
+    #       are compressed in parallel and concatenated into a multi-member
+    #       gzip stream, zlib releases the GIL so threads are sufficient
+    parallel_threshold = 16 * 1024 * 1024
+    parallel_chunk_size = 4 * 1024 * 1024
+
+    # NOTE: All requests go through a single session, so the connections
+    #       to the API and the storage endpoint are kept alive and reused
+    pool_connections = 2
+    pool_maxsize = 4
+
+    # NOTE: The read timeout grows with the size of the request body, so
+    #       large uploads on slow connections don't time out prematurely
+    connect_timeout = 5.0
+    read_timeout = 10.0
+    min_upload_speed = 1024 * 1024
+
     def __init__(
         self,
         slug: str,
         commit: str | None = None,
         branch: str | None = None,
-        token: str | None = None
+        token: str | None = None,
+        compression_level: CompressionLevel = 'auto',
+        compression_workers: int = 1,
+        session: requests.Session | None = None,
+        retry_policy: RetryPolicy | None = None,
+        flags: Iterable[str] = (),
+        profile: UploadProfile | None = None
     ) -> None:
         self.slug = slug
         self.commit = commit
         self.branch = branch
         self.token = token
+        self.flags = list(flags)
+        self.compression_level = compression_level
+        self.compression_workers = compression_workers
+        self.compression_stats: CompressionStats | None = None
+        self.junit_stats: SlimStats | None = None
+        self.profile = UploadProfile() if profile is None else profile
+        self._owns_session = session is None
+        self.session = self.create_session() if session is None else session
+        self.retry_policy = retry_policy or RetryPolicy()
         self._coverage_store_url: str | None = None
-        self._coverage_buffer = io.StringIO()
+        self._coverage_buffer = self._spooled_file()
+        self._compressed_network: bytes | None = None
+        self._compressed_network_size = 0
         self._test_result_store_url: str | None = None
-        self._test_result_files: list[dict[str, Any]] = []
+        self._test_result_files: list[str] = []
+        self._test_results_buffer = self._spooled_file()
+        self._test_results_digest = PayloadDigest()
+
+    def create_session(self) -> requests.Session:
+        return create_session(self.pool_connections, self.pool_maxsize)
+
+    def timeout(self, size: int = 0) -> tuple[float, float]:
+        return (
+            self.connect_timeout,
+            self.read_timeout + size / self.min_upload_speed
+        )
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        size: int = 0,
+        **kwargs: Any
+    ) -> requests.Response:
 
-    def add_network_files(self, files: list[str]) -> None:
-        self._coverage_buffer.write('\n'.join(files))
-        if files:
-            self._coverage_buffer.write('\n')
-        self._coverage_buffer.write('<<<<<< network')
+        policy = self.retry_policy
+        idempotent = method.upper() not in ('POST', 'PATCH')
+        retry_on = policy.retry_on if idempotent else policy.retry_unsafe_on
+        seek = getattr(kwargs.get('data'), 'seek', None)
+        for attempt in range(policy.attempts):
+            last_attempt = attempt + 1 == policy.attempts
+            # NOTE: File bodies need to be rewound before we can resend
+            #       them, since the payload is spooled we don't have to
+            #       compress it again
+            if seek is not None:
+                seek(0)
+            try:
+                response = self.session.request(
+                    method,
+                    url,
+                    timeout=self.timeout(size),
+                    **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                # NOTE: If the request may have reached the server we can't
+                #       resend it without risking a duplicate upload
+                if last_attempt or not (idempotent or request_unsent(exc)):
+                    host = urlsplit(url).netloc
+                    raise CodecovError(
+                        f'Failed to connect to {host} after '
+                        f'{attempt + 1} attempt(s): {exc}'
+                    ) from exc
+            else:
+                if last_attempt or response.status_code not in retry_on:
+                    return response
+
+            time.sleep(policy.delay(attempt))
+
+        raise AssertionError('unreachable')
+
+    def close(self) -> None:
+        # NOTE: We leave sessions that were passed in to the caller
+        if self._owns_session:
+            self.session.close()
+        self._coverage_buffer.close()
+        self._test_results_buffer.close()
+
+    def _spooled_file(self) -> IO[bytes]:
+        return tempfile.SpooledTemporaryFile(
+            max_size=self.spool_size
+        )
+
+    def _write(self, text: str) -> None:
+        self._coverage_buffer.write(text.encode('utf-8'))
+
+    def add_network_files(self, files: Iterable[str]) -> None:
+        for path in files:
+            self._write(f'{path}\n')
+        self._write('<<<<<< network')
+
+    def add_compressed_network(self, gz_network: bytes) -> None:
+        """ Adds a network section that was already compressed elsewhere,
+        e.g. on a pytest-xdist worker, instead of using add_network_files.
+
+        Payloads which are compressed in parallel are multi-member gzip
+        streams, in that case it's used as the first member as is. Otherwise
+        it's recompressed along with the reports into a single stream.
+
+        """
+        self._compressed_network = gz_network
+        # NOTE: The gzip trailer ends with the uncompressed size
+        self._compressed_network_size = int.from_bytes(
+            gz_network[-4:],
+            'little'
+        )
 
     def add_coverage_report(
         self,
         cov: Coverage,
         filename: str = 'coverage.xml',
+        morfs: Iterable[str] | None = None
     ) -> None:
-        with tempfile.NamedTemporaryFile(mode='r') as xml_report:
+        with self.profile.measure('report', self._coverage_buffer):
             # embed xml report
-            self._coverage_buffer.write(f'\n# path=./{filename}\n')
-            cov.xml_report(outfile=xml_report.name)
-            xml_report.seek(0)
-            self._coverage_buffer.write(xml_report.read())
-            self._coverage_buffer.write('\n<<<<<< EOF')
+            self._write(f'\n# path=./{filename}\n')
+            # NOTE: coverage.py removes the output file again if it fails
+            #       to generate the report, so we give it a directory
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                outfile = os.path.join(tmp_dir, 'coverage.xml')
+                cov.xml_report(morfs=morfs, outfile=outfile)
+                with open(outfile, 'rb') as xml_report:
+                    shutil.copyfileobj(
+                        xml_report,
+                        self._coverage_buffer,
+                        self.chunk_size
+                    )
+                self._write('\n<<<<<< EOF')
+
+    def add_report_file(
+        self,
+        path: StrOrBytesPath,
+        filename: str | None = None
+    ) -> None:
+        """ Embeds an existing coverage report, e.g. one generated by a
+        different tool, as is.
+
+        """
+        with self.profile.measure('report', self._coverage_buffer):
+            if filename is None:
+                filename = os.path.basename(os.fsdecode(path))
+            self._write(f'\n# path=./{filename}\n')
+            with open(path, 'rb') as report:
+                shutil.copyfileobj(
+                    report,
+                    self._coverage_buffer,
+                    self.chunk_size
+                )
+            self._write('\n<<<<<< EOF')
+
+    def add_json_coverage_report(
+        self,
+        cov: Coverage,
+        filename: str = 'codecov.json',
+        workers: int = 1,
+        morfs: Iterable[str] | None = None
+    ) -> None:
+        """ Embeds the report in Codecov's own JSON coverage format.
+
+        Unlike the XML report, which is built as a whole in memory, this
+        is written out one file at a time straight from the analysis. With
+        more than one worker the files are analyzed in a process pool.
+
+        The report can be restricted to the given files, just like
+        the XML report.
+
+        """
+        with self.profile.measure('report', self._coverage_buffer):
+            self._write(f'\n# path=./{filename}\n{{"coverage": {{')
+            if workers > 1:
+                fragments = self._parallel_json_coverage(cov, workers, morfs)
+            else:
+                fragments = itertools.starmap(
+                    _json_file_coverage,
+                    _analysis_to_report(cov, morfs)
+                )
+
+            separator = ''
+            for fragment in fragments:
+                self._write(f'{separator}{fragment}')
+                separator = ',\n'
+            self._write('}}\n<<<<<< EOF')
+
+    def _parallel_json_coverage(
+        self,
+        cov: Coverage,
+        workers: int,
+        morfs: Iterable[str] | None = None
+    ) -> Iterator[str]:
+
+        if morfs is None:
+            morfs = cov.get_data().measured_files()
+        measured_files = sorted(morfs)
+        # NOTE: Contiguous slices of the sorted files keep the report in
+        #       the same order as the single process version, a few
+        #       slices per worker even out the differences in file size
+        size = max(len(measured_files) // (workers * 4), 1)
+        partitions = [
+            measured_files[offset:offset + size]
+            for offset in range(0, len(measured_files), size)
+        ]
+        # NOTE: We spawn fresh interpreters rather than forking, since
+        #       we're likely running inside a process with other threads
+        context = multiprocessing.get_context('spawn')
+        options = {
+            name: cov.get_option(name)
+            for name in json_report_options
+        }
+        on_disk = _data_file_on_disk(cov.get_data())
+        executor = ProcessPoolExecutor(workers, mp_context=context)
+        with on_disk as data_file, executor:
+            results = executor.map(
+                _json_coverage_fragments,
+                itertools.repeat(data_file),
+                itertools.repeat(cov.config.config_file),
+                itertools.repeat(options),
+                partitions
+            )
+            empty = True
+            for fragments in results:
+                for fragment in fragments:
+                    empty = False
+                    yield fragment
+
+        if empty:
+            from coverage.exceptions import NoDataError
+            raise NoDataError('No data to report.')
 
     def add_junit_xml(
         self,
         path: StrOrBytesPath,
-        filename: str = 'junit.xml'
+        filename: str = 'junit.xml',
+        slim: bool = False,
+        max_message_length: int = 1000
     ) -> None:
+        buffer = self._test_results_buffer
+        with self.profile.measure('junit', buffer):
+            # NOTE: If the file turns out to be unreadable we roll back
+            #       to the last complete entry, so the body stays valid
+            start = buffer.tell()
+            digest = self._test_results_digest.copy()
+            try:
+                self._write_junit_xml(
+                    path,
+                    filename,
+                    slim,
+                    max_message_length
+                )
+            except BaseException:
+                buffer.seek(start)
+                buffer.truncate()
+                self._test_results_digest = digest
+                raise
+            self._test_result_files.append(filename)
+
+    def _write_junit_xml(
+        self,
+        path: StrOrBytesPath,
+        filename: str,
+        slim: bool,
+        max_message_length: int
+    ) -> None:
+        # NOTE: The JSON body of the test results upload is assembled
+        #       in a spooled file, the JUnit XML is compressed and encoded
+        #       in chunks, so we never hold the whole file in memory
+        buffer = self._test_results_buffer
+        if self._test_result_files:
+            buffer.write(b', ')
+        header = json.dumps({
+            'filename': filename,
+            'format': 'base64+compressed',
+        })
+        buffer.write(f'{header[:-1]}, "data": "'.encode())
+
+        digest = self._test_results_digest
+        digest.update(f'\n{filename}\n'.encode())
+        compressor = zlib.compressobj()
+        remainder = b''
+
+        def encode(data: bytes) -> None:
+            nonlocal remainder
+            # NOTE: Base64 encodes groups of three bytes, so we hold back
+            #       the rest until we have a complete group
+            data = remainder + data
+            end = len(data) - len(data) % 3
+            buffer.write(b64encode(data[:end]))
+            remainder = data[end:]
+
         with open(path, 'rb') as junit_xml:
-            self._test_result_files.append({
-                'filename': filename,
-                'format': 'base64+compressed',
-                'data': b64encode(
-                    zlib.compress(junit_xml.read())
-                ).decode('ascii'),
-                'labels': '',
-            })
+            chunks: Iterable[bytes]
+            if slim:
+                chunks = slim_junit_xml(junit_xml, max_message_length)
+            else:
+                chunks = iter(lambda: junit_xml.read(self.chunk_size), b'')
+
+            size = 0
+            for chunk in chunks:
+                size += len(chunk)
+                digest.update(chunk)
+                encode(compressor.compress(chunk))
+        encode(compressor.flush())
+
+        if slim:
+            raw_size = os.path.getsize(path)
+            if self.junit_stats is not None:
+                raw_size += self.junit_stats.raw_size
+                size += self.junit_stats.slim_size
+            self.junit_stats = SlimStats(raw_size, size)
+        buffer.write(b64encode(remainder))
+        buffer.write(b'", "labels": ""}')
 
     def get_payload(self) -> str:
-        return self._coverage_buffer.getvalue()
+        self._coverage_buffer.seek(0)
+        payload = self._coverage_buffer.read().decode('utf-8')
+        self._coverage_buffer.seek(0, 2)
+        if self._compressed_network is not None:
+            network = gzip.decompress(self._compressed_network)
+            payload = network.decode('utf-8') + payload
+        return payload
 
-    def ping(self) -> None:
+    def payload_digest(self) -> str:
+        """ Returns a digest which identifies the reports, so we can tell
+        whether they were already uploaded for this commit.
+
+        """
+        digest = PayloadDigest()
+        for value in (self.slug, self.branch, self.commit):
+            digest.update(f'{value or ""}\n'.encode())
+        digest.update(f'{",".join(self.flags)}\n'.encode())
+
+        if self._compressed_network is not None:
+            digest.update(gzip.decompress(self._compressed_network))
+
+        self._coverage_buffer.seek(0)
+        for chunk in iter(
+            lambda: self._coverage_buffer.read(self.chunk_size),
+            b''
+        ):
+            digest.update(chunk)
+        self._coverage_buffer.seek(0, 2)
+
+        if self._test_result_files:
+            digest.update(self._test_results_digest.hexdigest().encode())
+        return digest.hexdigest()
+
+    def auto_compression_level(self, size: int) -> int:
+        if size <= self.auto_max_level_size:
+            return 9
+
+        # estimate the throughput by compressing a sample of the payload
+        self._coverage_buffer.seek(0)
+        sample = self._coverage_buffer.read(self.chunk_size)
+        self._coverage_buffer.seek(0, 2)
+        start = time.perf_counter()
+        zlib.compress(sample, 6)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        estimate = size / (len(sample) / elapsed)
+        return 6 if estimate <= self.auto_time_budget else 1
+
+    def _compress_parallel(
+        self,
+        gz_payload: IO[bytes],
+        level: int,
+        workers: int
+    ) -> None:
+
+        chunks = iter(
+            lambda: self._coverage_buffer.read(self.parallel_chunk_size),
+            b''
+        )
+        # NOTE: We limit the number of chunks in flight, so memory use
+        #       stays bounded and members are written in order
+        pending: deque[Future[bytes]] = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for chunk in chunks:
+                pending.append(executor.submit(gzip.compress, chunk, level))
+                if len(pending) >= workers * 2:
+                    gz_payload.write(pending.popleft().result())
+            while pending:
+                gz_payload.write(pending.popleft().result())
+
+    def compress_payload(self) -> IO[bytes]:
+        raw_size = self._coverage_buffer.tell()
+        if self.compression_level == 'auto':
+            level = self.auto_compression_level(raw_size)
+        else:
+            level = self.compression_level
+
+        workers = self.compression_workers
+        if raw_size < self.parallel_threshold:
+            workers = 1
+
+        start = time.perf_counter()
+        gz_payload = self._spooled_file()
+        if self._compressed_network is not None:
+            raw_size += self._compressed_network_size
+
+        self._coverage_buffer.seek(0)
+        if workers > 1:
+            # NOTE: Large payloads are sent as multi-member gzip streams
+            #       anyway, so we can use the compressed network section
+            #       as is for the first member
+            if self._compressed_network is not None:
+                gz_payload.write(self._compressed_network)
+            self._compress_parallel(gz_payload, level, workers)
+        else:
+            with gzip.GzipFile(
+                fileobj=gz_payload,
+                mode='wb',
+                compresslevel=level
+            ) as payload:
+                if self._compressed_network is not None:
+                    with gzip.GzipFile(
+                        fileobj=io.BytesIO(self._compressed_network)
+                    ) as network:
+                        shutil.copyfileobj(network, payload, self.chunk_size)
+                shutil.copyfileobj(
+                    self._coverage_buffer,
+                    payload,
+                    self.chunk_size
+                )
+        self._coverage_buffer.seek(0, 2)
+        self.compression_stats = CompressionStats(
+            level=level,
+            raw_size=raw_size,
+            compressed_size=gz_payload.tell(),
+            seconds=time.perf_counter() - start,
+            workers=workers,
+        )
+        self.profile.add(
+            'compress',
+            self.compression_stats.seconds,
+            self.compression_stats.compressed_size
+        )
+        gz_payload.seek(0)
+        return gz_payload
+
+    def _check_slug(self) -> None:
         if not self.slug:
             raise CodecovError(
                 'Failed to determine git repository slug. '
                 'Cannot upload without a valid slug.'
             )
+
+    def ping_coverage(self) -> None:
+        self._check_slug()
         api_url = urljoin(self.api_endpoint, '/upload/v4')
         headers = {
             'X-Reduced-Redundancy': 'false',
@@ -105,50 +986,81 @@ class CodecovUploader:
             'tag': '',  # TODO: support tags?
             'slug': self.slug,
             'service': '',
-            'flags': '',  # TODO: support flags?
+            'flags': ','.join(self.flags),
             'pr': '',  # TODO: support pull requests?
             'job': '',
             'cmd_args': '',
         }
-        response = requests.post(
-            api_url,
-            headers=headers,
-            params=params,
-            timeout=(5, 10)
-        )
+        with self.profile.measure('ping coverage'):
+            response = self.request(
+                'post',
+                api_url,
+                headers=headers,
+                params=params,
+            )
         lines = response.text.splitlines()
-        if len(lines) != 2 or not lines[1].startswith(self.storage_endpoint):
+        if (
+            not response.ok
+            or len(lines) != 2
+            or not lines[1].startswith(self.storage_endpoint)
+        ):
             raise CodecovError(
                 f'Invalid response from codecov API:\n{response.text}'
             )
         self._coverage_store_url = lines[1]
 
-        if not self._test_result_files:
-            return
-
+    def ping_test_results(self) -> None:
+        self._check_slug()
         headers = {} if self.token is None else {
             'Authorization': f'token {self.token}',
             'User-Agent': package()
         }
-        data = {
+        data: dict[str, Any] = {
             'slug': self.slug,
             'branch': self.branch or '',
             'commit': self.commit or '',
         }
+        if self.flags:
+            data['flags'] = self.flags
         api_url = urljoin(self.api_endpoint, '/upload/test_results/v1')
-        response = requests.post(
-            api_url,
-            headers=headers,
-            json=data,
-            timeout=(5, 10)
-        )
-        if response.ok:
-            # TODO: Fail more loudly?
+        with self.profile.measure('ping test results'):
+            response = self.request(
+                'post',
+                api_url,
+                headers=headers,
+                json=data,
+            )
+        if not response.ok:
+            raise CodecovError(
+                f'Invalid response from test results API:\n{response.text}'
+            )
+
+        try:
             url = response.json()['raw_upload_location']
-            if url.startswith(self.storage_endpoint):
-                self._test_result_store_url = url
+        except (ValueError, KeyError, TypeError) as exc:
+            raise CodecovError(
+                f'Invalid response from test results API:\n{response.text}'
+            ) from exc
 
-    def upload(self) -> None:
+        if (
+            not isinstance(url, str)
+            or not url.startswith(self.storage_endpoint)
+        ):
+            raise CodecovError(
+                f'Invalid test results upload location: {url}'
+            )
+        self._test_result_store_url = url
+
+    def ping(self) -> None:
+        self.ping_coverage()
+        if self._test_result_files:
+            # NOTE: Test results are optional, so we don't fail if
+            #       we can't upload them, use run_pipelines to get
+            #       the individual errors
+            with contextlib.suppress(CodecovError):
+                self.ping_test_results()
+
+    def upload_coverage(self, gz_payload: IO[bytes] | None = None) -> None:
         if not self._coverage_store_url:
             raise CodecovError('Need to ping API before upload.')
 
@@ -156,32 +1068,100 @@ class CodecovUploader:
             'Content-Type': 'application/x-gzip',
             'Content-Encoding': 'gzip',
         }
-        gz_payload = io.BytesIO()
-        with gzip.open(gz_payload, 'wb', 9) as payload:
-            payload.write(self.get_payload().encode('utf-8'))
-        gz_payload.seek(0)
-        response = requests.put(
-            self._coverage_store_url,
-            headers=headers,
-            data=gz_payload,
-            timeout=(5, 10)
-        )
+        with contextlib.ExitStack() as stack:
+            if gz_payload is None:
+                gz_payload = stack.enter_context(self.compress_payload())
+            size = gz_payload.seek(0, 2)
+            with self.profile.measure('upload coverage'):
+                response = self.request(
+                    'put',
+                    self._coverage_store_url,
+                    size=size,
+                    headers=headers,
+                    data=gz_payload,
+                )
+            self.profile.add('upload coverage', size=size)
 
         if not response.ok:
             raise CodecovError('Failed to upload report to storage endpoint.')
 
         self._coverage_store_url = None
 
-        if not self._test_result_store_url or not self._test_result_files:
-            return
-
-        json_payload = json.dumps({
-            'test_results_files': self._test_result_files
-        }).encode('ascii')
-        # TODO: Fail more loudly?
-        requests.put(
-            self._test_result_store_url,
-            data=json_payload,
-            timeout=(5, 10)
-        )
+    def test_results_payload(self) -> IO[bytes] | None:
+        if not self._test_result_files:
+            return None
+
+        payload = self._spooled_file()
+        payload.write(b'{"test_results_files": [')
+        self._test_results_buffer.seek(0)
+        shutil.copyfileobj(self._test_results_buffer, payload, self.chunk_size)
+        payload.write(b']}')
+        payload.seek(0)
+        return payload
+
+    def upload_test_results(self, payload: IO[bytes] | None = None) -> None:
+        if not self._test_result_store_url:
+            raise CodecovError('Need to ping test results API before upload.')
+
+        with contextlib.ExitStack() as stack:
+            if payload is None:
+                payload = self.test_results_payload()
+                if payload is None:
+                    raise CodecovError('No test results to upload.')
+                stack.enter_context(payload)
+            size = payload.seek(0, 2)
+            with self.profile.measure('upload test results'):
+                response = self.request(
+                    'put',
+                    self._test_result_store_url,
+                    size=size,
+                    data=payload,
+                )
+            self.profile.add('upload test results', size=size)
+        if not response.ok:
+            raise CodecovError(
+                'Failed to upload test results to storage endpoint.'
+            )
+
         self._test_result_store_url = None
+
+    def upload(self) -> None:
+        self.upload_coverage()
+        if self._test_result_store_url and self._test_result_files:
+            with contextlib.suppress(CodecovError):
+                self.upload_test_results()
+        self._test_result_store_url = None
+
+    def run_pipelines(
+        self,
+        coverage: bool = True
+    ) -> dict[str, CodecovError | None]:
+        """ Pings and uploads coverage and test results concurrently.
+
+        Pass `coverage=False` to only upload the test results.
+
+        Returns the error for each pipeline, or `None` if it succeeded.
+
+        """
+        pipelines: dict[str, tuple[Callable[[], None], ...]] = {}
+        if coverage:
+            pipelines['coverage'] = (self.ping_coverage, self.upload_coverage)
+        if self._test_result_files:
+            pipelines['test results'] = (
+                self.ping_test_results,
+                self.upload_test_results
+            )
+
+        def run(name: str) -> CodecovError | None:
+            try:
+                for step in pipelines[name]:
+                    step()
+            except CodecovError as error:
+                return error
+            return None
+
+        if not pipelines:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=len(pipelines)) as executor:
+            return dict(zip(pipelines, executor.map(run, pipelines)))
@@ -1,81 +1,459 @@
 from __future__ import annotations
 
+import contextlib
+import fnmatch
+import hashlib
 import os
-import pathlib
 import re
+import subprocess  # noqa: S404
+from typing import cast
+from typing import IO
+from typing import NamedTuple
+from typing import TYPE_CHECKING
 
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from collections.abc import Iterator
+    from git import Repo
 
-slug = None
-branch = None
-commit = None
-
-_exclude_pattern = re.compile(
-    r'/(\.?virtualenvs?|'
-    r'\.?v?envs?|'
-    r'\.git|'
-    r'\.tox|'
-    r'\.pytest_cache|'
-    r'\.coverage|'
-    r'coverage\.xml|'
-    r'[^/]*\.egg-info|'
-    r'vendor|'
-    r'__pycache__|'
-    r'node_modules)(/|$)'
-)
-_exlude_extension = (
-    '.png',
-    '.gif',
-    '.jpg',
-    '.jpeg',
-    '.md',
-)
-
-
-def os_ls_files() -> list[str]:
-    basedir = os.getcwd()
-    paths = []
-    for path in pathlib.Path(basedir).glob('**/*'):
-        if path.is_dir():
+
+_metadata: dict[str, str | None] | None = None
+
+
+def _compile_globs(patterns: Iterable[str]) -> re.Pattern[str] | None:
+    patterns = [fnmatch.translate(pattern) for pattern in patterns]
+    return re.compile('|'.join(patterns)) if patterns else None
+
+
+class PathMatcher:
+    """ Decides which files are listed in the network section.
+
+    Everything is compiled once up front, so each path costs a set lookup
+    for its segments and extension and a single match per glob group.
+    The globs are matched against the path relative to the repository
+    root, or the current directory outside of a repository, files
+    matching an include glob are always listed.
+
+    """
+
+    # NOTE: These are matched against individual path segments, so we
+    #       can prune excluded directories before descending into them
+    exclude_names = frozenset((
+        'virtualenv',
+        'virtualenvs',
+        '.virtualenv',
+        '.virtualenvs',
+        'env',
+        'envs',
+        'venv',
+        'venvs',
+        '.env',
+        '.envs',
+        '.venv',
+        '.venvs',
+        '.git',
+        '.tox',
+        '.pytest_cache',
+        '.coverage',
+        'coverage.xml',
+        'vendor',
+        '__pycache__',
+        'node_modules',
+    ))
+    exclude_name_suffix = re.compile(r'\.egg-info(?:/|$)')
+    exclude_extensions = frozenset((
+        'png',
+        'gif',
+        'jpg',
+        'jpeg',
+        'md',
+    ))
+
+    def __init__(
+        self,
+        exclude: Iterable[str] = (),
+        include: Iterable[str] = ()
+    ) -> None:
+        self.exclude = tuple(exclude)
+        self.include = tuple(include)
+        self._exclude = _compile_globs(self.exclude)
+        self._include = _compile_globs(self.include)
+
+    @property
+    def fingerprint(self) -> str:
+        return '\0'.join(('exclude', *self.exclude, 'include', *self.include))
+
+    def excludes_name(self, name: str) -> bool:
+        return (
+            name in self.exclude_names
+            or self.exclude_name_suffix.search(name) is not None
+        )
+
+    def prunes(self, name: str) -> bool:
+        # NOTE: An include glob may match a file inside an excluded
+        #       directory, so we can only prune if there are none
+        return self._include is None and self.excludes_name(name)
+
+    def matches_globs(self, path: str) -> bool:
+        """ Only applies the include and exclude globs, for files which
+        are tracked by git and thus skip the built-in excludes.
+
+        """
+        if self._include is not None and self._include.match(path):
+            return True
+        return self._exclude is None or self._exclude.match(path) is None
+
+    def __call__(self, path: str) -> bool:
+        if self._include is not None and self._include.match(path):
+            return True
+
+        segments = path.split('/')
+        _, dot, extension = segments[-1].rpartition('.')
+        if dot and extension in self.exclude_extensions:
+            return False
+        if not self.exclude_names.isdisjoint(segments):
+            return False
+        if self.exclude_name_suffix.search(path):
+            return False
+        return self._exclude is None or self._exclude.match(path) is None
+
+
+default_matcher = PathMatcher()
+
+
+class _IgnoreRule(NamedTuple):
+    base: str
+    pattern: re.Pattern[str]
+    anchored: bool
+    negate: bool
+    dir_only: bool
+
+
+def _translate_gitignore(pattern: str) -> str:
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+            continue
+
+        char = pattern[i]
+        if char == '*':
+            parts.append('[^/]*')
+        elif char == '?':
+            parts.append('[^/]')
+        elif char == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            group = pattern[i + 1:end]
+            if group.startswith('!'):
+                group = '^' + group[1:]
+            parts.append(f'[{group}]')
+            i = end
+        elif char == '\\' and i + 1 < len(pattern):
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    return ''.join(parts)
+
+
+def _read_gitignore(directory: str, base: str) -> list[_IgnoreRule]:
+    try:
+        with open(os.path.join(directory, '.gitignore')) as fp:
+            lines = fp.read().splitlines()
+    except OSError:
+        return []
+
+    rules = []
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith('#'):
             continue
-        if path.suffix in _exlude_extension:
+
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        anchored = '/' in line
+        line = line.lstrip('/')
+        if not line:
+            continue
+
+        rules.append(_IgnoreRule(
+            base=base,
+            pattern=re.compile(_translate_gitignore(line)),
+            anchored=anchored,
+            negate=negate,
+            dir_only=dir_only,
+        ))
+    return rules
+
+
+def _is_ignored(
+    rules: list[_IgnoreRule],
+    relpath: str,
+    name: str,
+    is_dir: bool
+) -> bool:
+    ignored = False
+    for rule in rules:
+        if rule.dir_only and not is_dir:
+            continue
+
+        target = relpath[len(rule.base):] if rule.anchored else name
+        if rule.pattern.fullmatch(target):
+            ignored = not rule.negate
+    return ignored
+
+
+def _walk(
+    directory: str,
+    prefix: str,
+    rules: list[_IgnoreRule] | None,
+    matcher: PathMatcher
+) -> Iterator[str]:
+
+    if rules is not None:
+        rules = rules + _read_gitignore(directory, prefix)
+
+    try:
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        return
+
+    for entry in entries:
+        name = entry.name
+        relpath = prefix + name
+        if entry.is_dir():
+            if entry.is_symlink() or matcher.prunes(name):
+                continue
+            if rules and _is_ignored(rules, relpath, name, True):
+                continue
+            yield from _walk(entry.path, f'{relpath}/', rules, matcher)
             continue
 
-        str_path = str(path)
-        if _exclude_pattern.search(str_path):
+        if not matcher(relpath):
+            continue
+        if rules and _is_ignored(rules, relpath, name, False):
             continue
-        paths.append(os.path.relpath(str_path, basedir))
-    return paths
+        yield relpath
+
+
+def _find_root(directory: str) -> str:
+    """ Returns the closest directory containing a .git entry, the same
+    way git looks for the repository, including GIT_CEILING_DIRECTORIES.
 
+    Falls back to the given directory if there is no repository.
 
-try:
+    """
+    ceilings = {
+        os.path.realpath(ceiling)
+        for ceiling in os.environ.get('GIT_CEILING_DIRECTORIES', '').split(
+            os.pathsep
+        )
+        if ceiling
+    }
+    current = os.path.realpath(directory)
+    while True:
+        if os.path.exists(os.path.join(current, '.git')):
+            return current
+        parent = os.path.dirname(current)
+        if parent == current or parent in ceilings:
+            return directory
+        current = parent
+
+
+def os_ls_files(
+    respect_gitignore: bool = False,
+    matcher: PathMatcher = default_matcher
+) -> Iterator[str]:
+    # NOTE: Like git we list paths relative to the repository root, so
+    #       the globs match the same paths regardless of the backend
+    basedir = _find_root(os.getcwd())
+    return _walk(basedir, '', [] if respect_gitignore else None, matcher)
+
+
+def _repo() -> Repo:
+    # NOTE: GitPython is fairly expensive to import, so we only
+    #       import it once we actually need to talk to the repo
     import git
+    return git.Repo(search_parent_directories=True)
+
+
+def _detect_metadata() -> dict[str, str | None]:
+    metadata: dict[str, str | None] = {
+        'slug': None,
+        'branch': None,
+        'commit': None,
+    }
+    # NOTE: For now we just ignore every error, so we don't have to
+    #       double wrap the block with GitPython specific exceptions
+    with contextlib.suppress(Exception):
+        repo = _repo()
+        metadata['commit'] = repo.head.commit.hexsha
+
+        if not repo.head.is_detached:
+            metadata['branch'] = repo.active_branch.name
+
+        origin = repo.remotes.origin
+        if origin:
+            url = origin.url
+            if url.endswith('.git'):
+                url = url[:-4]
+            parts = url.split(':')[-1].split('/')
+            if len(parts) >= 2:
+                metadata['slug'] = '/'.join(parts[-2:])
+    return metadata
+
+
+def __getattr__(name: str) -> str | None:
+    # NOTE: slug, branch and commit are resolved on first access, so
+    #       merely loading the plugin doesn't touch the repository
+    global _metadata
+    if name not in ('slug', 'branch', 'commit'):
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    if _metadata is None:
+        _metadata = _detect_metadata()
+    return _metadata[name]
+
+
+def _stream_ls_files(root: str) -> Iterator[str]:
+    with subprocess.Popen(
+        ['git', 'ls-files', '-z'],  # noqa: S607
+        cwd=root,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    ) as process:
+        stdout = cast('IO[bytes]', process.stdout)
+        remainder = b''
+        for chunk in iter(lambda: stdout.read(65536), b''):
+            *paths, remainder = (remainder + chunk).split(b'\0')
+            for path in paths:
+                yield os.fsdecode(path)
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+
+def _subprocess_ls_files() -> Iterator[str]:
+    # NOTE: We resolve the top level eagerly, so we can still fall back
+    #       to a different backend if we're not inside a git repository
+    root = subprocess.run(
+        ['git', 'rev-parse', '--show-toplevel'],  # noqa: S607
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True,
+        text=True,
+    ).stdout.rstrip('\n')
+    return _stream_ls_files(root)
+
+
+def _git_ls_files() -> list[str]:
+    repo = _repo()
+    return [
+        e.path  # type: ignore[attr-defined]
+        for e in repo.head.commit.tree.traverse()
+        if not hasattr(e, 'blobs')
+    ]
+
+
+def ls_files(matcher: PathMatcher = default_matcher) -> Iterable[str]:
+    # NOTE: The built-in excludes only apply when we walk the file system,
+    #       every file tracked by git is listed unless the user excludes it
+    def tracked(files: Iterable[str]) -> Iterable[str]:
+        if matcher.exclude or matcher.include:
+            return filter(matcher.matches_globs, files)
+        return files
+
+    try:
+        return tracked(_subprocess_ls_files())
+    except (OSError, subprocess.CalledProcessError):
+        # NOTE: Either git is not installed or we're not inside a
+        #       repository, so we try the slower fallbacks instead
+        try:
+            return tracked(_git_ls_files())
+        except Exception:
+            return os_ls_files(respect_gitignore=True, matcher=matcher)
+
+
+def ls_files_key() -> str | None:
+    """ Returns a key which changes whenever the output of ls_files might
+    change, i.e. when the checked out tree or the index change.
+
+    Returns None if the files aren't listed through git.
+
+    """
+    try:
+        root, index, tree = subprocess.run(
+            [  # noqa: S607
+                'git',
+                'rev-parse',
+                '--show-toplevel',
+                '--git-path',
+                'index',
+                'HEAD^{tree}',
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            text=True,
+        ).stdout.splitlines()
+        # NOTE: The index is rewritten on checkouts and whenever files
+        #       are added or removed, so its stat is a cheap dirty check
+        stat = os.stat(os.path.join(os.getcwd(), index))
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return None
+
+    key = f'{root}\0{tree}\0{stat.st_mtime_ns}\0{stat.st_size}'
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class ChangedFiles(NamedTuple):
+    root: str
+    paths: list[str]
+
+
+def changed_files(base: str) -> ChangedFiles | None:
+    """ Returns the files which changed between the merge base of HEAD and
+    the given ref and the working tree, relative to the repository root.
+
+    Deleted files are left out. Returns None if the changes can't be
+    determined through git.
+
+    """
+    def git(*args: str) -> str:
+        return subprocess.run(  # noqa: S603
+            ['git', *args],  # noqa: S607
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            text=True,
+        ).stdout
+
+    try:
+        root = git('rev-parse', '--show-toplevel').rstrip('\n')
+        merge_base = git('merge-base', base, 'HEAD').rstrip('\n')
+        paths = git(
+            '-C',
+            root,
+            'diff',
+            '--name-only',
+            '--no-renames',
+            '--diff-filter=d',
+            '-z',
+            merge_base,
+            '--',
+        ).split('\0')[:-1]
+    except (OSError, subprocess.CalledProcessError):
+        return None
 
-    repo = git.Repo(search_parent_directories=True)
-    commit = repo.head.commit.hexsha
-
-    if not repo.head.is_detached:
-        branch = repo.active_branch.name
-
-    _origin = repo.remotes.origin
-    if _origin:
-        _url = _origin.url
-        if _url.endswith('.git'):
-            _url = _url[:-4]
-        _parts = _url.split(':')[-1].split('/')
-        if len(_parts) >= 2:
-            slug = '/'.join(_parts[-2:])
-
-    def _git_ls_files() -> list[str]:
-        repo = git.Repo(search_parent_directories=True)
-        return [
-            e.path  # type: ignore[attr-defined]
-            for e in repo.head.commit.tree.traverse()
-            if not hasattr(e, 'blobs')
-        ]
-
-    ls_files = _git_ls_files
-
-except Exception:
-    # For now we just ignore every error, so we don't have to
-    # double wrap the try block with GitPython specific exceptions
-    ls_files = os_ls_files
+    return ChangedFiles(root, paths)
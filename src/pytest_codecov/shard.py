@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import argparse
+import glob
+import os
+import shutil
+import sys
+import uuid
+from typing import TYPE_CHECKING
+
+import pytest_codecov.codecov as codecov
+import pytest_codecov.git as git
+
+if TYPE_CHECKING:
+    from _typeshed import StrOrBytesPath
+    from collections.abc import Iterable
+    from collections.abc import Sequence
+    from coverage import Coverage
+
+
+DATA_FILE = '.coverage'
+REPORT_FILES = 'report-files'
+JUNIT_FILES = 'junit-files'
+
+
+def _copy_files(files: Iterable[tuple[str, str]], directory: str) -> None:
+    for path, filename in files:
+        target = os.path.join(directory, *filename.split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(path, target)
+
+
+def shard_files(directory: str, name: str) -> list[tuple[str, str]]:
+    """ Returns the files of the given kind that were copied into the
+    shards, along with the name they're embedded under.
+
+    """
+    files = []
+    for base in sorted(glob.glob(os.path.join(directory, f'{name}.*'))):
+        for root, _, filenames in sorted(os.walk(base)):
+            for filename in sorted(filenames):
+                path = os.path.join(root, filename)
+                relpath = os.path.relpath(path, base)
+                files.append((path, relpath.replace(os.sep, '/')))
+    return files
+
+
+def write_shard(
+    cov: Coverage,
+    directory: str,
+    junit_xml: StrOrBytesPath | None = None,
+    report_files: Iterable[tuple[str, str]] = (),
+    junit_files: Iterable[tuple[str, str]] = ()
+) -> str:
+    """ Writes the coverage data of this node and optionally its JUnit XML
+    into the shard directory, so they can be combined and uploaded at once
+    by pytest-codecov-combine.
+
+    Additional report and JUnit XML files are given as pairs of their path
+    and the name they should be embedded under.
+
+    """
+    from coverage import CoverageData
+
+    os.makedirs(directory, exist_ok=True)
+    # NOTE: We can't use suffix=True, since coverage.py then embeds a hash
+    #       of the recorded data in the file name, which doesn't account
+    #       for data added through update(), so all of our shards would
+    #       look like duplicates of each other when they're combined
+    suffix = uuid.uuid4().hex
+    data = CoverageData(
+        basename=os.path.join(directory, DATA_FILE),
+        suffix=suffix
+    )
+    data.update(cov.get_data())
+    data.write()
+    path = data.data_filename()
+
+    if junit_xml is not None:
+        shutil.copyfile(
+            junit_xml,
+            os.path.join(directory, f'junit.{suffix}.xml')
+        )
+    _copy_files(
+        report_files,
+        os.path.join(directory, f'{REPORT_FILES}.{suffix}')
+    )
+    _copy_files(
+        junit_files,
+        os.path.join(directory, f'{JUNIT_FILES}.{suffix}')
+    )
+    return path
+
+
+def combine_shards(directory: str) -> Coverage:
+    from coverage import Coverage
+
+    # NOTE: The configuration in the current directory is used, so any
+    #       [paths] remapping between the nodes applies when combining.
+    #       We keep the shards, so a failed upload can be retried
+    cov = Coverage(data_file=os.path.join(directory, DATA_FILE))
+    cov.combine([directory], keep=True)
+    return cov
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    from pytest_codecov import validate_flag
+    from pytest_codecov import validate_workers
+    from pytest_codecov import validate_slug
+    from pytest_codecov import validate_token
+
+    parser = argparse.ArgumentParser(
+        prog='pytest-codecov-combine',
+        description='Combine the shards written by pytest --codecov-shard '
+                    'and upload them as a single report.'
+    )
+    parser.add_argument('directory', help='The shard directory.')
+    parser.add_argument(
+        '--token',
+        type=validate_token,
+        default=os.environ.get('CODECOV_TOKEN') or None,
+        help='Set the codecov token for private repositories.'
+    )
+    parser.add_argument(
+        '--slug',
+        type=validate_slug,
+        default=os.environ.get('CODECOV_SLUG') or None,
+        help='Set the git repository slug manually.'
+    )
+    parser.add_argument(
+        '--branch',
+        default=os.environ.get('CODECOV_BRANCH') or None,
+        help='Set the git branch manually.'
+    )
+    parser.add_argument(
+        '--commit',
+        default=os.environ.get('CODECOV_COMMIT') or None,
+        help='Set the git commit hash manually.'
+    )
+    parser.add_argument(
+        '--flag',
+        action='append',
+        dest='flags',
+        type=validate_flag,
+        default=[],
+        help='Add a flag to the upload, can be given multiple times.'
+    )
+    parser.add_argument(
+        '--report-format',
+        choices=('xml', 'json'),
+        default='xml',
+        help='Upload a coverage.py XML report or use the JSON format of '
+             'Codecov.'
+    )
+    parser.add_argument(
+        '--report-workers',
+        type=validate_workers,
+        default=1,
+        help='Generate the JSON report in this many processes.'
+    )
+    parser.add_argument(
+        '--dump',
+        action='store_true',
+        help='Dump codecov payload instead of uploading it.'
+    )
+    parser.add_argument(
+        '--retries',
+        type=int,
+        default=2,
+        help='How many times failed requests are retried.'
+    )
+    parser.add_argument(
+        '--retry-backoff',
+        type=float,
+        default=1.0,
+        help='Initial delay between retries in seconds.'
+    )
+    args = parser.parse_args(argv)
+
+    data_files = glob.glob(os.path.join(args.directory, f'{DATA_FILE}.*'))
+    if not data_files:
+        sys.stdout.write(f'ERROR: No shards found in {args.directory}.\n')
+        return 1
+
+    junit_files = [
+        (path, os.path.basename(path))
+        for path in sorted(
+            glob.glob(os.path.join(args.directory, 'junit.*.xml'))
+        )
+    ]
+    junit_files += shard_files(args.directory, JUNIT_FILES)
+    report_files = shard_files(args.directory, REPORT_FILES)
+    from coverage.exceptions import CoverageException
+    try:
+        cov = combine_shards(args.directory)
+    except CoverageException as exc:
+        sys.stdout.write(f'ERROR: Failed to combine shards: {exc}\n')
+        return 1
+
+    uploader = codecov.CodecovUploader(
+        args.slug or git.slug or '',
+        commit=args.commit or git.commit,
+        branch=args.branch or git.branch,
+        token=args.token,
+        retry_policy=codecov.RetryPolicy(
+            attempts=args.retries + 1,
+            backoff=args.retry_backoff,
+        ),
+        flags=args.flags,
+    )
+    try:
+        uploader.add_network_files(git.ls_files())
+        try:
+            if args.report_format == 'json':
+                uploader.add_json_coverage_report(
+                    cov,
+                    workers=args.report_workers
+                )
+            else:
+                uploader.add_coverage_report(cov)
+        except CoverageException as exc:
+            sys.stdout.write(
+                f'ERROR: Failed to generate {args.report_format.upper()} '
+                f'report: {exc}\n'
+            )
+            return 1
+
+        for path, filename in report_files:
+            uploader.add_report_file(path, filename=filename)
+        for path, filename in junit_files:
+            uploader.add_junit_xml(path, filename=filename)
+
+        if args.dump:
+            sys.stdout.write(uploader.get_payload())
+            sys.stdout.write('\n')
+            return 0
+
+        errors = uploader.run_pipelines()
+    finally:
+        uploader.close()
+
+    failed = False
+    for pipeline, error in errors.items():
+        if error is None:
+            sys.stdout.write(f'Uploaded {pipeline}.\n')
+        else:
+            failed = True
+            sys.stdout.write(f'ERROR: {error}\n')
+
+    for _, filename in report_files:
+        sys.stdout.write(f'Report file {filename} included in upload.\n')
+    sys.stdout.write(
+        f'Combined {len(data_files)} shard(s) into a single upload.\n'
+    )
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
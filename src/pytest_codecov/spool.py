@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+import pytest_codecov.codecov as codecov
+
+if TYPE_CHECKING:
+    import requests
+    from collections.abc import Sequence
+
+
+PAYLOAD_FILE = 'payload.gz'
+TEST_RESULTS_FILE = 'test_results.json'
+METADATA_FILE = 'metadata.json'
+
+
+def spool_report(
+    uploader: codecov.CodecovUploader,
+    directory: str,
+    token_env: str | None = 'CODECOV_TOKEN',  # noqa: S107
+    coverage: bool = True
+) -> str:
+    """ Writes the compressed payload, test results and metadata of the
+    given uploader to a new entry in the spool directory.
+
+    Pass `coverage=False` to only spool the test results.
+
+    The token itself is never written to disk, instead we store the name
+    of the environment variable it should be read from when draining. If
+    `token_env` is `None` the token has to be passed to the drain.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = f'{time.strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex}'
+    # NOTE: We write to a hidden directory first and rename it once the
+    #       entry is complete, so a drain never sees a partial entry
+    tmp_path = os.path.join(directory, f'.{name}')
+    os.mkdir(tmp_path)
+    try:
+        if coverage:
+            payload_path = os.path.join(tmp_path, PAYLOAD_FILE)
+            gz_payload = uploader.compress_payload()
+            with gz_payload, open(payload_path, 'wb') as fp:
+                shutil.copyfileobj(gz_payload, fp, uploader.chunk_size)
+
+        test_results = uploader.test_results_payload()
+        if test_results is not None:
+            test_results_path = os.path.join(tmp_path, TEST_RESULTS_FILE)
+            with test_results, open(test_results_path, 'wb') as fp:
+                shutil.copyfileobj(test_results, fp, uploader.chunk_size)
+
+        with open(os.path.join(tmp_path, METADATA_FILE), 'w') as fp:
+            json.dump({
+                'slug': uploader.slug,
+                'branch': uploader.branch,
+                'commit': uploader.commit,
+                'flags': uploader.flags,
+                'token_env': token_env,
+            }, fp)
+
+        path = os.path.join(directory, name)
+        os.rename(tmp_path, path)
+    except BaseException:
+        # NOTE: Nothing ever picks up a hidden entry, so we clean up
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return path
+
+
+def spooled_reports(directory: str) -> list[str]:
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+
+    return [
+        os.path.join(directory, name)
+        for name in names
+        if not name.startswith('.')
+        and os.path.isfile(os.path.join(directory, name, METADATA_FILE))
+    ]
+
+
+def upload_spooled_report(
+    path: str,
+    session: requests.Session,
+    token: str | None = None,
+    retry_policy: codecov.RetryPolicy | None = None
+) -> dict[str, codecov.CodecovError | None]:
+    """ Uploads a single spool entry and removes the parts of it that
+    were uploaded successfully, so a later drain only retries the rest.
+
+    """
+    with open(os.path.join(path, METADATA_FILE)) as fp:
+        metadata = json.load(fp)
+
+    if token is None and metadata.get('token_env'):
+        token = os.environ.get(metadata['token_env']) or None
+
+    uploader = codecov.CodecovUploader(
+        metadata['slug'],
+        commit=metadata['commit'],
+        branch=metadata['branch'],
+        token=token,
+        session=session,
+        retry_policy=retry_policy,
+        flags=metadata.get('flags', ()),
+    )
+    errors: dict[str, codecov.CodecovError | None] = {}
+    try:
+        payload_path = os.path.join(path, PAYLOAD_FILE)
+        if os.path.isfile(payload_path):
+            try:
+                with open(payload_path, 'rb') as gz_payload:
+                    uploader.ping_coverage()
+                    uploader.upload_coverage(gz_payload)
+            except codecov.CodecovError as error:
+                errors['coverage'] = error
+            else:
+                errors['coverage'] = None
+                os.remove(payload_path)
+
+        test_results_path = os.path.join(path, TEST_RESULTS_FILE)
+        if os.path.isfile(test_results_path):
+            try:
+                with open(test_results_path, 'rb') as test_results:
+                    uploader.ping_test_results()
+                    uploader.upload_test_results(test_results)
+            except codecov.CodecovError as error:
+                errors['test results'] = error
+            else:
+                errors['test results'] = None
+                os.remove(test_results_path)
+    finally:
+        uploader.close()
+
+    if not any(errors.values()):
+        shutil.rmtree(path)
+    return errors
+
+
+def drain(
+    directory: str,
+    token: str | None = None,
+    workers: int = 4,
+    retry_policy: codecov.RetryPolicy | None = None
+) -> dict[str, dict[str, codecov.CodecovError | None]]:
+    """ Uploads all the spooled reports concurrently over a shared pool
+    of connections.
+
+    """
+    paths = spooled_reports(directory)
+    if not paths:
+        return {}
+
+    def upload(path: str) -> dict[str, codecov.CodecovError | None]:
+        try:
+            return upload_spooled_report(
+                path,
+                session,
+                token=token,
+                retry_policy=retry_policy
+            )
+        except Exception as exc:
+            # NOTE: A broken entry, e.g. one with corrupt metadata, must
+            #       not keep the other entries from being uploaded
+            return {'report': codecov.CodecovError(
+                f'Failed to upload spooled report: {exc!r}'
+            )}
+
+    workers = max(min(workers, len(paths)), 1)
+    session = codecov.create_session(pool_maxsize=workers * 2)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(paths, executor.map(upload, paths)))
+    finally:
+        session.close()
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    from pytest_codecov import validate_token
+
+    parser = argparse.ArgumentParser(
+        prog='pytest-codecov-drain',
+        description='Upload reports spooled by pytest --codecov-spool.'
+    )
+    parser.add_argument('directory', help='The spool directory.')
+    parser.add_argument(
+        '--token',
+        type=validate_token,
+        default=None,
+        help='The codecov token, by default it is read from the '
+             'environment variable recorded with each report.'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='How many reports to upload concurrently.'
+    )
+    parser.add_argument(
+        '--retries',
+        type=int,
+        default=2,
+        help='How many times failed requests are retried.'
+    )
+    parser.add_argument(
+        '--retry-backoff',
+        type=float,
+        default=1.0,
+        help='Initial delay between retries in seconds.'
+    )
+    args = parser.parse_args(argv)
+
+    results = drain(
+        args.directory,
+        token=args.token,
+        workers=args.workers,
+        retry_policy=codecov.RetryPolicy(
+            attempts=args.retries + 1,
+            backoff=args.retry_backoff,
+        ),
+    )
+    failed = False
+    for path, errors in results.items():
+        name = os.path.basename(path)
+        for pipeline, error in errors.items():
+            if error is None:
+                sys.stdout.write(f'{name}: Uploaded {pipeline}.\n')
+            else:
+                failed = True
+                sys.stdout.write(f'{name}: ERROR: {error}\n')
+
+    sys.stdout.write(f'Drained {len(results)} spooled report(s).\n')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,19 @@
 from __future__ import annotations
 
 import importlib
+import io
 import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
 from typing import Any
+from typing import IO
 from typing import TYPE_CHECKING
 
 import pytest
+import requests
+from coverage import CoverageData
 from coverage.exceptions import CoverageException
 
 import pytest_codecov
@@ -14,6 +22,12 @@ import pytest_codecov.git
 
 if TYPE_CHECKING:
     from _typeshed import StrOrBytesPath
+    from collections.abc import Iterable
+    from collections.abc import Iterator
+    from pytest_codecov.codecov import CodecovError
+    from pytest_codecov.codecov import CodecovUploader
+    from pytest_codecov.codecov import CompressionStats
+    from pytest_codecov.codecov import SlimStats
 
     from coverage import Coverage
 
@@ -31,9 +45,10 @@ def no_gitpython(monkeypatch: pytest.MonkeyPatch) -> None:
     monkeypatch.setattr('pytest_codecov.git.slug', None)
     monkeypatch.setattr('pytest_codecov.git.branch', None)
     monkeypatch.setattr('pytest_codecov.git.commit', None)
+    git = pytest_codecov.git  # type: ignore[attr-defined]
     monkeypatch.setattr(
         'pytest_codecov.git.ls_files',
-        pytest_codecov.git.os_ls_files  # type: ignore[attr-defined]
+        lambda matcher=git.default_matcher: git.os_ls_files(matcher=matcher)
     )
 
 
@@ -68,7 +83,19 @@ def dummy_reporter() -> DummyReporter:
 
 class DummyCoverage(Coverage):
 
-    def xml_report(self, outfile: StrOrBytesPath) -> None:  # type: ignore[override]
+    def __init__(self) -> None:
+        self.measured_files: list[str] = []
+
+    def get_data(self) -> CoverageData:
+        data = CoverageData(no_disk=True)
+        data.add_lines({path: [1] for path in self.measured_files})
+        return data
+
+    def xml_report(  # type: ignore[override]
+        self,
+        morfs: Iterable[str] | None = None,
+        outfile: StrOrBytesPath = 'coverage.xml'
+    ) -> None:
         with open(outfile, 'w') as fp:
             fp.write('<dummy_report/>')
 
@@ -78,6 +105,10 @@ def dummy_cov() -> DummyCoverage:
     return DummyCoverage()
 
 
+# NOTE: Kept around so fixtures can restore it for local requests
+session_request = requests.sessions.Session.request
+
+
 @pytest.fixture(autouse=True)
 def no_requests(monkeypatch: pytest.MonkeyPatch) -> None:
     # prevents tests from making live requests
@@ -86,9 +117,17 @@ def no_requests(monkeypatch: pytest.MonkeyPatch) -> None:
 
 class MockResponse:
 
-    def __init__(self, text: str = '', ok: bool = True) -> None:
+    def __init__(
+        self,
+        text: str = '',
+        ok: bool = True,
+        status_code: int | None = None
+    ) -> None:
         self.text = text
         self.ok = ok
+        if status_code is None:
+            status_code = 200 if ok else 400
+        self.status_code = status_code
 
     def json(self) -> Any:
         return json.loads(self.text)
@@ -104,8 +143,13 @@ class MockRequests:
         self._response = MockResponse()
         self.mock_connection_error = False
 
-    def set_response(self, text: str, ok: bool = True) -> None:
-        self._response = MockResponse(text, ok=ok)
+    def set_response(
+        self,
+        text: str,
+        ok: bool = True,
+        status_code: int | None = None
+    ) -> None:
+        self._response = MockResponse(text, ok=ok, status_code=status_code)
 
     def set_responses(self, *texts: str) -> None:
         assert texts
@@ -141,19 +185,120 @@ class MockRequests:
 
 @pytest.fixture
 def mock_requests(monkeypatch: pytest.MonkeyPatch) -> MockRequests:
-    monkeypatch.undo()
     mock_requests = MockRequests()
     monkeypatch.setattr(
         'requests.sessions.Session.request',
-        mock_requests.mock_method
+        mock_requests.mock_method,
+        raising=False
     )
     return mock_requests
 
 
+class LocalServerHandler(BaseHTTPRequestHandler):
+
+    server: LocalServer
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def read_body(self) -> bytes:
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                chunk = self.rfile.read(size + 2)[:size]
+                if not size:
+                    return body
+                body += chunk
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def respond(self, status: int, body: str = '') -> None:
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_request(self) -> None:
+        body = self.read_body()
+        server = self.server
+        path = self.path.split('?')[0]
+        with server.lock:
+            server.requests.append((self.command, self.path, body))
+            failures = server.failures.get(path, 0)
+            if failures:
+                server.failures[path] = failures - 1
+
+        if failures:
+            self.respond(503, 'Service Unavailable')
+        elif self.path.startswith('/upload/v4'):
+            self.respond(200, f'{server.url}\n{server.url}/storage/coverage')
+        elif self.path.startswith('/upload/test_results/v1'):
+            self.respond(200, json.dumps({
+                'raw_upload_location': f'{server.url}/storage/test_results'
+            }))
+        elif self.path.startswith('/storage/'):
+            self.respond(200)
+        else:
+            self.respond(404, 'Not Found')
+
+    do_POST = do_PUT = handle_request  # noqa: N815
+
+
+class LocalServer(ThreadingHTTPServer):
+    """ Local stand-in for the codecov API and storage endpoints. """
+
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(('127.0.0.1', 0), LocalServerHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.failures: dict[str, int] = {}
+        self.requests: list[tuple[str, str, bytes]] = []
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host!s}:{port}'
+
+    def configure(self, uploader: CodecovUploader) -> None:
+        uploader.api_endpoint = self.url
+        uploader.storage_endpoint = f'{self.url}/storage/'
+
+
+@pytest.fixture
+def local_server(monkeypatch: pytest.MonkeyPatch) -> Iterator[LocalServer]:
+    # allow real requests against our local server
+    monkeypatch.setattr(
+        'requests.sessions.Session.request',
+        session_request,
+        raising=False
+    )
+    server = LocalServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
 class DummyUploader:
     # TODO: Implement some basic behavior, so we can test
     #       more exhaustively.
 
+    slug = 'foo/bar'
+    branch = 'master'
+    commit = 'deadbeef'
+    chunk_size = 1024
+
     def __init__(
         self,
         factory: DummyUploaderFactory,
@@ -161,38 +306,128 @@ class DummyUploader:
         **kwargs: object
     ) -> None:
         self.factory = factory
+        self.factory.kwargs = kwargs
+        self.compression_stats = factory.compression_stats
+        self.junit_stats: SlimStats | None = None
+        self.flags = kwargs.get('flags', [])
 
     def add_network_files(self, files: list[str]) -> None:
         pass
 
-    def add_coverage_report(self, cov: object) -> None:
+    def add_compressed_network(self, gz_network: bytes) -> None:
+        self.factory.compressed_network = gz_network
+
+    def add_coverage_report(self, cov: object, **kwargs: object) -> None:
+        self.factory.report_format = 'xml'
+        self.factory.morfs = kwargs.get('morfs')
         if self.factory.fail_report_generation:
             raise CoverageException('test exception')
 
-    def add_junit_xml(self, path: StrOrBytesPath) -> None:
+    def add_json_coverage_report(
+        self,
+        cov: object,
+        workers: int,
+        morfs: object = None
+    ) -> None:
+        self.factory.report_format = 'json'
+        self.factory.report_workers = workers
+        self.factory.morfs = morfs
+
+    def add_report_file(
+        self,
+        path: StrOrBytesPath,
+        filename: str | None = None
+    ) -> None:
+        self.factory.report_files.append(path)
+        self.factory.filenames.append(filename)
+
+    def add_junit_xml(
+        self,
+        path: StrOrBytesPath,
+        filename: str = 'junit.xml',
+        slim: bool = False,
+        max_message_length: int = 1000
+    ) -> None:
+        error = self.factory.junit_errors.get(os.fsdecode(path))
+        if error is not None:
+            raise error
+        if filename != 'junit.xml':
+            self.factory.junit_files.append(path)
+            self.factory.filenames.append(filename)
+            return
         self.factory.junit_xml = path
+        self.factory.junit_max_message_length = max_message_length
+        if slim:
+            codecov = pytest_codecov.codecov  # type: ignore[attr-defined]
+            self.junit_stats = codecov.SlimStats(100, 40)
 
     def get_payload(self) -> str:
         return 'stub'
 
+    def payload_digest(self) -> str:
+        return self.factory.digest
+
     def ping(self) -> None:
         pass
 
     def upload(self) -> None:
         pass
 
+    def compress_payload(self) -> IO[bytes]:
+        return io.BytesIO(b'stub')
+
+    def test_results_payload(self) -> IO[bytes] | None:
+        return None
+
+    def run_pipelines(
+        self,
+        coverage: bool = True
+    ) -> dict[str, CodecovError | None]:
+        self.factory.uploads += 1
+        self.factory.upload_coverage = coverage
+        errors = dict(self.factory.pipeline_errors)
+        if not coverage:
+            errors.pop('coverage', None)
+            errors.setdefault('test results', None)
+        return errors
+
+    def close(self) -> None:
+        pass
+
 
 class DummyUploaderFactory:
 
     def __init__(self) -> None:
         self.fail_report_generation = False
         self.junit_xml: StrOrBytesPath | None = None
+        self.junit_max_message_length: int | None = None
+        self.junit_files: list[StrOrBytesPath] = []
+        self.report_files: list[StrOrBytesPath] = []
+        self.filenames: list[str | None] = []
+        self.junit_errors: dict[str, Exception] = {}
+        self.kwargs: dict[str, object] = {}
+        self.morfs: object = None
+        self.compressed_network: bytes | None = None
+        self.digest = 'digest'
+        self.uploads = 0
+        self.upload_coverage = True
+        self.report_format: str | None = None
+        self.report_workers = 1
+        self.compression_stats: CompressionStats | None = None
+        self.pipeline_errors: dict[str, CodecovError | None] = {
+            'coverage': None
+        }
 
     def __call__(self, slug: str, **kwargs: object) -> DummyUploader:
         return DummyUploader(self, slug, **kwargs)
 
     def clear(self) -> None:
         self.junit_xml = None
+        self.junit_files = []
+        self.report_files = []
+        self.filenames = []
+        self.morfs = None
+        self.compressed_network = None
 
 
 @pytest.fixture
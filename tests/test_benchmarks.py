@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import pathlib
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+from typing import Callable
+from typing import cast
+from typing import TYPE_CHECKING
+
+import pytest
+
+from pytest_codecov import CodecovWorkerPlugin
+from pytest_codecov import get_compressed_network
+from pytest_codecov.codecov import CodecovUploader
+from pytest_codecov.git import PathMatcher
+from pytest_codecov.git import _git_ls_files
+from pytest_codecov.git import _subprocess_ls_files
+from pytest_codecov.git import os_ls_files
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from pathlib import Path
+
+
+RecordProperty = Callable[[str, object], None]
+
+
+# NOTE: The pre-scandir implementation of os_ls_files, which we keep
+#       around as a reference to benchmark against
+_legacy_exclude_pattern = re.compile(
+    r'/(\.?virtualenvs?|'
+    r'\.?v?envs?|'
+    r'\.git|'
+    r'\.tox|'
+    r'\.pytest_cache|'
+    r'\.coverage|'
+    r'coverage\.xml|'
+    r'[^/]*\.egg-info|'
+    r'vendor|'
+    r'__pycache__|'
+    r'node_modules)(/|$)'
+)
+
+
+def legacy_os_ls_files() -> list[str]:
+    basedir = os.getcwd()
+    paths = []
+    for path in pathlib.Path(basedir).glob('**/*'):
+        if path.is_dir():
+            continue
+        if path.suffix in ('.png', '.gif', '.jpg', '.jpeg', '.md'):
+            continue
+
+        str_path = str(path)
+        if _legacy_exclude_pattern.search(str_path):
+            continue
+        paths.append(os.path.relpath(str_path, basedir))
+    return paths
+
+
+@pytest.fixture
+def bench_scale() -> float:
+    # NOTE: The default sizes are kept small so the benchmarks stay cheap
+    #       as part of the regular test suite, they can be scaled up to
+    #       realistic sizes through this environment variable.
+    return float(os.environ.get('PYTEST_CODECOV_BENCH_SCALE', '1'))
+
+
+def _measure_import(code: str) -> dict[str, object]:
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    return json.loads(result.stdout)  # type: ignore[no-any-return]
+
+
+def test_plugin_import_cost(
+    record_property: RecordProperty
+) -> None:
+
+    lazy = _measure_import(
+        'import json, sys, time\n'
+        'start = time.perf_counter()\n'
+        'import pytest_codecov\n'
+        'elapsed = time.perf_counter() - start\n'
+        'print(json.dumps({\n'
+        '    "elapsed": elapsed,\n'
+        '    "gitpython": "git" in sys.modules,\n'
+        '    "detected": pytest_codecov.git._metadata is not None,\n'
+        '    "modules": sorted(sys.modules),\n'
+        '}))\n'
+    )
+    eager = _measure_import(
+        'import json, sys, time\n'
+        'start = time.perf_counter()\n'
+        'import pytest_codecov\n'
+        'pytest_codecov.git.commit\n'
+        'elapsed = time.perf_counter() - start\n'
+        'print(json.dumps({"elapsed": elapsed}))\n'
+    )
+    record_property('lazy_import_seconds', lazy['elapsed'])
+    record_property('eager_import_seconds', eager['elapsed'])
+
+    # importing the plugin must not touch GitPython or the repository
+    assert lazy['gitpython'] is False
+    assert lazy['detected'] is False
+    # nor load the upload machinery, unless the plugin is enabled
+    loaded = set(cast('list[str]', lazy['modules']))
+    assert loaded.isdisjoint({
+        'pytest_codecov.codecov',
+        'pytest_codecov.shard',
+        'pytest_codecov.spool',
+        'concurrent.futures',
+        'requests',
+        'multiprocessing',
+    })
+
+
+def test_ls_files_backends(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    record_property: RecordProperty,
+    bench_scale: float
+) -> None:
+
+    num_files = int(2000 * bench_scale)
+    for i in range(num_files):
+        directory = tmp_path / f'pkg{i % 50}'
+        directory.mkdir(exist_ok=True)
+        (directory / f'module{i}.py').write_text('')
+
+    def git(*args: str) -> None:
+        subprocess.run(
+            ['git', '-c', 'user.name=bench', '-c', 'user.email=bench@local',
+             *args],
+            cwd=tmp_path,
+            check=True,
+            capture_output=True,
+        )
+
+    git('init')
+    git('add', '.')
+    git('commit', '-m', 'Initial commit')
+    monkeypatch.chdir(tmp_path)
+
+    backends: dict[str, Callable[[], Iterable[str]]] = {
+        'subprocess': _subprocess_ls_files,
+        'gitpython': _git_ls_files,
+        'os': os_ls_files,
+    }
+    results = {}
+    for name, backend in backends.items():
+        start = time.perf_counter()
+        results[name] = sorted(backend())
+        elapsed = time.perf_counter() - start
+        record_property(f'{name}_ls_files_seconds', elapsed)
+
+    assert len(results['subprocess']) == num_files
+    assert results['subprocess'] == results['gitpython']
+    assert results['subprocess'] == results['os']
+
+
+def test_worker_network(
+    pytester: pytest.Pytester,
+    monkeypatch: pytest.MonkeyPatch,
+    record_property: RecordProperty,
+    bench_scale: float
+) -> None:
+
+    num_files = int(2000 * bench_scale)
+    for i in range(num_files):
+        directory = pytester.path / f'pkg{i % 50}'
+        directory.mkdir(exist_ok=True)
+        (directory / f'module{i}.py').write_text('')
+
+    monkeypatch.chdir(pytester.path)
+    config = pytester.parseconfig('--codecov')
+
+    # without the worker plugin the controller lists the files serially
+    start = time.perf_counter()
+    expected = get_compressed_network(config)
+    serial = time.perf_counter() - start
+    record_property('serial_network_seconds', serial)
+
+    # the worker lists them while its tests run, so its session only ends
+    # up waiting for whatever is left once the tests are done
+    workeroutput: dict[str, object] = {}
+    monkeypatch.setattr(config, 'workeroutput', workeroutput, raising=False)
+    session = cast('pytest.Session', types.SimpleNamespace(config=config))
+    plugin = CodecovWorkerPlugin()
+    plugin.pytest_sessionstart(session)
+    time.sleep(serial)
+    start = time.perf_counter()
+    plugin.pytest_sessionfinish(session)
+    record_property('worker_network_wait_seconds', time.perf_counter() - start)
+
+    assert workeroutput['codecov_network'] == expected
+
+
+def test_os_ls_files_pruning(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    record_property: RecordProperty,
+    bench_scale: float
+) -> None:
+
+    num_files = int(500 * bench_scale)
+    for i in range(num_files):
+        directory = tmp_path / 'src' / f'pkg{i % 20}'
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f'module{i}.py').write_text('')
+
+    # excluded directories are typically much larger than the project
+    for excluded in ('node_modules', '.tox', '.venv'):
+        for i in range(num_files * 4):
+            directory = tmp_path / excluded / f'dep{i % 100}' / 'lib'
+            directory.mkdir(parents=True, exist_ok=True)
+            (directory / f'file{i}.js').write_text('')
+
+    monkeypatch.chdir(tmp_path)
+
+    start = time.perf_counter()
+    legacy = sorted(legacy_os_ls_files())
+    record_property('legacy_os_ls_files_seconds', time.perf_counter() - start)
+
+    start = time.perf_counter()
+    pruned = sorted(os_ls_files())
+    record_property('os_ls_files_seconds', time.perf_counter() - start)
+
+    assert len(pruned) == num_files
+    assert pruned == legacy
+
+
+def test_path_matcher(
+    record_property: RecordProperty,
+    bench_scale: float
+) -> None:
+
+    # NOTE: Use PYTEST_CODECOV_BENCH_SCALE=10 for a million paths
+    templates = (
+        'src/pkg{0}/module{0}.py',
+        'tests/pkg{0}/test_module{0}.py',
+        'docs/images/figure{0}.png',
+        'docs/chapter{0}.md',
+        'frontend/node_modules/dep{0}/index.js',
+        'build/lib/pkg{0}/module{0}.py',
+        'src/pkg{0}/__pycache__/module{0}.pyc',
+        'static/icons/icon{0}.svg',
+        'foo{0}.egg-info/PKG-INFO',
+        'fixtures/data{0}.json',
+    )
+    paths = [
+        template.format(i)
+        for i in range(int(10000 * bench_scale))
+        for template in templates
+    ]
+
+    def legacy_matcher(path: str) -> bool:
+        extension = os.path.splitext(path)[1]
+        if extension in ('.png', '.gif', '.jpg', '.jpeg', '.md'):
+            return False
+        if _legacy_exclude_pattern.search(f'/{path}'):
+            return False
+        return not any(
+            re.fullmatch(pattern, path)
+            for pattern in (r'build/.*', r'.*\.svg')
+        )
+
+    start = time.perf_counter()
+    legacy = [path for path in paths if legacy_matcher(path)]
+    elapsed = time.perf_counter() - start
+    record_property('legacy_paths_per_second', len(paths) / elapsed)
+
+    matcher = PathMatcher(exclude=['build/*', '*.svg'])
+    start = time.perf_counter()
+    matched = list(filter(matcher, paths))
+    elapsed = time.perf_counter() - start
+    record_property('matcher_paths_per_second', len(paths) / elapsed)
+
+    assert matched == legacy
+    assert len(matched) == len(paths) * 3 // 10
+
+
+def test_report_formats(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    record_property: RecordProperty,
+    bench_scale: float
+) -> None:
+
+    from coverage import Coverage
+    from coverage import CoverageData
+
+    num_files = int(10 * bench_scale)
+    num_lines = 200
+    source = ''.join(f'a{i} = {i}\n' for i in range(num_lines))
+    measured = {}
+    for i in range(num_files):
+        directory = tmp_path / 'src' / f'pkg{i % 10}'
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'module{i}.py'
+        path.write_text(source)
+        measured[str(path)] = list(range(1, num_lines + 1, 2))
+
+    data = CoverageData(basename=str(tmp_path / '.coverage'))
+    data.add_lines(measured)
+    data.write()
+    monkeypatch.chdir(tmp_path)
+
+    workers = os.cpu_count() or 1
+
+    def generate(report_format: str) -> int:
+        cov = Coverage(data_file=str(tmp_path / '.coverage'))
+        cov.load()
+        uploader = CodecovUploader('seantis/pytest-codecov')
+        if report_format == 'json_parallel':
+            uploader.add_json_coverage_report(cov, workers=max(workers, 2))
+        elif report_format == 'json':
+            uploader.add_json_coverage_report(cov)
+        else:
+            uploader.add_coverage_report(cov)
+        size = len(uploader.get_payload())
+        uploader.close()
+        return size
+
+    record_property('cpu_count', workers)
+    for report_format in ('xml', 'json', 'json_parallel'):
+        start = time.perf_counter()
+        size = generate(report_format)
+        record_property(
+            f'{report_format}_report_seconds',
+            time.perf_counter() - start
+        )
+        record_property(f'{report_format}_report_bytes', size)
+
+        tracemalloc.start()
+        try:
+            generate(report_format)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        record_property(f'{report_format}_report_peak_bytes', peak)
+
+
+def test_parallel_compression(
+    record_property: RecordProperty,
+    bench_scale: float
+) -> None:
+
+    uploader = CodecovUploader('seantis/pytest-codecov', compression_level=6)
+    uploader.parallel_threshold = 0
+    uploader.parallel_chunk_size = 1024 * 1024
+    uploader._write('<coverage>\n')
+    for i in range(int(50000 * bench_scale)):
+        uploader._write(
+            f'<class name="module{i}.py" filename="src/module{i}.py">'
+            f'<lines><line number="{i % 300}" hits="{i % 7}"/></lines>'
+            '</class>\n'
+        )
+    uploader._write('</coverage>')
+    expected = uploader.get_payload().encode('utf-8')
+
+    for workers in (1, 2, 4):
+        uploader.compression_workers = workers
+        with uploader.compress_payload() as gz_payload:
+            assert gzip.decompress(gz_payload.read()) == expected
+
+        stats = uploader.compression_stats
+        assert stats is not None
+        assert stats.workers == workers
+        record_property(
+            f'compression_mb_per_second_{workers}_workers',
+            stats.raw_size / stats.seconds / 1024 / 1024
+        )
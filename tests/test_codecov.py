@@ -1,16 +1,39 @@
 from __future__ import annotations
 
+import base64
+import gzip
+import io
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+import zlib
+from typing import Any
 from typing import TYPE_CHECKING
 
 import pytest
+import requests
 
 from pytest_codecov.codecov import CodecovError
 from pytest_codecov.codecov import CodecovUploader
+from pytest_codecov.codecov import MeasuredFiles
+from pytest_codecov.codecov import PayloadDigest
+from pytest_codecov.codecov import RetryPolicy
+from pytest_codecov.codecov import UploadProfile
+from pytest_codecov.codecov import compress_network
+from pytest_codecov.codecov import decompress_network
+from pytest_codecov.codecov import slim_junit_xml
 
 if TYPE_CHECKING:
     from pathlib import Path
 
+    from _typeshed import StrOrBytesPath
+
     from tests.conftest import DummyCoverage
+    from tests.conftest import DummyUploaderFactory
+    from tests.conftest import LocalServer
     from tests.conftest import MockRequests
 
 
@@ -32,6 +55,20 @@ def test_write_network_files() -> None:
     )
 
 
+def test_write_network_files_iterator() -> None:
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_network_files(iter(['foo.py', 'bar/baz.py']))
+    assert uploader.get_payload() == (
+        'foo.py\n'
+        'bar/baz.py\n'
+        '<<<<<< network'
+    )
+
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_network_files(iter([]))
+    assert uploader.get_payload() == '<<<<<< network'
+
+
 def test_add_coverage_report(dummy_cov: DummyCoverage) -> None:
     uploader = CodecovUploader('seantis/pytest-codecov')
     uploader.add_network_files(['foo.py'])
@@ -91,6 +128,65 @@ def test_ping_junit(
     assert uploader._test_result_store_url == uploader.storage_endpoint
 
 
+def test_ping_invalid_responses(
+    mock_requests: MockRequests,
+    tmp_path: Path
+) -> None:
+
+    junit_xml = tmp_path / 'junit.xml'
+    junit_xml.write_text('foo')
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_junit_xml(str(junit_xml))
+
+    endpoint = uploader.storage_endpoint
+    mock_requests.set_response(f'codecov.io\n{endpoint}', ok=False)
+    with pytest.raises(CodecovError, match=r'Invalid response'):
+        uploader.ping_coverage()
+
+    for text in (
+        '<html>Bad Gateway</html>',
+        '{"location": "https://example.com"}',
+        '["raw_upload_location"]',
+    ):
+        mock_requests.set_response(text)
+        with pytest.raises(CodecovError, match=r'Invalid response'):
+            uploader.ping_test_results()
+
+    mock_requests.set_response('{"raw_upload_location": null}')
+    with pytest.raises(CodecovError, match=r'Invalid test results'):
+        uploader.ping_test_results()
+    assert uploader._test_result_store_url is None
+
+    # the pipeline reports the error rather than crashing
+    mock_requests.set_response('<html>Bad Gateway</html>')
+    errors = uploader.run_pipelines()
+    assert 'codecov API' in str(errors['coverage'])
+    assert 'test results API' in str(errors['test results'])
+
+
+def test_ping_flags(
+    mock_requests: MockRequests,
+    tmp_path: Path
+) -> None:
+
+    junit_xml = tmp_path / 'junit.xml'
+    junit_xml.write_text('foo')
+    uploader = CodecovUploader(
+        'seantis/pytest-codecov',
+        flags=['unit', 'py312']
+    )
+    uploader.add_junit_xml(str(junit_xml))
+
+    mock_requests.set_responses(
+        f'codecov.io\n{uploader.storage_endpoint}',
+        f'{{"raw_upload_location":"{uploader.storage_endpoint}"}}'
+    )
+    uploader.ping()
+    (_, _, coverage), (_, _, test_results) = mock_requests.pop()
+    assert coverage['params']['flags'] == 'unit,py312'
+    assert test_results['json']['flags'] == ['unit', 'py312']
+
+
 def test_ping_no_slug(
     dummy_cov: DummyCoverage,
     mock_requests: MockRequests
@@ -147,3 +243,948 @@ def test_upload_junit(
     assert uploader._test_result_store_url is None
 
     # TODO: Verify correct url/headers/params
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1024 * 1024])
+def test_test_results_payload(tmp_path: Path, chunk_size: int) -> None:
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.chunk_size = chunk_size
+    assert uploader.test_results_payload() is None
+
+    junit = [
+        '<testsuite tests="1"><testcase name="foo"/></testsuite>',
+        '<testsuite tests="0"/>',
+    ]
+    for i, content in enumerate(junit):
+        junit_xml = tmp_path / f'junit{i}.xml'
+        junit_xml.write_text(content)
+        uploader.add_junit_xml(str(junit_xml), filename=f'junit{i}.xml')
+
+    payload = uploader.test_results_payload()
+    assert payload is not None
+    with payload:
+        test_results = json.load(payload)
+
+    files = test_results['test_results_files']
+    assert [f['filename'] for f in files] == ['junit0.xml', 'junit1.xml']
+    for test_result_file, content in zip(files, junit):
+        assert test_result_file['format'] == 'base64+compressed'
+        assert test_result_file['labels'] == ''
+        data = base64.b64decode(test_result_file['data'])
+        assert zlib.decompress(data).decode() == content
+
+    # the payload can be built more than once
+    payload = uploader.test_results_payload()
+    assert payload is not None
+    with payload:
+        assert json.load(payload) == test_results
+
+
+def test_add_junit_xml_bounded_memory(tmp_path: Path) -> None:
+    junit_size = 16 * 1024 * 1024
+    junit_xml = tmp_path / 'junit.xml'
+    with open(junit_xml, 'w') as fp:
+        fp.write('<testsuite>')
+        testcase = '<testcase classname="tests.test_foo" name="test_{}"/>\n'
+        written = 0
+        i = 0
+        while written < junit_size:
+            written += fp.write(testcase.format(i))
+            i += 1
+        fp.write('</testsuite>')
+
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.spool_size = 1024 * 1024
+
+    tracemalloc.start()
+    try:
+        uploader.add_junit_xml(str(junit_xml))
+        payload = uploader.test_results_payload()
+        assert payload is not None
+        payload.close()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        uploader.close()
+
+    # peak memory is bounded by the spool size rather than the size
+    # of the JUnit XML
+    assert peak < 4 * 1024 * 1024
+
+
+def test_slim_junit_xml(tmp_path: Path) -> None:
+    junit_xml = tmp_path / 'junit.xml'
+    junit_xml.write_text(
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<testsuites>\n'
+        '<testsuite name="pytest" failures="1" tests="2">\n'
+        '<properties><property name="foo" value="bar"/></properties>\n'
+        '<testcase classname="test_foo" name="test_a" time="0.1">\n'
+        '<system-out>captured output</system-out>\n'
+        '<system-err>captured error</system-err>\n'
+        '</testcase>\n'
+        '<testcase classname="test_foo" name="test_b" time="0.2">\n'
+        '<failure message="assert 1 == 2 &amp; more">Traceback</failure>\n'
+        '<properties><property name="foo" value="bar"/></properties>\n'
+        '</testcase>\n'
+        '<system-out>suite output</system-out>\n'
+        '</testsuite>\n'
+        '</testsuites>\n'
+    )
+    slim = b''.join(slim_junit_xml(str(junit_xml), max_message_length=6))
+    assert slim.decode() == (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<testsuites>'
+        '<testsuite name="pytest" failures="1" tests="2">'
+        '<testcase classname="test_foo" name="test_a" time="0.1" />'
+        '<testcase classname="test_foo" name="test_b" time="0.2">'
+        '<failure message="assert...">Traceb...</failure>'
+        '</testcase>'
+        '</testsuite>'
+        '</testsuites>'
+    )
+
+
+def test_add_junit_xml_slim(tmp_path: Path) -> None:
+    junit_xml = tmp_path / 'junit.xml'
+    junit_xml.write_text(
+        '<testsuite tests="1">'
+        '<testcase name="test_a"><system-out>output</system-out></testcase>'
+        '</testsuite>'
+    )
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_junit_xml(str(junit_xml))
+    assert uploader.junit_stats is None
+
+    uploader.add_junit_xml(str(junit_xml), filename='slim.xml', slim=True)
+    assert uploader.junit_stats is not None
+    assert uploader.junit_stats.raw_size == junit_xml.stat().st_size
+    assert uploader.junit_stats.saved > 0
+
+    payload = uploader.test_results_payload()
+    assert payload is not None
+    with payload:
+        files = json.load(payload)['test_results_files']
+    assert [f['filename'] for f in files] == ['junit.xml', 'slim.xml']
+    data = zlib.decompress(base64.b64decode(files[1]['data']))
+    assert data == (
+        b'<?xml version="1.0" encoding="utf-8"?>'
+        b'<testsuite tests="1"><testcase name="test_a" /></testsuite>'
+    )
+    assert len(data) == uploader.junit_stats.slim_size
+
+
+def test_add_junit_xml_broken(tmp_path: Path) -> None:
+    from xml.etree.ElementTree import ParseError
+
+    broken_xml = tmp_path / 'broken.xml'
+    broken_xml.write_text('<testsuite tests="1"><testcase name="test_a">')
+    ok_xml = tmp_path / 'ok.xml'
+    ok_xml.write_text(
+        '<testsuite tests="1"><testcase name="test_a" /></testsuite>'
+    )
+
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    with pytest.raises(ParseError):
+        uploader.add_junit_xml(str(broken_xml), 'broken.xml', slim=True)
+    uploader.add_junit_xml(str(ok_xml), 'ok.xml', slim=True)
+
+    expected = CodecovUploader('seantis/pytest-codecov')
+    expected.add_junit_xml(str(ok_xml), 'ok.xml', slim=True)
+
+    # the broken file leaves no trace in the payload or its digest
+    payload = uploader.test_results_payload()
+    assert payload is not None
+    with payload:
+        files = json.load(payload)['test_results_files']
+    assert [f['filename'] for f in files] == ['ok.xml']
+    assert uploader.payload_digest() == expected.payload_digest()
+
+
+def test_slim_junit_xml_bounded_memory(tmp_path: Path) -> None:
+    junit_size = 16 * 1024 * 1024
+    junit_xml = tmp_path / 'junit.xml'
+    output = 'x' * 4096
+    with open(junit_xml, 'w') as fp:
+        fp.write('<testsuite>')
+        written = 0
+        i = 0
+        while written < junit_size:
+            written += fp.write(
+                f'<testcase name="test_{i}">'
+                f'<system-out>{output}</system-out>'
+                '</testcase>\n'
+            )
+            i += 1
+        fp.write('</testsuite>')
+
+    tracemalloc.start()
+    try:
+        size = sum(map(len, slim_junit_xml(str(junit_xml))))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert size < junit_size / 50
+    assert peak < 1024 * 1024
+
+
+def test_compress_payload(dummy_cov: DummyCoverage) -> None:
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_network_files(['foo.py'])
+    uploader.add_coverage_report(dummy_cov)
+    assert uploader.compression_stats is None
+    with uploader.compress_payload() as gz_payload:
+        assert gzip.decompress(gz_payload.read()).decode('utf-8') == (
+            uploader.get_payload()
+        )
+
+    stats = uploader.compression_stats
+    assert stats is not None
+    assert stats.level == 9
+    assert stats.raw_size == len(uploader.get_payload())
+    assert stats.compressed_size > 0
+    assert stats.ratio == stats.compressed_size / stats.raw_size
+
+    uploader.compression_level = 1
+    with uploader.compress_payload():
+        pass
+    assert uploader.compression_stats.level == 1
+
+
+def test_compress_payload_parallel() -> None:
+    uploader = CodecovUploader(
+        'seantis/pytest-codecov',
+        compression_level=6,
+        compression_workers=4
+    )
+    uploader.add_network_files(f'src/module{i}.py' for i in range(10000))
+    payload = uploader.get_payload()
+
+    # below the threshold we stay single-threaded
+    with uploader.compress_payload() as gz_payload:
+        assert gzip.decompress(gz_payload.read()).decode('utf-8') == payload
+    assert uploader.compression_stats is not None
+    assert uploader.compression_stats.workers == 1
+
+    uploader.parallel_threshold = 0
+    uploader.parallel_chunk_size = 1024
+    with uploader.compress_payload() as gz_payload:
+        data = gz_payload.read()
+
+    # the result is a valid multi-member gzip stream
+    assert gzip.decompress(data).decode('utf-8') == payload
+    assert data.count(b'\x1f\x8b\x08') >= len(payload) // 1024
+    assert uploader.compression_stats.workers == 4
+
+
+def test_add_report_file(tmp_path: Path) -> None:
+    report = tmp_path / 'lcov.info'
+    report.write_text('SF:foo.py\nDA:1,1\nend_of_record\n')
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_network_files(['foo.py'])
+    uploader.add_report_file(str(report))
+    uploader.add_report_file(str(report), filename='pkg/lcov.info')
+    assert uploader.get_payload() == (
+        'foo.py\n'
+        '<<<<<< network\n'
+        '# path=./lcov.info\n'
+        'SF:foo.py\nDA:1,1\nend_of_record\n\n'
+        '<<<<<< EOF\n'
+        '# path=./pkg/lcov.info\n'
+        'SF:foo.py\nDA:1,1\nend_of_record\n\n'
+        '<<<<<< EOF'
+    )
+
+
+def test_add_json_coverage_report(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    from coverage import Coverage
+    from coverage import CoverageData
+
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'src' / 'foo.py').write_text(
+        'a = 1\n'
+        'if a:\n'
+        '    b = 2\n'
+        'c = 3\n'
+    )
+    (tmp_path / 'bar.py').write_text('a = 1\nb = 2\n')
+    monkeypatch.chdir(tmp_path)
+    data = CoverageData(basename=str(tmp_path / '.coverage'))
+    data.add_arcs({
+        str(tmp_path / 'src' / 'foo.py'): [(-1, 1), (1, 2), (2, 4), (4, -1)],
+        str(tmp_path / 'bar.py'): [(-1, 1), (1, -1)],
+    })
+    data.write()
+    cov = Coverage(data_file=str(tmp_path / '.coverage'), branch=True)
+    cov.load()
+
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_network_files(['bar.py', 'src/foo.py'])
+    uploader.add_json_coverage_report(cov)
+    _, report = uploader.get_payload().split('<<<<<< network\n')
+    header, *lines, eof = report.splitlines()
+    assert header == '# path=./codecov.json'
+    assert eof == '<<<<<< EOF'
+    assert json.loads('\n'.join(lines)) == {
+        'coverage': {
+            'bar.py': {'1': 1, '2': 0},
+            'src/foo.py': {'1': 1, '2': '1/2', '3': 0, '4': 1},
+        }
+    }
+
+    # the report can be restricted to some of the files
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_json_coverage_report(cov, morfs=[str(tmp_path / 'bar.py')])
+    _, *lines, _ = uploader.get_payload().strip().splitlines()
+    assert json.loads('\n'.join(lines)) == {
+        'coverage': {'bar.py': {'1': 1, '2': 0}}
+    }
+
+
+def test_add_json_coverage_report_parallel(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    from coverage import Coverage
+    from coverage import CoverageData
+
+    (tmp_path / '.coveragerc').write_text(
+        '[report]\nomit = */omitted*.py\n'
+    )
+    measured = {}
+    for i in range(20):
+        path = tmp_path / f'module{i:02}.py'
+        path.write_text('a = 1\nb = 2\nc = 3\n')
+        measured[str(path)] = [1, 3] if i % 2 else [1]
+    for i in range(3):
+        path = tmp_path / f'omitted{i}.py'
+        path.write_text('a = 1\n')
+        measured[str(path)] = [1]
+
+    monkeypatch.chdir(tmp_path)
+    data = CoverageData(basename=str(tmp_path / '.coverage'))
+    data.add_lines(measured)
+    data.write()
+    cov = Coverage(data_file=str(tmp_path / '.coverage'))
+    cov.load()
+
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_json_coverage_report(cov)
+    expected = uploader.get_payload()
+    assert 'omitted' not in expected
+
+    # the report is stitched together in the same order
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_json_coverage_report(cov, workers=3)
+    assert uploader.get_payload() == expected
+
+    # data which only lives in memory is still reported in parallel, the
+    # workers are fresh interpreters, so this only breaks this process
+    def no_analysis(*args: object) -> None:
+        raise AssertionError('Analyzed the files in a single process')
+
+    monkeypatch.setattr(
+        'pytest_codecov.codecov._analysis_to_report',
+        no_analysis
+    )
+    cov = Coverage(data_file=None)
+    cov.get_data().add_lines(measured)
+    assert not os.path.exists(cov.get_data().data_filename())
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_json_coverage_report(cov, workers=3)
+    assert uploader.get_payload() == expected
+
+
+def test_add_json_coverage_report_parallel_settings(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    from coverage import Coverage
+    from coverage import CoverageData
+
+    (tmp_path / 'pkg').mkdir()
+    measured = {}
+    for i in range(10):
+        path = tmp_path / 'pkg' / f'module{i:02}.py'
+        path.write_text('a = 1\nif a:  # skip me\n    b = 2\nc = 3\n')
+        measured[str(path)] = [1, 2, 3, 4]
+    for i in range(3):
+        path = tmp_path / 'pkg' / f'omitted{i}.py'
+        path.write_text('a = 1\n')
+        measured[str(path)] = [1]
+
+    monkeypatch.chdir(tmp_path)
+    data = CoverageData(basename=str(tmp_path / '.coverage'))
+    data.add_lines(measured)
+    data.write()
+    # NOTE: Just like pytest-cov does for --cov=pkg, the settings are
+    #       passed in code rather than through a configuration file
+    cov = Coverage(
+        data_file=str(tmp_path / '.coverage'),
+        config_file=False,
+        source=[str(tmp_path / 'pkg')],
+        omit=['*/omitted*.py'],
+    )
+    cov.set_option('report:exclude_lines', ['skip me'])
+    cov.load()
+
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_json_coverage_report(cov)
+    expected = uploader.get_payload()
+    assert 'omitted' not in expected
+    assert '"pkg/module00.py": {"1":1,"4":1}' in expected
+
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_json_coverage_report(cov, workers=3)
+    assert uploader.get_payload() == expected
+
+
+def test_add_compressed_network(dummy_cov: DummyCoverage) -> None:
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_network_files(['foo.py', 'bar.py'])
+    uploader.add_coverage_report(dummy_cov)
+    expected = uploader.get_payload()
+
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    gz_network = compress_network(['foo.py', 'bar.py'])
+    uploader.add_compressed_network(gz_network)
+    uploader.add_coverage_report(dummy_cov)
+    assert uploader.get_payload() == expected
+    with uploader.compress_payload() as gz_payload:
+        data = gz_payload.read()
+
+    # by default the payload is a single gzip stream
+    assert not data.startswith(gz_network)
+    assert data.count(b'\x1f\x8b\x08') == 1
+    assert gzip.decompress(data).decode('utf-8') == expected
+    assert uploader.compression_stats is not None
+    assert uploader.compression_stats.raw_size == len(expected)
+
+    # parallel compression produces a multi-member stream anyway, so
+    # the precompressed network section is used as the first member
+    uploader.compression_workers = 2
+    uploader.parallel_threshold = 0
+    with uploader.compress_payload() as gz_payload:
+        data = gz_payload.read()
+    assert data.startswith(gz_network)
+    assert gzip.decompress(data).decode('utf-8') == expected
+    assert uploader.compression_stats.raw_size == len(expected)
+
+
+def test_decompress_network() -> None:
+    files = ['foo.py', 'src/bar.py']
+    assert decompress_network(compress_network(files)) == files
+    assert decompress_network(compress_network([])) == []
+
+
+def test_measured_files() -> None:
+    measured_files = MeasuredFiles(
+        ['/home/ci/repo/src/foo.py', '/home/ci/repo/bar.py'],
+        include=['docs/*.rst', '*.cfg']
+    )
+    # paths are matched regardless of the directory they're relative to
+    assert 'src/foo.py' in measured_files
+    assert 'repo/src/foo.py' in measured_files
+    assert 'foo.py' in measured_files
+    assert 'bar.py' in measured_files
+    assert 'src/bar.py' not in measured_files
+    assert 'src/baz.py' not in measured_files
+    assert 'rc/foo.py' not in measured_files
+
+    # the include globs are always kept
+    assert 'docs/index.rst' in measured_files
+    assert 'setup.cfg' in measured_files
+    assert 'docs/logo.png' not in measured_files
+    assert 'foo.py' in MeasuredFiles(['foo.py'])
+    assert 'bar.py' not in MeasuredFiles(['foo.py'])
+
+
+def test_payload_digest(tmp_path: Path) -> None:
+    def make_digest(
+        report: str,
+        junit: str,
+        commit: str = 'deadbeef',
+        flags: list[str] | None = None
+    ) -> str:
+        uploader = CodecovUploader(
+            'seantis/pytest-codecov',
+            commit=commit,
+            flags=flags or ()
+        )
+        uploader.add_network_files(['foo.py'])
+        uploader._write(report)
+        junit_xml = tmp_path / 'junit.xml'
+        junit_xml.write_text(junit)
+        uploader.add_junit_xml(str(junit_xml))
+        return uploader.payload_digest()
+
+    report = '<coverage version="7.0" timestamp="{}" lines-valid="1"/>'
+    junit = '<testsuite hostname="{}" time="{}" tests="1"/>'
+    digest = make_digest(report.format(1), junit.format('a', '0.1'))
+    # timestamps and durations don't change the digest
+    assert digest == make_digest(report.format(2), junit.format('b', '0.2'))
+    assert digest != make_digest(
+        report.format(1),
+        junit.format('a', '0.1'),
+        commit='cafebabe'
+    )
+    assert digest != make_digest(
+        report.format(1),
+        junit.format('a', '0.1'),
+        flags=['unit']
+    )
+    assert digest != make_digest(
+        report.format(1).replace('lines-valid="1"', 'lines-valid="2"'),
+        junit.format('a', '0.1')
+    )
+
+
+def test_payload_digest_chunks() -> None:
+    data = b'x' * 1000 + b' timestamp="12345"' + b'y' * 1000
+    expected = PayloadDigest()
+    expected.update(b'x' * 1000 + b'y' * 1000)
+
+    # attributes split between chunks are still ignored
+    for size in (1, 7, 256, 1009):
+        digest = PayloadDigest()
+        for offset in range(0, len(data), size):
+            digest.update(data[offset:offset + size])
+        assert digest.hexdigest() == expected.hexdigest()
+
+
+def test_auto_compression_level() -> None:
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.add_network_files(f'src/module{i}.py' for i in range(1000))
+    size = len(uploader.get_payload())
+    assert uploader.auto_compression_level(size) == 9
+
+    uploader.auto_max_level_size = 0
+    assert uploader.auto_compression_level(size) == 6
+
+    # we wouldn't be able to compress the payload within our budget
+    uploader.auto_time_budget = 0
+    assert uploader.auto_compression_level(size) == 1
+
+
+class LargeCoverage:
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+
+    def xml_report(
+        self,
+        morfs: object = None,
+        outfile: StrOrBytesPath = 'coverage.xml'
+    ) -> None:
+        line = '<line number="1" hits="1"/>\n'
+        lines = (line for _ in range(self.size // len(line)))
+        with open(outfile, 'w') as fp:
+            fp.writelines(lines)
+
+
+def test_upload_bounded_memory(
+    mock_requests: MockRequests,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    report_size = 16 * 1024 * 1024
+    uploaded = 0
+
+    def consume(
+        session: object,
+        method: str,
+        url: str,
+        **kwargs: Any
+    ) -> object:
+        nonlocal uploaded
+        if method.lower() == 'put':
+            decompressor = zlib.decompressobj(31)
+            for chunk in iter(lambda: kwargs['data'].read(65536), b''):
+                uploaded += len(decompressor.decompress(chunk, 65536))
+                while decompressor.unconsumed_tail:
+                    uploaded += len(decompressor.decompress(
+                        decompressor.unconsumed_tail,
+                        65536
+                    ))
+        return mock_requests.mock_method(method, url, **kwargs)
+
+    monkeypatch.setattr('requests.sessions.Session.request', consume)
+    mock_requests.set_response(
+        f'codecov.io\n{CodecovUploader.storage_endpoint}'
+    )
+
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    uploader.spool_size = 1024 * 1024
+
+    tracemalloc.start()
+    try:
+        uploader.add_network_files(f'src/module{i}.py' for i in range(100000))
+        uploader.add_coverage_report(
+            LargeCoverage(report_size)  # type: ignore[arg-type]
+        )
+        uploader.ping()
+        uploader.upload()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert uploaded > report_size - 1024
+    # peak memory is bounded by the spool size rather than the payload
+    assert peak < 8 * 1024 * 1024
+
+
+def test_session_reuse(
+    dummy_cov: DummyCoverage,
+    local_server: LocalServer,
+    tmp_path: Path
+) -> None:
+
+    junit_xml = tmp_path / 'junit.xml'
+    junit_xml.write_text('foo')
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    local_server.configure(uploader)
+    uploader.add_network_files(['foo.py'])
+    uploader.add_coverage_report(dummy_cov)
+    uploader.add_junit_xml(str(junit_xml))
+    uploader.ping()
+    uploader.upload()
+    uploader.close()
+
+    assert [
+        (method, path.split('?')[0])
+        for method, path, _ in local_server.requests
+    ] == [
+        ('POST', '/upload/v4'),
+        ('POST', '/upload/test_results/v1'),
+        ('PUT', '/storage/coverage'),
+        ('PUT', '/storage/test_results'),
+    ]
+    assert gzip.decompress(local_server.requests[2][2]).decode('utf-8') == (
+        'foo.py\n'
+        '<<<<<< network\n'
+        '# path=./coverage.xml\n'
+        '<dummy_report/>\n'
+        '<<<<<< EOF'
+    )
+    # all four requests were sent over a single kept-alive connection
+    assert local_server.connections == 1
+
+
+def test_local_server_keeps_patches(
+    dummy_uploader: DummyUploaderFactory,
+    local_server: LocalServer
+) -> None:
+
+    import pytest_codecov.codecov as codecov
+
+    # the server only lifts the ban on requests
+    uploader: object = codecov.CodecovUploader
+    assert uploader is dummy_uploader
+
+
+def test_session_injected(local_server: LocalServer) -> None:
+    session = requests.Session()
+    uploader = CodecovUploader('seantis/pytest-codecov', session=session)
+    local_server.configure(uploader)
+    assert uploader.session is session
+    uploader.ping()
+    uploader.upload()
+    uploader.close()
+
+    # sessions passed in by the caller remain open and usable
+    uploader = CodecovUploader('seantis/pytest-codecov', session=session)
+    local_server.configure(uploader)
+    uploader.ping()
+    assert len(local_server.requests) == 3
+    assert local_server.connections == 1
+    session.close()
+
+
+def test_run_pipelines(
+    dummy_cov: DummyCoverage,
+    local_server: LocalServer,
+    tmp_path: Path
+) -> None:
+
+    junit_xml = tmp_path / 'junit.xml'
+    junit_xml.write_text('foo')
+    uploader = CodecovUploader(
+        'seantis/pytest-codecov',
+        retry_policy=RetryPolicy(attempts=1)
+    )
+    local_server.configure(uploader)
+    uploader.add_coverage_report(dummy_cov)
+    assert uploader.run_pipelines() == {'coverage': None}
+
+    uploader.add_junit_xml(str(junit_xml))
+    assert uploader.run_pipelines() == {
+        'coverage': None,
+        'test results': None
+    }
+
+    # errors are reported per pipeline
+    local_server.failures['/storage/test_results'] = 1
+    errors = uploader.run_pipelines()
+    assert errors['coverage'] is None
+    assert 'Failed to upload test results' in str(errors['test results'])
+
+    local_server.failures['/storage/coverage'] = 1
+    errors = uploader.run_pipelines()
+    assert 'Failed to upload report' in str(errors['coverage'])
+    assert errors['test results'] is None
+
+    # the coverage pipeline can be skipped
+    local_server.requests.clear()
+    assert uploader.run_pipelines(coverage=False) == {'test results': None}
+    assert sorted(
+        path.split('?')[0] for _, path, _ in local_server.requests
+    ) == ['/storage/test_results', '/upload/test_results/v1']
+    uploader.close()
+
+
+def test_upload_profile() -> None:
+    profile = UploadProfile()
+    output = io.BytesIO(b'foo')
+    output.seek(0, 2)
+    with profile.measure('write', output):
+        output.write(b'bar')
+    with profile.measure('wait'):
+        time.sleep(0.01)
+    # phases which run more than once are summed up
+    with profile.measure('write', output):
+        output.write(b'baz!')
+    profile.add('wait', 0.5)
+
+    assert list(profile.seconds) == ['write', 'wait']
+    assert profile.sizes == {'write': 7}
+    assert profile.seconds['wait'] >= 0.51
+    assert re.fullmatch(
+        r'write \d+\.\d\ds \(7 bytes\), wait 0\.5\ds, total \d+\.\d\ds',
+        profile.summary()
+    )
+    data = profile.as_dict()
+    assert data['total_seconds'] > 0
+    assert [
+        (phase['name'], phase['bytes']) for phase in data['phases']
+    ] == [('write', 7), ('wait', None)]
+
+
+def test_run_pipelines_profile(
+    dummy_cov: DummyCoverage,
+    local_server: LocalServer,
+    tmp_path: Path
+) -> None:
+
+    junit_xml = tmp_path / 'junit.xml'
+    junit_xml.write_text('foo')
+    profile = UploadProfile()
+    uploader = CodecovUploader('seantis/pytest-codecov', profile=profile)
+    local_server.configure(uploader)
+    uploader.add_coverage_report(dummy_cov)
+    uploader.add_junit_xml(str(junit_xml))
+    payload_size = len(uploader.get_payload())
+    assert uploader.run_pipelines() == {
+        'coverage': None,
+        'test results': None
+    }
+    uploader.close()
+
+    assert uploader.profile is profile
+    assert sorted(profile.seconds) == [
+        'compress',
+        'junit',
+        'ping coverage',
+        'ping test results',
+        'report',
+        'upload coverage',
+        'upload test results',
+    ]
+    assert uploader.compression_stats is not None
+    assert profile.sizes['report'] == payload_size
+    assert profile.sizes['compress'] == (
+        uploader.compression_stats.compressed_size
+    )
+    assert profile.sizes['upload coverage'] == profile.sizes['compress']
+    uploaded = {
+        path: len(body)
+        for method, path, body in local_server.requests
+        if method == 'PUT'
+    }
+    assert profile.sizes['upload test results'] == (
+        uploaded['/storage/test_results']
+    )
+    assert profile.sizes['junit'] + len(b'{"test_results_files": []}') == (
+        uploaded['/storage/test_results']
+    )
+
+
+def test_run_pipelines_concurrently(
+    dummy_cov: DummyCoverage,
+    local_server: LocalServer,
+    tmp_path: Path
+) -> None:
+
+    # NOTE: The pings only get past the barrier if both of them are in
+    #       flight at the same time, so running the pipelines one after
+    #       the other breaks the barrier rather than relying on timing
+    barrier = threading.Barrier(2, timeout=10)
+
+    class BarrierSession(requests.Session):
+        def request(  # type: ignore[override]
+            self,
+            method: str,
+            url: str,
+            **kwargs: Any
+        ) -> requests.Response:
+            if method.lower() == 'post':
+                barrier.wait()
+            return super().request(method, url, **kwargs)
+
+    junit_xml = tmp_path / 'junit.xml'
+    junit_xml.write_text('foo')
+    session = BarrierSession()
+    uploader = CodecovUploader('seantis/pytest-codecov', session=session)
+    local_server.configure(uploader)
+    uploader.add_coverage_report(dummy_cov)
+    uploader.add_junit_xml(str(junit_xml))
+    assert uploader.run_pipelines() == {
+        'coverage': None,
+        'test results': None
+    }
+    session.close()
+    assert not barrier.broken
+    assert len(local_server.requests) == 4
+
+
+def test_retry_policy() -> None:
+    policy = RetryPolicy(backoff=1.0, max_backoff=5.0, jitter=0)
+    assert [policy.delay(attempt) for attempt in range(5)] == [
+        1.0, 2.0, 4.0, 5.0, 5.0
+    ]
+
+    policy = RetryPolicy(backoff=1.0, jitter=0.5)
+    for _ in range(100):
+        assert 2.0 <= policy.delay(1) <= 3.0
+
+    assert RetryPolicy(attempts=0).attempts == 1
+    assert 503 in RetryPolicy().retry_on
+    assert 404 not in RetryPolicy().retry_on
+
+
+def test_timeout() -> None:
+    uploader = CodecovUploader('seantis/pytest-codecov')
+    assert uploader.timeout() == (5.0, 10.0)
+    assert uploader.timeout(100 * 1024 * 1024) == (5.0, 110.0)
+
+
+def test_retry(
+    dummy_cov: DummyCoverage,
+    local_server: LocalServer
+) -> None:
+
+    uploader = CodecovUploader(
+        'seantis/pytest-codecov',
+        retry_policy=RetryPolicy(attempts=3, backoff=0)
+    )
+    local_server.configure(uploader)
+    uploader.add_network_files(['foo.py'])
+    uploader.add_coverage_report(dummy_cov)
+
+    local_server.failures['/upload/v4'] = 2
+    local_server.failures['/storage/coverage'] = 2
+    assert uploader.run_pipelines() == {'coverage': None}
+
+    sent = [
+        (method, path.split('?')[0], body)
+        for method, path, body in local_server.requests
+    ]
+    assert [request[:2] for request in sent] == [
+        ('POST', '/upload/v4'),
+        ('POST', '/upload/v4'),
+        ('POST', '/upload/v4'),
+        ('PUT', '/storage/coverage'),
+        ('PUT', '/storage/coverage'),
+        ('PUT', '/storage/coverage'),
+    ]
+    # the spooled payload is rewound and sent in full on every attempt
+    assert sent[3][2] == sent[4][2] == sent[5][2]
+    assert gzip.decompress(sent[5][2]).startswith(b'foo.py\n')
+
+    # once we're out of attempts we give up
+    local_server.failures['/storage/coverage'] = 3
+    errors = uploader.run_pipelines()
+    assert 'Failed to upload report' in str(errors['coverage'])
+    uploader.close()
+
+
+def test_retry_connection_error(local_server: LocalServer) -> None:
+    uploader = CodecovUploader(
+        'seantis/pytest-codecov',
+        retry_policy=RetryPolicy(attempts=2, backoff=0)
+    )
+    local_server.configure(uploader)
+    # nothing is listening on this port anymore
+    local_server.shutdown()
+    local_server.server_close()
+    with pytest.raises(CodecovError, match=r'after 2 attempt\(s\)'):
+        uploader.ping()
+    uploader.close()
+
+
+def test_retry_unsafe_requests(mock_requests: MockRequests) -> None:
+    uploader = CodecovUploader(
+        'seantis/pytest-codecov',
+        retry_policy=RetryPolicy(attempts=3, backoff=0)
+    )
+    # the server may have reserved an upload, so we don't try again
+    mock_requests.set_response('error', ok=False, status_code=500)
+    assert uploader.request('POST', 'https://example.com').status_code == 500
+    assert len(mock_requests.pop()) == 1
+
+    # unless it told us to come back later
+    mock_requests.set_response('busy', ok=False, status_code=503)
+    assert uploader.request('POST', 'https://example.com').status_code == 503
+    assert len(mock_requests.pop()) == 3
+
+    # idempotent requests are retried either way
+    mock_requests.set_response('error', ok=False, status_code=500)
+    assert uploader.request('PUT', 'https://example.com').status_code == 500
+    assert len(mock_requests.pop()) == 3
+    uploader.close()
+
+
+def test_retry_unsafe_timeout() -> None:
+    calls = []
+
+    class TimeoutSession(requests.Session):
+        def request(  # type: ignore[override]
+            self,
+            method: str,
+            url: str,
+            **kwargs: Any
+        ) -> requests.Response:
+            calls.append(method)
+            raise requests.ReadTimeout('timed out')
+
+    uploader = CodecovUploader(
+        'seantis/pytest-codecov',
+        retry_policy=RetryPolicy(attempts=3, backoff=0),
+        session=TimeoutSession()
+    )
+    # the request was sent, but we don't know if it was processed
+    with pytest.raises(CodecovError, match=r'after 1 attempt\(s\)'):
+        uploader.request('POST', 'https://example.com')
+    assert calls == ['POST']
+
+    calls.clear()
+    with pytest.raises(CodecovError, match=r'after 3 attempt\(s\)'):
+        uploader.request('PUT', 'https://example.com')
+    assert calls == ['PUT', 'PUT', 'PUT']
+    uploader.session.close()
@@ -5,6 +5,14 @@ import os
 
 import pytest
 
+from pytest_codecov.git import PathMatcher
+from pytest_codecov.git import _git_ls_files
+from pytest_codecov.git import _subprocess_ls_files
+from pytest_codecov.git import changed_files
+from pytest_codecov.git import ls_files
+from pytest_codecov.git import ls_files_key
+from pytest_codecov.git import os_ls_files
+
 
 def test_no_repository(pytester: pytest.Pytester) -> None:
 
@@ -144,3 +152,280 @@ def test_commit(pytester: pytest.Pytester) -> None:
 
     result = pytester.runpytest()
     result.assert_outcomes(passed=1)
+
+
+def test_lazy_metadata(pytester: pytest.Pytester) -> None:
+    repo = git.Repo.init(pytester.path)
+    repo.create_remote('origin', 'git@example.com:foo/bar.git')
+
+    pytester.makepyfile(
+        """
+        import pytest_codecov.git as git
+        from importlib import reload
+
+        reload(git)
+
+        def test_lazy_metadata():
+            assert git._metadata is None
+            assert git.slug == 'foo/bar'
+            assert git._metadata is not None
+        """
+    )
+
+    repo.index.add(os.path.join(pytester.path, 'test_lazy_metadata.py'))
+    repo.index.commit('Initial commit')
+
+    result = pytester.runpytest()
+    result.assert_outcomes(passed=1)
+
+
+def test_no_detection_without_codecov(pytester: pytest.Pytester) -> None:
+    repo = git.Repo.init(pytester.path)
+    repo.create_remote('origin', 'git@example.com:foo/bar.git')
+
+    pytester.makepyfile(
+        """
+        import sys
+        import pytest_codecov.git
+
+        def test_no_detection():
+            assert pytest_codecov.git._metadata is None
+            assert 'git' not in sys.modules
+        """
+    )
+
+    result = pytester.runpytest_subprocess()
+    result.assert_outcomes(passed=1)
+
+
+def test_ls_files(
+    pytester: pytest.Pytester,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    repo = git.Repo.init(pytester.path)
+    pytester.makefile('.txt', foo='bar')
+    pytester.mkdir('sub')
+    pytester.makefile('.py', **{'sub/baz': ''})
+    pytester.mkdir('vendor')
+    pytester.makefile('.py', **{'vendor/lib': ''})
+    pytester.makefile('.md', readme='')
+    repo.index.add([
+        os.path.join(pytester.path, 'foo.txt'),
+        os.path.join(pytester.path, 'sub', 'baz.py'),
+        os.path.join(pytester.path, 'vendor', 'lib.py'),
+        os.path.join(pytester.path, 'readme.md'),
+    ])
+    repo.index.commit('Initial commit')
+    tracked = ['foo.txt', 'readme.md', 'sub/baz.py', 'vendor/lib.py']
+
+    # paths are always relative to the repository root
+    monkeypatch.chdir(pytester.path / 'sub')
+    files = _subprocess_ls_files()
+    assert sorted(files) == tracked
+    assert sorted(_git_ls_files()) == tracked
+    # the built-in excludes don't apply to tracked files
+    assert sorted(ls_files()) == tracked
+    # but the globs given by the user do
+    assert sorted(ls_files(PathMatcher(exclude=['*.txt', 'vendor/*']))) == [
+        'readme.md',
+        'sub/baz.py',
+    ]
+
+    # if the git executable is unavailable we fall back to GitPython
+    def no_git(*args: object, **kwargs: object) -> None:
+        raise FileNotFoundError('git')
+
+    monkeypatch.setattr('subprocess.run', no_git)
+    with pytest.raises(FileNotFoundError, match=r'git'):
+        _subprocess_ls_files()
+    assert sorted(ls_files()) == tracked
+
+
+def test_ls_files_no_repository(
+    pytester: pytest.Pytester,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    pytester.makefile('.txt', foo='bar')
+    pytester.makefile('.md', readme='')
+    monkeypatch.setenv('GIT_CEILING_DIRECTORIES', str(pytester.path.parent))
+    monkeypatch.chdir(pytester.path)
+    assert list(ls_files()) == ['foo.txt']
+
+
+def test_os_ls_files(
+    pytester: pytest.Pytester,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    for path in (
+        'src/foo.py',
+        'src/__pycache__/foo.pyc',
+        'node_modules/foo/index.js',
+        '.tox/py311/lib/foo.py',
+        '.venv/bin/python',
+        'foo.egg-info/PKG-INFO',
+        'docs/index.rst',
+        'docs/logo.png',
+        'README.md',
+        'build/foo.py',
+        'debug.log',
+        'keep.log',
+        'top.txt',
+        'sub/top.txt',
+        'sub/data/foo.csv',
+    ):
+        (pytester.path / path).parent.mkdir(parents=True, exist_ok=True)
+        (pytester.path / path).write_text('')
+
+    pytester.makefile(
+        '',
+        **{'.gitignore': 'build/\n*.log\n!keep.log\n/top.txt\n'}
+    )
+    pytester.makefile('', **{'sub/.gitignore': 'data/\n'})
+    monkeypatch.chdir(pytester.path)
+
+    assert list(os_ls_files()) == [
+        '.gitignore',
+        'build/foo.py',
+        'debug.log',
+        'docs/index.rst',
+        'keep.log',
+        'src/foo.py',
+        'sub/.gitignore',
+        'sub/data/foo.csv',
+        'sub/top.txt',
+        'top.txt',
+    ]
+    assert list(os_ls_files(respect_gitignore=True)) == [
+        '.gitignore',
+        'docs/index.rst',
+        'keep.log',
+        'src/foo.py',
+        'sub/.gitignore',
+        'sub/top.txt',
+    ]
+
+    matcher = PathMatcher(exclude=['sub/*', '*.log'], include=['.tox/*'])
+    assert list(os_ls_files(matcher=matcher)) == [
+        '.gitignore',
+        '.tox/py311/lib/foo.py',
+        'build/foo.py',
+        'docs/index.rst',
+        'src/foo.py',
+        'top.txt',
+    ]
+
+    # inside a repository the paths are relative to its root, just like
+    # the output of git ls-files, even if we're in a subdirectory
+    (pytester.path / '.git').mkdir()
+    monkeypatch.chdir(pytester.path / 'sub')
+    matcher = PathMatcher(exclude=['src/*', 'docs/*'])
+    assert list(os_ls_files(respect_gitignore=True, matcher=matcher)) == [
+        '.gitignore',
+        'keep.log',
+        'sub/.gitignore',
+        'sub/top.txt',
+    ]
+
+
+def test_path_matcher() -> None:
+    matcher = PathMatcher()
+    assert matcher('src/foo.py')
+    assert matcher('README.rst')
+    assert matcher('.gitignore')
+    assert not matcher('README.md')
+    assert not matcher('docs/logo.png')
+    assert not matcher('coverage.xml')
+    assert not matcher('src/__pycache__/foo.pyc')
+    assert not matcher('node_modules/foo/index.js')
+    assert not matcher('.venv/bin/python')
+    assert not matcher('foo.egg-info/PKG-INFO')
+    assert not matcher('src/foo.egg-info/PKG-INFO')
+    assert matcher('src/environment.py')
+    assert matcher('foo.egg-info.py')
+    assert matcher.prunes('node_modules')
+    assert matcher.prunes('foo.egg-info')
+    assert not matcher.prunes('src')
+
+    matcher = PathMatcher(exclude=['docs/*'], include=['vendor/ours/*'])
+    assert not matcher('docs/index.rst')
+    assert matcher('vendor/ours/foo.py')
+    assert not matcher('vendor/theirs/foo.py')
+    # we can't prune directories, if we may need to include files from it
+    assert not matcher.prunes('vendor')
+    assert matcher.fingerprint != PathMatcher().fingerprint
+
+
+def test_ls_files_key(
+    pytester: pytest.Pytester,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    monkeypatch.setenv('GIT_CEILING_DIRECTORIES', str(pytester.path.parent))
+    monkeypatch.chdir(pytester.path)
+    assert ls_files_key() is None
+
+    # without a commit there is no tree to key on
+    repo = git.Repo.init(pytester.path)
+    assert ls_files_key() is None
+
+    pytester.makefile('.txt', foo='bar')
+    repo.index.add([os.path.join(pytester.path, 'foo.txt')])
+    repo.index.commit('Initial commit')
+    key = ls_files_key()
+    assert key is not None
+    assert ls_files_key() == key
+
+    # the key is the same in subdirectories
+    pytester.mkdir('sub')
+    monkeypatch.chdir(pytester.path / 'sub')
+    assert ls_files_key() == key
+
+    # but changes as soon as the index changes
+    pytester.makefile('.txt', bar='foo')
+    repo.index.add([os.path.join(pytester.path, 'bar.txt')])
+    repo.index.write()
+    assert ls_files_key() not in (None, key)
+
+
+def test_changed_files(
+    pytester: pytest.Pytester,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    monkeypatch.setenv('GIT_CEILING_DIRECTORIES', str(pytester.path.parent))
+    monkeypatch.chdir(pytester.path)
+    assert changed_files('base') is None
+
+    repo = git.Repo.init(pytester.path)
+    pytester.makefile('.txt', foo='foo', bar='bar', baz='baz')
+    repo.index.add([
+        os.path.join(pytester.path, name)
+        for name in ('foo.txt', 'bar.txt', 'baz.txt')
+    ])
+    repo.index.commit('Initial commit')
+    repo.create_head('base')
+
+    pytester.makefile('.txt', foo='changed')
+    pytester.mkdir('sub')
+    pytester.makefile('.py', **{'sub/new': ''})
+    repo.index.add([
+        os.path.join(pytester.path, 'foo.txt'),
+        os.path.join(pytester.path, 'sub', 'new.py'),
+    ])
+    repo.index.remove([os.path.join(pytester.path, 'bar.txt')])
+    repo.index.commit('Change some files')
+    # uncommitted changes are included as well
+    pytester.makefile('.txt', baz='changed')
+
+    # paths are always relative to the repository root
+    monkeypatch.chdir(pytester.path / 'sub')
+    changed = changed_files('base')
+    assert changed is not None
+    assert os.path.samefile(changed.root, pytester.path)
+    # deleted files are left out
+    assert sorted(changed.paths) == ['baz.txt', 'foo.txt', 'sub/new.py']
+
+    assert changed_files('missing') is None
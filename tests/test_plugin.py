@@ -1,14 +1,23 @@
 from __future__ import annotations
 
+import gzip
+import json
+import os
+import threading
 from typing import TYPE_CHECKING
 
 import pytest
 
 from pytest_codecov import CodecovPlugin
+from pytest_codecov import report_filename
+from pytest_codecov.codecov import CodecovError
+from pytest_codecov.codecov import CompressionStats
+from pytest_codecov.codecov import RetryPolicy
 
 if TYPE_CHECKING:
     from pathlib import Path
 
+    from pytest_codecov.git import PathMatcher
     from tests.conftest import DummyCoverage
     from tests.conftest import DummyReporter
     from tests.conftest import DummyUploaderFactory
@@ -75,6 +84,15 @@ def test_options_invalid_slug(
         pytester.parseconfig('--codecov', '--codecov-slug=invalid')
 
 
+def test_options_invalid_flag(
+    pytester: pytest.Pytester,
+    no_gitpython: None
+) -> None:
+
+    with pytest.raises(pytest.UsageError, match=r'Invalid flag'):
+        pytester.parseconfig('--codecov', '--codecov-flag=no spaces')
+
+
 def test_upload_report_no_slug(
     pytester: pytest.Pytester,
     dummy_reporter: DummyReporter,
@@ -165,6 +183,89 @@ def test_upload_report(
     ) in dummy_reporter.text
 
 
+def test_upload_report_flags_and_files(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage,
+    no_gitpython: None
+) -> None:
+
+    for name in ('a', 'b'):
+        pytester.makefile('.xml', **{f'packages/{name}/coverage': ''})
+        pytester.makefile('.xml', **{f'packages/{name}/junit': ''})
+    pytester.makefile('.info', lcov='')
+
+    config = pytester.parseconfig(
+        '--codecov',
+        '--codecov-token=12345678-1234-1234-1234-1234567890ab',
+        '--codecov-slug=foo/bar',
+        '--codecov-branch=master',
+        '--codecov-commit=deadbeef',
+        '--codecov-flag=unit',
+        '--codecov-flag=py312',
+        '--codecov-report-file=packages/*/coverage.xml',
+        '--codecov-report-file=*.info',
+        '--codecov-report-file=packages/a/coverage.xml',
+        '--codecov-report-file=missing/*.xml',
+        '--codecov-junit-file=packages/**/junit.xml'
+    )
+    plugin = CodecovPlugin()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert dummy_uploader.kwargs['flags'] == ['unit', 'py312']
+    assert dummy_uploader.report_files == [
+        os.path.join('packages', 'a', 'coverage.xml'),
+        os.path.join('packages', 'b', 'coverage.xml'),
+        'lcov.info',
+    ]
+    assert dummy_uploader.junit_files == [
+        os.path.join('packages', 'a', 'junit.xml'),
+        os.path.join('packages', 'b', 'junit.xml'),
+    ]
+    assert dummy_uploader.junit_xml is None
+    # the files are embedded under their POSIX path
+    assert dummy_uploader.filenames == [
+        'packages/a/coverage.xml',
+        'packages/b/coverage.xml',
+        'lcov.info',
+        'packages/a/junit.xml',
+        'packages/b/junit.xml',
+    ]
+    assert (
+        'Environment:\n'
+        'Slug:   foo/bar\n'
+        'Branch: master\n'
+        'Commit: deadbeef\n'
+        'Flags:  unit,py312\n'
+        '\n'
+        f'Report file {os.path.join("packages", "a", "coverage.xml")} '
+        'included in upload.\n'
+    ) in dummy_reporter.text
+    assert (
+        f'JUnit XML file {os.path.join("packages", "b", "junit.xml")} '
+        'included in upload.\n'
+    ) in dummy_reporter.text
+
+
+def test_report_filename(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    (tmp_path / 'src').mkdir()
+    monkeypatch.chdir(tmp_path / 'src')
+    assert report_filename('coverage.xml') == 'coverage.xml'
+    assert report_filename(os.path.join('.', 'a', 'lcov.info')) == (
+        'a/lcov.info'
+    )
+    assert report_filename(str(tmp_path / 'src' / 'a' / 'junit.xml')) == (
+        'a/junit.xml'
+    )
+    # files outside of the current directory keep only their name
+    assert report_filename(str(tmp_path / 'r.xml')) == 'r.xml'
+    assert report_filename(os.path.join('..', 'r.xml')) == 'r.xml'
+
+
 def test_upload_report_junit(
     pytester: pytest.Pytester,
     dummy_reporter: DummyReporter,
@@ -203,6 +304,79 @@ def test_upload_report_junit(
     assert dummy_uploader.junit_xml == str(junit_xml)
 
 
+def test_upload_report_junit_broken(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage,
+    no_gitpython: None
+) -> None:
+
+    from xml.etree.ElementTree import ParseError
+
+    pytester.makefile('.xml', broken='', ok='')
+    broken = str(pytester.path / 'broken.xml')
+    dummy_uploader.junit_errors[broken] = ParseError('no element found')
+    config = pytester.parseconfig(
+        '--codecov',
+        '--codecov-slug=foo/bar',
+        '--codecov-branch=master',
+        '--codecov-commit=deadbeef',
+        f'--codecov-junit-file={broken}',
+        f'--codecov-junit-file={pytester.path / "ok.xml"}',
+    )
+    plugin = CodecovPlugin()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert (
+        f'WARNING: Skipped JUnit XML file {broken}: no element found'
+    ) in dummy_reporter.text
+    assert dummy_uploader.junit_files == [str(pytester.path / 'ok.xml')]
+    assert 'JUnit XML file broken.xml' not in dummy_reporter.text
+    assert 'Successfully queued reports' in dummy_reporter.text
+
+
+def test_upload_report_junit_slim(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage,
+    no_gitpython: None,
+    tmp_path: Path
+) -> None:
+
+    junit_xml = tmp_path / 'junit.xml'
+    junit_xml.write_text('foo')
+    args = [
+        f'--junit-xml={junit_xml}',
+        '-o',
+        'junit_family=legacy',
+        '--codecov',
+        '--codecov-token=12345678-1234-1234-1234-1234567890ab',
+        '--codecov-slug=foo/bar',
+        '--codecov-branch=master',
+        '--codecov-commit=deadbeef'
+    ]
+    config = pytester.parseconfig(*args)
+    plugin = CodecovPlugin()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert 'Slimmed JUnit XML' not in dummy_reporter.text
+    assert dummy_uploader.junit_max_message_length == 1000
+
+    dummy_reporter.flush()
+    config = pytester.parseconfig(
+        *args,
+        '--codecov-junit-slim',
+        '--codecov-junit-max-message-length=200'
+    )
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert (
+        'JUnit XML file detected and included in upload.\n'
+        '\n'
+        'Slimmed JUnit XML from 100 to 40 bytes, saved 60 bytes.\n'
+    ) in dummy_reporter.text
+    assert dummy_uploader.junit_max_message_length == 200
+
+
 def test_upload_report_junit_info(
     pytester: pytest.Pytester,
     dummy_reporter: DummyReporter,
@@ -296,3 +470,795 @@ def test_upload_report_generation_failure(
     assert (
         'ERROR: Failed to generate XML report: test exception'
     ) in dummy_reporter.text
+
+
+def test_resolve_git_metadata(
+    pytester: pytest.Pytester,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    monkeypatch.setattr('pytest_codecov.git.slug', 'foo/bar')
+    monkeypatch.setattr('pytest_codecov.git.branch', 'master')
+    monkeypatch.setattr('pytest_codecov.git.commit', 'deadbeef')
+    config = pytester.parseconfig('--codecov')
+    assert config.option.codecov_slug is None
+    assert config.option.codecov_branch is None
+    assert config.option.codecov_commit is None
+
+    plugin = CodecovPlugin()
+    plugin.resolve_git_metadata(config.option)
+    assert config.option.codecov_slug == 'foo/bar'
+    assert config.option.codecov_branch == 'master'
+    assert config.option.codecov_commit == 'deadbeef'
+
+    # explicitly supplied values take precedence
+    config = pytester.parseconfig('--codecov', '--codecov-branch=main')
+    plugin.resolve_git_metadata(config.option)
+    assert config.option.codecov_branch == 'main'
+
+    # invalid slugs are ignored
+    monkeypatch.setattr('pytest_codecov.git.slug', 'invalid')
+    config = pytester.parseconfig('--codecov')
+    plugin.resolve_git_metadata(config.option)
+    assert config.option.codecov_slug is None
+
+
+def test_options_compression_level(
+    pytester: pytest.Pytester,
+    no_gitpython: None
+) -> None:
+
+    from pytest_codecov import get_compression_level
+
+    config = pytester.parseconfig('--codecov')
+    assert config.option.codecov_compression_level is None
+    assert get_compression_level(config) == 'auto'
+
+    config = pytester.parseconfig('--codecov-compression-level=6')
+    assert get_compression_level(config) == 6
+
+    config = pytester.parseconfig('--codecov-compression-level=auto')
+    assert get_compression_level(config) == 'auto'
+
+    pytester.makeini('[pytest]\ncodecov_compression_level = 1\n')
+    config = pytester.parseconfig('--codecov')
+    assert get_compression_level(config) == 1
+
+    # the command line takes precedence
+    config = pytester.parseconfig('--codecov-compression-level=9')
+    assert get_compression_level(config) == 9
+
+    with pytest.raises(pytest.UsageError, match=r'Invalid compression'):
+        pytester.parseconfig('--codecov-compression-level=10')
+
+    pytester.makeini('[pytest]\ncodecov_compression_level = best\n')
+    config = pytester.parseconfig('--codecov')
+    with pytest.raises(pytest.UsageError, match=r'Invalid compression'):
+        get_compression_level(config)
+
+
+def test_upload_report_compression_stats(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage,
+    no_gitpython: None
+) -> None:
+
+    dummy_uploader.compression_stats = CompressionStats(
+        level=6,
+        raw_size=1000,
+        compressed_size=250,
+        seconds=0.5,
+        workers=2,
+    )
+    config = pytester.parseconfig(
+        '--codecov',
+        '--codecov-slug=foo/bar',
+        '--codecov-branch=master',
+        '--codecov-commit=deadbeef',
+        '--codecov-compression-level=6',
+        '--codecov-compression-workers=2',
+    )
+    plugin = CodecovPlugin()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert dummy_uploader.kwargs['compression_level'] == 6
+    assert dummy_uploader.kwargs['compression_workers'] == 2
+    assert (
+        'Compressed payload from 1000 to 250 bytes (25.0%) '
+        'at level 6 in 0.50s using 2 threads.'
+    ) in dummy_reporter.text
+
+
+def test_options_compression_workers(
+    pytester: pytest.Pytester,
+    no_gitpython: None
+) -> None:
+
+    from pytest_codecov import get_compression_workers
+
+    config = pytester.parseconfig('--codecov')
+    assert config.option.codecov_compression_workers is None
+    assert get_compression_workers(config) == 1
+
+    config = pytester.parseconfig('--codecov-compression-workers=8')
+    assert get_compression_workers(config) == 8
+
+    pytester.makeini('[pytest]\ncodecov_compression_workers = 4\n')
+    config = pytester.parseconfig('--codecov')
+    assert get_compression_workers(config) == 4
+
+    # the command line takes precedence
+    config = pytester.parseconfig('--codecov-compression-workers=2')
+    assert get_compression_workers(config) == 2
+
+    with pytest.raises(pytest.UsageError, match=r'number of workers'):
+        pytester.parseconfig('--codecov-compression-workers=0')
+
+    pytester.makeini('[pytest]\ncodecov_compression_workers = many\n')
+    config = pytester.parseconfig('--codecov')
+    with pytest.raises(pytest.UsageError, match=r'number of workers'):
+        get_compression_workers(config)
+
+
+def test_upload_report_pipeline_errors(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage,
+    no_gitpython: None
+) -> None:
+
+    config = pytester.parseconfig(
+        '--codecov',
+        '--codecov-slug=foo/bar',
+        '--codecov-branch=master',
+        '--codecov-commit=deadbeef'
+    )
+    plugin = CodecovPlugin()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert 'ERROR' not in dummy_reporter.text
+    assert 'Successfully queued reports' in dummy_reporter.text
+
+    dummy_reporter.flush()
+    dummy_uploader.pipeline_errors = {
+        'coverage': None,
+        'test results': CodecovError('Failed to upload test results.')
+    }
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert 'ERROR: Failed to upload test results.' in dummy_reporter.text
+    assert 'Successfully queued reports' in dummy_reporter.text
+
+    dummy_reporter.flush()
+    dummy_uploader.pipeline_errors = {
+        'coverage': CodecovError('Failed to upload report.'),
+        'test results': None
+    }
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert 'ERROR: Failed to upload report.' in dummy_reporter.text
+    assert 'Successfully queued reports' not in dummy_reporter.text
+
+
+def test_background_upload(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage,
+    no_gitpython: None
+) -> None:
+
+    config = pytester.parseconfig(
+        '--codecov',
+        '--codecov-background',
+        '--codecov-slug=foo/bar',
+        '--codecov-branch=master',
+        '--codecov-commit=deadbeef'
+    )
+    plugin = CodecovPlugin()
+    plugin.start_background_upload(config, dummy_cov)
+    plugin.join_background_upload(dummy_reporter, timeout=10)
+    assert (
+        'Environment:\n'
+        'Slug:   foo/bar\n'
+        'Branch: master\n'
+        'Commit: deadbeef\n'
+    ) in dummy_reporter.text
+    assert 'Successfully queued reports' in dummy_reporter.text
+
+    # joining again is a no-op
+    dummy_reporter.flush()
+    plugin.join_background_upload(dummy_reporter, timeout=10)
+    assert dummy_reporter.lines == []
+
+
+def test_background_upload_timeout(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_cov: DummyCoverage,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    done = threading.Event()
+
+    def upload_report(*args: object) -> None:
+        done.wait(10)
+
+    config = pytester.parseconfig('--codecov', '--codecov-background')
+    plugin = CodecovPlugin()
+    monkeypatch.setattr(plugin, 'upload_report', upload_report)
+    plugin.start_background_upload(config, dummy_cov)
+    plugin.join_background_upload(dummy_reporter, timeout=0.01)
+    done.set()
+    assert (
+        'ERROR: Timed out waiting for background upload to finish.'
+    ) in dummy_reporter.text
+
+
+def test_background_upload_session(pytester: pytest.Pytester) -> None:
+    pytester.makepyfile(
+        """
+        def test_foo():
+            assert True
+        """
+    )
+    result = pytester.runpytest_subprocess(
+        '--cov',
+        '--codecov',
+        '--codecov-background',
+        '--codecov-dump',
+    )
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines([
+        '*Prepared Codecov.io payload*',
+        '*<<<<<< network*',
+        '# path=./coverage.xml',
+        '<?xml version=*',
+    ])
+
+
+def test_upload_report_xdist(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage
+) -> None:
+
+    class Node:
+        def __init__(self) -> None:
+            self.workeroutput = {'codecov_network': b'network'}
+
+    config = pytester.parseconfig(
+        '--codecov',
+        '--codecov-slug=foo/bar',
+        '--codecov-branch=master',
+        '--codecov-commit=deadbeef',
+    )
+    plugin = CodecovPlugin()
+    plugin.pytest_testnodedown(object(), None)
+    plugin.pytest_testnodedown(Node(), None)
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert dummy_uploader.compressed_network == b'network'
+
+
+def test_xdist_session(pytester: pytest.Pytester) -> None:
+    # the network section has to come from the first worker, so listing
+    # the files on the controller fails the test
+    pytester.makeconftest("""
+        import pytest_codecov.git
+
+        def pytest_configure(config):
+            if not hasattr(config, 'workerinput'):
+                def ls_files(*args, **kwargs):
+                    raise AssertionError('Listed the files on the controller')
+
+                pytest_codecov.git.ls_files = ls_files
+        """)
+    pytester.makepyfile(
+        test_foo="""
+        def test_foo():
+            assert True
+        """,
+        test_bar="""
+        def test_bar():
+            assert True
+        """
+    )
+    result = pytester.runpytest_subprocess(
+        '-n', '2',
+        '--cov',
+        '--codecov',
+        '--codecov-dump',
+    )
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines([
+        '*Prepared Codecov.io payload*',
+        'test_bar.py',
+        'test_foo.py',
+        '<<<<<< network',
+        '# path=./coverage.xml',
+        '<?xml version=*',
+    ])
+
+
+def test_upload_report_retry_policy(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage,
+    no_gitpython: None
+) -> None:
+
+    config = pytester.parseconfig('--codecov', '--codecov-slug=foo/bar')
+    plugin = CodecovPlugin()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    policy = dummy_uploader.kwargs['retry_policy']
+    assert isinstance(policy, RetryPolicy)
+    assert policy.attempts == 3
+    assert policy.backoff == pytest.approx(1.0)
+
+    config = pytester.parseconfig(
+        '--codecov',
+        '--codecov-slug=foo/bar',
+        '--codecov-retries=0',
+        '--codecov-retry-backoff=0.5',
+    )
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    policy = dummy_uploader.kwargs['retry_policy']
+    assert isinstance(policy, RetryPolicy)
+    assert policy.attempts == 1
+    assert policy.backoff == pytest.approx(0.5)
+
+
+def test_upload_report_spool(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage,
+    no_gitpython: None,
+    tmp_path: Path
+) -> None:
+
+    spool_dir = tmp_path / 'spool'
+    config = pytester.parseconfig(
+        '--codecov',
+        '--codecov-slug=foo/bar',
+        '--codecov-branch=master',
+        '--codecov-commit=deadbeef',
+        f'--codecov-spool={spool_dir}',
+    )
+    plugin = CodecovPlugin()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert 'Spooled reports to' in dummy_reporter.text
+    assert 'Pinging codecov API' not in dummy_reporter.text
+    [entry] = spool_dir.iterdir()
+    assert (entry / 'payload.gz').read_bytes() == b'stub'
+    metadata = json.loads((entry / 'metadata.json').read_text())
+    assert metadata['token_env'] == 'CODECOV_TOKEN'
+    assert 'WARNING' not in dummy_reporter.text
+
+
+def test_upload_report_spool_cli_token(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage,
+    no_gitpython: None,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path
+) -> None:
+
+    monkeypatch.delenv('CODECOV_TOKEN', raising=False)
+    spool_dir = tmp_path / 'spool'
+    config = pytester.parseconfig(
+        '--codecov',
+        '--codecov-token=12345678-1234-1234-1234-1234567890ab',
+        '--codecov-slug=foo/bar',
+        '--codecov-branch=master',
+        '--codecov-commit=deadbeef',
+        f'--codecov-spool={spool_dir}',
+    )
+    plugin = CodecovPlugin()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert (
+        'WARNING: The token passed with --codecov-token is not spooled, '
+        'pass it to pytest-codecov-drain with --token.'
+    ) in dummy_reporter.text
+    assert 'Spooled reports to' in dummy_reporter.text
+    # the drain must not pick up an unrelated token from the environment
+    [entry] = spool_dir.iterdir()
+    metadata = json.loads((entry / 'metadata.json').read_text())
+    assert metadata['token_env'] is None
+
+
+def test_upload_report_profile(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage,
+    no_gitpython: None,
+    tmp_path: Path
+) -> None:
+
+    args = (
+        '--codecov',
+        '--codecov-slug=foo/bar',
+        '--codecov-branch=master',
+        '--codecov-commit=deadbeef',
+    )
+    config = pytester.parseconfig(*args)
+    plugin = CodecovPlugin()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert 'Profile: git ' in dummy_reporter.text
+
+    profile_path = tmp_path / 'profile.json'
+    config = pytester.parseconfig(*args, f'--codecov-profile={profile_path}')
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    profile = json.loads(profile_path.read_text())
+    assert profile['slug'] == 'foo/bar'
+    assert profile['branch'] == 'master'
+    assert profile['commit'] == 'deadbeef'
+    assert profile['total_seconds'] > 0
+    phases = {phase['name']: phase for phase in profile['phases']}
+    assert list(phases) == ['git', 'network']
+    assert phases['git']['bytes'] is None
+    assert phases['network']['bytes'] == len(
+        dummy_uploader.compressed_network or b''
+    )
+
+    # failing to write the profile doesn't fail the upload
+    dummy_reporter.flush()
+    config = pytester.parseconfig(
+        *args,
+        f'--codecov-profile={tmp_path / "missing" / "profile.json"}'
+    )
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert 'WARNING: Failed to write profile' in dummy_reporter.text
+    assert dummy_uploader.uploads == 3
+
+
+def test_upload_report_shard(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path
+) -> None:
+
+    shards: list[tuple[object, ...]] = []
+
+    def write_shard(
+        cov: object,
+        directory: str,
+        junit_xml: object,
+        report_files: object = (),
+        junit_files: object = ()
+    ) -> str:
+        shards.append((cov, directory, junit_xml, report_files, junit_files))
+        return f'{directory}/.coverage.foo'
+
+    monkeypatch.setattr('pytest_codecov.shard.write_shard', write_shard)
+    shard_dir = str(tmp_path / 'shards')
+    config = pytester.parseconfig(
+        '--codecov',
+        f'--codecov-shard={shard_dir}',
+    )
+    plugin = CodecovPlugin()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert shards == [(dummy_cov, shard_dir, None, [], [])]
+    assert f'Wrote coverage data to {shard_dir}/.coverage.foo' in (
+        dummy_reporter.text
+    )
+
+    # additional files are carried along in the shard
+    pytester.mkdir('reports')
+    pytester.makefile('.info', **{'reports/lcov': 'foo'})
+    pytester.makefile('.xml', extra='<testsuites/>')
+    config = pytester.parseconfig(
+        '--codecov',
+        f'--codecov-shard={shard_dir}',
+        '--codecov-report-file=reports/*.info',
+        '--codecov-junit-file=extra.xml',
+    )
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert shards[-1] == (
+        dummy_cov,
+        shard_dir,
+        None,
+        [(os.path.join('reports', 'lcov.info'), 'reports/lcov.info')],
+        [('extra.xml', 'extra.xml')],
+    )
+    assert 'Report file reports/lcov.info included in shard.' in (
+        dummy_reporter.text
+    )
+    assert 'JUnit XML file extra.xml included in shard.' in (
+        dummy_reporter.text
+    )
+    # no payload is prepared on the individual shards
+    assert 'Codecov.io upload' not in dummy_reporter.text
+    assert dummy_uploader.kwargs == {}
+
+
+def test_upload_report_cache(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage
+) -> None:
+
+    args = (
+        '--codecov',
+        '--codecov-slug=foo/bar',
+        '--codecov-branch=master',
+        '--codecov-commit=deadbeef',
+    )
+    config = pytester.parseconfigure(*args)
+    plugin = CodecovPlugin()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert dummy_uploader.uploads == 1
+    assert 'Successfully queued reports' in dummy_reporter.text
+
+    # identical reports are only uploaded once
+    dummy_reporter.flush()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert dummy_uploader.uploads == 1
+    assert 'Identical reports were already uploaded' in dummy_reporter.text
+
+    # unless we force it
+    config = pytester.parseconfigure(*args, '--codecov-force-upload')
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert dummy_uploader.uploads == 2
+
+    # failed uploads are not remembered
+    dummy_uploader.digest = 'other'
+    dummy_uploader.pipeline_errors = {'coverage': CodecovError('failed')}
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert dummy_uploader.uploads == 4
+    assert config.cache is not None
+    assert config.cache.get('codecov/uploads', []) == ['digest']
+
+
+def test_get_compressed_network(
+    pytester: pytest.Pytester,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    from pytest_codecov import get_compressed_network
+
+    listings: list[str] = []
+
+    def ls_files(matcher: PathMatcher) -> list[str]:
+        listings.append('listed')
+        return [path for path in ('foo.py', 'foo.png') if matcher(path)]
+
+    key = 'a' * 64
+    monkeypatch.setattr('pytest_codecov.git.ls_files', ls_files)
+    monkeypatch.setattr('pytest_codecov.git.ls_files_key', lambda: key)
+    config = pytester.parseconfigure('--codecov')
+    gz_network = get_compressed_network(config)
+    assert gzip.decompress(gz_network) == b'foo.py\n<<<<<< network'
+    assert get_compressed_network(config) == gz_network
+    assert len(listings) == 1
+
+    # the listing is recomputed once the tree or the index change
+    key = 'b' * 64
+    assert get_compressed_network(config) == gz_network
+    assert len(listings) == 2
+    assert config.cache is not None
+    directory = config.cache.mkdir('codecov-network')
+    assert len(list(directory.iterdir())) == 1
+
+    # or the globs change
+    config.option.codecov_network_include = ['*.png']
+    assert gzip.decompress(get_compressed_network(config)) == (
+        b'foo.py\nfoo.png\n<<<<<< network'
+    )
+    assert len(listings) == 3
+
+    # outside of git repositories we don't cache anything
+    config.option.codecov_network_include = []
+    monkeypatch.setattr('pytest_codecov.git.ls_files_key', lambda: None)
+    assert get_compressed_network(config) == gz_network
+    assert get_compressed_network(config) == gz_network
+    assert len(listings) == 5
+
+
+def test_get_path_matcher(pytester: pytest.Pytester) -> None:
+    from pytest_codecov import get_path_matcher
+
+    pytester.makeini(
+        """
+        [pytest]
+        codecov_network_exclude =
+            docs/*
+            *.svg
+        codecov_network_include = vendor/ours/*
+        """
+    )
+    config = pytester.parseconfig(
+        '--codecov-network-exclude=*.lock',
+        '--codecov-network-include=docs/index.rst',
+    )
+    matcher = get_path_matcher(config)
+    assert matcher.exclude == ('docs/*', '*.svg', '*.lock')
+    assert matcher.include == ('vendor/ours/*', 'docs/index.rst')
+    assert matcher('src/foo.py')
+    assert not matcher('docs/conf.py')
+    assert not matcher('static/logo.svg')
+    assert not matcher('poetry.lock')
+    assert not matcher('vendor/theirs/foo.py')
+    assert matcher('vendor/ours/foo.py')
+    assert matcher('docs/index.rst')
+
+
+def test_upload_report_network_measured_only(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    from pytest_codecov.codecov import decompress_network
+
+    files = ['docs/index.rst', 'src/foo.py', 'src/bar.py', 'setup.cfg']
+    monkeypatch.setattr(
+        'pytest_codecov.git.ls_files',
+        lambda matcher: files
+    )
+    dummy_cov.measured_files = [str(pytester.path / 'src' / 'foo.py')]
+    args = (
+        '--codecov',
+        '--codecov-slug=foo/bar',
+        '--codecov-branch=master',
+        '--codecov-commit=deadbeef',
+        '--codecov-dump',
+    )
+    config = pytester.parseconfig(*args)
+    plugin = CodecovPlugin()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert dummy_uploader.compressed_network is not None
+    assert decompress_network(dummy_uploader.compressed_network) == files
+
+    config = pytester.parseconfig(
+        *args,
+        '--codecov-network-measured-only',
+        '--codecov-network-include=*.cfg',
+    )
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert decompress_network(dummy_uploader.compressed_network) == [
+        'src/foo.py',
+        'setup.cfg',
+    ]
+
+
+def test_upload_report_diff_base(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage,
+    monkeypatch: pytest.MonkeyPatch
+) -> None:
+
+    from pytest_codecov.codecov import decompress_network
+    from pytest_codecov.git import ChangedFiles
+
+    files = ['docs/index.rst', 'src/foo.py', 'src/bar.py', 'setup.cfg']
+    monkeypatch.setattr(
+        'pytest_codecov.git.ls_files',
+        lambda matcher: files
+    )
+    changed_files: ChangedFiles | None = ChangedFiles(
+        str(pytester.path),
+        ['docs/index.rst', 'src/foo.py']
+    )
+    monkeypatch.setattr(
+        'pytest_codecov.git.changed_files',
+        lambda base: changed_files
+    )
+    foo = str(pytester.path / 'src' / 'foo.py')
+    bar = str(pytester.path / 'src' / 'bar.py')
+    dummy_cov.measured_files = [foo, bar]
+    args = (
+        '--codecov',
+        '--codecov-slug=foo/bar',
+        '--codecov-branch=master',
+        '--codecov-commit=deadbeef',
+        '--codecov-diff-base=origin/main',
+    )
+    config = pytester.parseconfig(*args)
+    plugin = CodecovPlugin()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert dummy_uploader.morfs == [foo]
+    assert dummy_uploader.compressed_network is not None
+    assert decompress_network(dummy_uploader.compressed_network) == [
+        'docs/index.rst',
+        'src/foo.py',
+    ]
+    assert (
+        'Restricted report to 1 measured file(s) changed since origin/main.'
+    ) in dummy_reporter.text
+    assert dummy_uploader.uploads == 1
+
+    # without changes to measured files there is nothing to upload
+    dummy_reporter.flush()
+    dummy_uploader.clear()
+    changed_files = ChangedFiles(str(pytester.path), ['docs/index.rst'])
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert (
+        'No measured files changed since origin/main, skipping upload.'
+    ) in dummy_reporter.text
+    assert dummy_uploader.uploads == 1
+
+    # unless there are test results, those are uploaded on their own
+    dummy_reporter.flush()
+    junit_xml = pytester.path / 'results.xml'
+    junit_xml.write_text('foo')
+    config = pytester.parseconfig(
+        *args,
+        f'--codecov-junit-file={junit_xml}'
+    )
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert (
+        'No measured files changed since origin/main, only uploading '
+        'test results.'
+    ) in dummy_reporter.text
+    assert 'Successfully queued reports' in dummy_reporter.text
+    assert dummy_uploader.junit_files == [str(junit_xml)]
+    assert dummy_uploader.compressed_network is None
+    assert dummy_uploader.morfs is None
+    assert dummy_uploader.upload_coverage is False
+    assert dummy_uploader.uploads == 2
+
+    # if git can't tell us what changed we upload everything
+    dummy_reporter.flush()
+    changed_files = None
+    config = pytester.parseconfig(*args)
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert (
+        'WARNING: Failed to determine the files changed since origin/main, '
+        'uploading the full report.'
+    ) in dummy_reporter.text
+    assert dummy_uploader.morfs is None
+    assert decompress_network(dummy_uploader.compressed_network) == files
+    assert dummy_uploader.upload_coverage is True
+    assert dummy_uploader.uploads == 3
+
+
+def test_upload_report_json(
+    pytester: pytest.Pytester,
+    dummy_reporter: DummyReporter,
+    dummy_uploader: DummyUploaderFactory,
+    dummy_cov: DummyCoverage
+) -> None:
+
+    args = (
+        '--codecov',
+        '--codecov-slug=foo/bar',
+        '--codecov-branch=master',
+        '--codecov-commit=deadbeef',
+        '--codecov-dump',
+    )
+    config = pytester.parseconfig(*args)
+    plugin = CodecovPlugin()
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert dummy_uploader.report_format == 'xml'
+
+    config = pytester.parseconfig(*args, '--codecov-report-format=json')
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert dummy_uploader.report_format == 'json'
+    assert dummy_uploader.report_workers == 1
+
+    config = pytester.parseconfig(
+        *args,
+        '--codecov-report-format=json',
+        '--codecov-report-workers=4'
+    )
+    plugin.upload_report(dummy_reporter, config, dummy_cov)
+    assert dummy_uploader.report_workers == 4
+
+
+def test_options_report_workers(pytester: pytest.Pytester) -> None:
+    with pytest.raises(pytest.UsageError):
+        pytester.parseconfig('--codecov-report-workers=0')
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import os
+from typing import cast
+from typing import TYPE_CHECKING
+
+import pytest
+from coverage import CoverageData
+
+from pytest_codecov.codecov import CodecovUploader
+from pytest_codecov.shard import JUNIT_FILES
+from pytest_codecov.shard import main
+from pytest_codecov.shard import shard_files
+from pytest_codecov.shard import write_shard
+
+if TYPE_CHECKING:
+    from coverage import Coverage
+    from pathlib import Path
+
+    from tests.conftest import LocalServer
+
+
+class ShardCoverage:
+
+    def __init__(self, lines: dict[str, list[int]]) -> None:
+        self.data = CoverageData(no_disk=True)
+        self.data.add_lines(lines)
+
+    def get_data(self) -> CoverageData:
+        return self.data
+
+
+@pytest.fixture
+def shard_dir(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch
+) -> str:
+
+    (tmp_path / 'src').mkdir()
+    source = tmp_path / 'src' / 'foo.py'
+    source.write_text('a = 1\nb = 2\nc = 3\n')
+    junit_xml = tmp_path / 'junit.xml'
+    junit_xml.write_text('foo')
+    monkeypatch.setenv('GIT_CEILING_DIRECTORIES', str(tmp_path.parent))
+    monkeypatch.chdir(tmp_path / 'src')
+
+    directory = str(tmp_path / 'shards')
+    path = str(source)
+    write_shard(cast('Coverage', ShardCoverage({path: [1]})), directory)
+    write_shard(
+        cast('Coverage', ShardCoverage({path: [3]})),
+        directory,
+        str(junit_xml)
+    )
+    return directory
+
+
+def test_write_shard(shard_dir: str) -> None:
+    names = os.listdir(shard_dir)
+    suffixes = [
+        name[len('.coverage.'):]
+        for name in names
+        if name.startswith('.coverage.')
+    ]
+    assert len(suffixes) == 2
+    # the JUnit XML is named after the shard it belongs to
+    junit_files = [name for name in names if name.startswith('junit.')]
+    assert len(junit_files) == 1
+    assert junit_files[0][len('junit.'):-len('.xml')] in suffixes
+
+
+def test_main_dump(
+    shard_dir: str,
+    capsys: pytest.CaptureFixture[str]
+) -> None:
+
+    assert main([shard_dir, '--slug=foo/bar', '--dump']) == 0
+    # the shards are kept, so they can still be uploaded afterwards
+    assert len([
+        name
+        for name in os.listdir(shard_dir)
+        if name.startswith('.coverage.')
+    ]) == 2
+    payload = capsys.readouterr().out
+    network, coverage_xml = payload.split('<<<<<< network\n')
+    assert network.splitlines() == ['foo.py']
+    assert coverage_xml.startswith('# path=./coverage.xml\n')
+    # the lines of both shards are combined into a single report
+    assert '<line number="1" hits="1"/>' in coverage_xml
+    assert '<line number="2" hits="0"/>' in coverage_xml
+    assert '<line number="3" hits="1"/>' in coverage_xml
+
+
+def test_main_dump_json(
+    shard_dir: str,
+    capsys: pytest.CaptureFixture[str]
+) -> None:
+
+    assert main([shard_dir, '--dump', '--report-format=json']) == 0
+    payload = capsys.readouterr().out
+    assert '# path=./codecov.json\n' in payload
+    assert '"foo.py": {"1":1,"2":0,"3":1}' in payload
+
+
+def test_main(
+    shard_dir: str,
+    local_server: LocalServer,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+
+    monkeypatch.setattr(CodecovUploader, 'api_endpoint', local_server.url)
+    monkeypatch.setattr(
+        CodecovUploader,
+        'storage_endpoint',
+        f'{local_server.url}/storage/'
+    )
+    assert main([
+        shard_dir,
+        '--slug=foo/bar',
+        '--commit=deadbeef',
+        '--flag=unit',
+    ]) == 0
+    out = capsys.readouterr().out
+    assert 'Uploaded coverage.' in out
+    assert 'Uploaded test results.' in out
+    assert 'Combined 2 shard(s) into a single upload.' in out
+    # a single upload for all the shards
+    assert sorted(
+        path.split('?')[0] for _, path, _ in local_server.requests
+    ) == [
+        '/storage/coverage',
+        '/storage/test_results',
+        '/upload/test_results/v1',
+        '/upload/v4',
+    ]
+    assert any(
+        'flags=unit' in path
+        for _, path, _ in local_server.requests
+        if path.startswith('/upload/v4')
+    )
+
+
+def test_main_extra_files(
+    shard_dir: str,
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str]
+) -> None:
+
+    (tmp_path / 'src' / 'reports').mkdir()
+    lcov = tmp_path / 'src' / 'reports' / 'lcov.info'
+    lcov.write_text('SF:bar.js\nend_of_record')
+    extra = tmp_path / 'extra.xml'
+    extra.write_text('<testsuites/>')
+    write_shard(
+        cast('Coverage', ShardCoverage({})),
+        shard_dir,
+        report_files=[(str(lcov), 'reports/lcov.info')],
+        junit_files=[(str(extra), 'extra.xml')]
+    )
+
+    [(path, filename)] = shard_files(shard_dir, JUNIT_FILES)
+    assert filename == 'extra.xml'
+    with open(path) as fp:
+        assert fp.read() == '<testsuites/>'
+
+    assert main([shard_dir, '--slug=foo/bar', '--dump']) == 0
+    out = capsys.readouterr().out
+    # the report files are embedded under the name given by the shard
+    assert '# path=./reports/lcov.info\nSF:bar.js\nend_of_record' in out
+
+
+def test_main_no_shards(
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str]
+) -> None:
+
+    assert main([str(tmp_path)]) == 1
+    assert 'ERROR: No shards found' in capsys.readouterr().out
+
+
+def test_main_report_failure(
+    shard_dir: str,
+    capsys: pytest.CaptureFixture[str]
+) -> None:
+
+    # the measured source is gone, so no report can be generated
+    for name in os.listdir(os.getcwd()):
+        os.remove(name)
+    assert main([shard_dir, '--slug=foo/bar', '--dump']) == 1
+    assert 'ERROR: Failed to generate XML report' in capsys.readouterr().out
+
+
+@pytest.mark.filterwarnings('ignore::coverage.exceptions.CoverageWarning')
+def test_main_broken_shards(
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str]
+) -> None:
+
+    (tmp_path / '.coverage.broken').write_text('not a database')
+    assert main([str(tmp_path), '--dump']) == 1
+    assert capsys.readouterr().out.startswith('ERROR: ')
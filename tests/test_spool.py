@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import gzip
+import json
+import os
+from typing import TYPE_CHECKING
+
+import pytest
+
+from pytest_codecov.codecov import CodecovUploader
+from pytest_codecov.codecov import RetryPolicy
+from pytest_codecov.spool import drain
+from pytest_codecov.spool import main
+from pytest_codecov.spool import spool_report
+from pytest_codecov.spool import spooled_reports
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from tests.conftest import DummyCoverage
+    from tests.conftest import LocalServer
+
+
+def make_uploader(
+    dummy_cov: DummyCoverage,
+    junit_xml: Path | None = None
+) -> CodecovUploader:
+
+    uploader = CodecovUploader(
+        'seantis/pytest-codecov',
+        commit='deadbeef',
+        branch='master',
+        token='12345678-1234-1234-1234-1234567890ab',
+        flags=['unit'],
+    )
+    uploader.add_network_files(['foo.py'])
+    uploader.add_coverage_report(dummy_cov)
+    if junit_xml is not None:
+        uploader.add_junit_xml(str(junit_xml))
+    return uploader
+
+
+def test_spool_report(dummy_cov: DummyCoverage, tmp_path: Path) -> None:
+    junit_xml = tmp_path / 'junit.xml'
+    junit_xml.write_text('foo')
+    spool_dir = tmp_path / 'spool'
+    uploader = make_uploader(dummy_cov, junit_xml)
+    path = spool_report(uploader, str(spool_dir))
+    uploader.close()
+
+    assert spooled_reports(str(spool_dir)) == [path]
+    assert sorted(os.listdir(path)) == [
+        'metadata.json',
+        'payload.gz',
+        'test_results.json',
+    ]
+    with open(os.path.join(path, 'payload.gz'), 'rb') as fp:
+        assert gzip.decompress(fp.read()).decode('utf-8') == (
+            'foo.py\n'
+            '<<<<<< network\n'
+            '# path=./coverage.xml\n'
+            '<dummy_report/>\n'
+            '<<<<<< EOF'
+        )
+    with open(os.path.join(path, 'metadata.json')) as fp:
+        metadata = json.load(fp)
+    # the token itself is never written to disk
+    assert metadata == {
+        'slug': 'seantis/pytest-codecov',
+        'branch': 'master',
+        'commit': 'deadbeef',
+        'flags': ['unit'],
+        'token_env': 'CODECOV_TOKEN',
+    }
+    with open(os.path.join(path, 'test_results.json')) as fp:
+        test_results = json.load(fp)
+    assert test_results['test_results_files'][0]['filename'] == 'junit.xml'
+
+
+def test_spool_test_results_only(
+    dummy_cov: DummyCoverage,
+    tmp_path: Path
+) -> None:
+
+    junit_xml = tmp_path / 'junit.xml'
+    junit_xml.write_text('foo')
+    uploader = make_uploader(dummy_cov, junit_xml)
+    path = spool_report(uploader, str(tmp_path / 'spool'), coverage=False)
+    uploader.close()
+    assert sorted(os.listdir(path)) == ['metadata.json', 'test_results.json']
+
+
+def test_spool_report_failure(
+    dummy_cov: DummyCoverage,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path
+) -> None:
+
+    def test_results_payload() -> None:
+        raise OSError('disk full')
+
+    spool_dir = tmp_path / 'spool'
+    uploader = make_uploader(dummy_cov)
+    monkeypatch.setattr(uploader, 'test_results_payload', test_results_payload)
+    with pytest.raises(OSError, match=r'disk full'):
+        spool_report(uploader, str(spool_dir))
+    uploader.close()
+    # the partial entry is removed again
+    assert os.listdir(spool_dir) == []
+
+
+def test_spooled_reports(tmp_path: Path) -> None:
+    assert spooled_reports(str(tmp_path / 'missing')) == []
+
+    # incomplete entries are ignored
+    (tmp_path / '.incomplete').mkdir()
+    (tmp_path / '.incomplete' / 'metadata.json').write_text('{}')
+    (tmp_path / 'empty').mkdir()
+    assert spooled_reports(str(tmp_path)) == []
+
+
+def test_drain(
+    dummy_cov: DummyCoverage,
+    local_server: LocalServer,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path
+) -> None:
+
+    junit_xml = tmp_path / 'junit.xml'
+    junit_xml.write_text('foo')
+    spool_dir = str(tmp_path / 'spool')
+    for _ in range(3):
+        uploader = make_uploader(dummy_cov, junit_xml)
+        spool_report(uploader, spool_dir)
+        uploader.close()
+
+    monkeypatch.setattr(CodecovUploader, 'api_endpoint', local_server.url)
+    monkeypatch.setattr(
+        CodecovUploader,
+        'storage_endpoint',
+        f'{local_server.url}/storage/'
+    )
+    monkeypatch.setenv('CODECOV_TOKEN', 'secret')
+    results = drain(spool_dir, workers=3)
+    assert len(results) == 3
+    assert all(
+        errors == {'coverage': None, 'test results': None}
+        for errors in results.values()
+    )
+    assert spooled_reports(spool_dir) == []
+    assert len(local_server.requests) == 12
+    assert all(
+        'token=secret' in path and 'flags=unit' in path
+        for method, path, _ in local_server.requests
+        if path.startswith('/upload/v4')
+    )
+    # the connections are shared between all the uploads
+    assert local_server.connections <= 6
+
+
+def test_drain_partial_failure(
+    dummy_cov: DummyCoverage,
+    local_server: LocalServer,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path
+) -> None:
+
+    junit_xml = tmp_path / 'junit.xml'
+    junit_xml.write_text('foo')
+    spool_dir = str(tmp_path / 'spool')
+    uploader = make_uploader(dummy_cov, junit_xml)
+    path = spool_report(uploader, spool_dir)
+    uploader.close()
+
+    monkeypatch.setattr(CodecovUploader, 'api_endpoint', local_server.url)
+    monkeypatch.setattr(
+        CodecovUploader,
+        'storage_endpoint',
+        f'{local_server.url}/storage/'
+    )
+    local_server.failures['/storage/test_results'] = 1
+    results = drain(spool_dir, retry_policy=RetryPolicy(attempts=1))
+    assert results[path]['coverage'] is None
+    assert 'Failed to upload test results' in str(
+        results[path]['test results']
+    )
+
+    # only the part that failed remains to be retried
+    assert spooled_reports(spool_dir) == [path]
+    assert sorted(os.listdir(path)) == ['metadata.json', 'test_results.json']
+
+    local_server.requests.clear()
+    results = drain(spool_dir)
+    assert results == {path: {'test results': None}}
+    assert [method for method, _, _ in local_server.requests] == [
+        'POST',
+        'PUT'
+    ]
+    assert spooled_reports(spool_dir) == []
+
+
+def test_drain_corrupt_entry(
+    dummy_cov: DummyCoverage,
+    local_server: LocalServer,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+    tmp_path: Path
+) -> None:
+
+    spool_dir = str(tmp_path / 'spool')
+    uploader = make_uploader(dummy_cov)
+    good = spool_report(uploader, spool_dir)
+    bad = spool_report(uploader, spool_dir)
+    uploader.close()
+    with open(os.path.join(bad, 'metadata.json'), 'w') as fp:
+        fp.write('{"slug": ')
+
+    monkeypatch.setattr(CodecovUploader, 'api_endpoint', local_server.url)
+    monkeypatch.setattr(
+        CodecovUploader,
+        'storage_endpoint',
+        f'{local_server.url}/storage/'
+    )
+    # the corrupt entry doesn't keep the other one from being uploaded
+    assert main([spool_dir]) == 1
+    out = capsys.readouterr().out
+    assert f'{os.path.basename(good)}: Uploaded coverage.' in out
+    assert (
+        f'{os.path.basename(bad)}: ERROR: Failed to upload spooled report: '
+        'JSONDecodeError('
+    ) in out
+    assert 'Drained 2 spooled report(s).' in out
+    assert spooled_reports(spool_dir) == [bad]
+
+
+def test_main(
+    dummy_cov: DummyCoverage,
+    local_server: LocalServer,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+    tmp_path: Path
+) -> None:
+
+    spool_dir = str(tmp_path / 'spool')
+    assert main([spool_dir]) == 0
+    assert 'Drained 0 spooled report(s).' in capsys.readouterr().out
+
+    uploader = make_uploader(dummy_cov)
+    path = spool_report(uploader, spool_dir)
+    uploader.close()
+
+    monkeypatch.setattr(CodecovUploader, 'api_endpoint', local_server.url)
+    monkeypatch.setattr(
+        CodecovUploader,
+        'storage_endpoint',
+        f'{local_server.url}/storage/'
+    )
+    local_server.failures['/storage/coverage'] = 1
+    assert main([spool_dir, '--retries=0']) == 1
+    name = os.path.basename(path)
+    assert (
+        f'{name}: ERROR: Failed to upload report to storage endpoint.'
+    ) in capsys.readouterr().out
+
+    assert main([spool_dir, '--retries=0']) == 0
+    assert f'{name}: Uploaded coverage.' in capsys.readouterr().out
+    assert spooled_reports(spool_dir) == []